@@ -1,9 +1,39 @@
-from flask import jsonify, request
-import requests
+from flask import jsonify, request, url_for, Response, stream_with_context, has_request_context
 import os
 import json
+import copy
+import time
+import hmac
+import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from . import api
+from .. import mongo
 from flask_jwt_extended import jwt_required, get_jwt_identity
+from ..utils.ai_client import AIClient, AIClientError, AIEndpoint, CircuitBreaker
+from ..utils.ai_logging import AICallLogger, install_redaction
+from ..utils.trip_cache import TripPlanCache
+from ..utils.job_runner import BoundedJobExecutor
+from ..utils.json_stream import IncrementalDaysParser
+from ..utils.gazetteer import Gazetteer
+from ..utils.geocoder import Geocoder, parse_coordinates
+from ..utils.json_extract import JSONExtractionStats, STRATEGY_REPAIRED
+from ..utils.canned_answers import CannedAnswerStore, content_hash
+from ..utils.single_flight import SingleFlight, make_flight_key
+from ..utils.itinerary_analysis import attach_analysis, strip_analysis
+from ..utils.prompt_builder import PromptTemplate
+from ..utils.template_index import TemplateIndex
+from ..utils.usage_meter import UsageMeter, PERIODS, PERIOD_HOUR, PERIOD_DAY
+from ..utils.admission import AdmissionController, AdmissionRejected, PRIORITY_HIGH, PRIORITY_LOW
+from ..utils.chat_context import (
+    normalize_history, build_context_messages, unsummarized_turns, plan_summarization
+)
+from ..utils.trip_patch import (
+    select_target_days, build_plan_outline, selected_days_payload, apply_trip_patch, to_prompt_json,
+    PatchScopeError, PATCHABLE_FIELDS,
+)
+from ..models import TripPlan, UserTrip
+from ..models.ai_job import AIJob
+from ..models.conversation import Conversation
 import logging
 
 # 日志配置
@@ -24,8 +54,168 @@ if not BACKUP_API_KEY:
     logger.warning("⚠️ BACKUP_API_KEY未设置，将使用DeepSeek API密钥")
 
 # 正确的模型名称
-PRIMARY_MODEL = 'deepseek-chat'  # 正确的DeepSeek模型名称
-BACKUP_MODEL = 'deepseek-chat'    # 备用模型也使用DeepSeek
+PRIMARY_MODEL = os.environ.get('PRIMARY_MODEL', 'deepseek-chat').strip()  # 正确的DeepSeek模型名称
+BACKUP_MODEL = os.environ.get('BACKUP_MODEL', 'deepseek-chat').strip()    # 备用模型默认也使用DeepSeek
+
+# 上游调用参数: 连接/读取超时、重试退避、熔断和对冲请求
+AI_CONNECT_TIMEOUT = float(os.environ.get('AI_CONNECT_TIMEOUT', 5))
+AI_READ_TIMEOUT = float(os.environ.get('AI_READ_TIMEOUT', 60))
+AI_MAX_RETRIES = int(os.environ.get('AI_MAX_RETRIES', 2))
+AI_BACKOFF_BASE = float(os.environ.get('AI_BACKOFF_BASE', 0.5))
+AI_BACKOFF_MAX = float(os.environ.get('AI_BACKOFF_MAX', 8))
+AI_POOL_SIZE = int(os.environ.get('AI_POOL_SIZE', 20))
+AI_BREAKER_THRESHOLD = int(os.environ.get('AI_BREAKER_THRESHOLD', 5))
+AI_BREAKER_RESET = float(os.environ.get('AI_BREAKER_RESET', 30))
+AI_HEDGE_DELAY = float(os.environ.get('AI_HEDGE_DELAY', 0))  # 0 表示不启用对冲请求
+
+# AI调用日志: 每次上游调用一条摘要；请求/响应体按比例抽样输出，且延迟序列化并脱敏
+AI_LOG_BODY_SAMPLE_RATE = float(os.environ.get('AI_LOG_BODY_SAMPLE_RATE', 0))
+AI_LOG_BODY_MAX_CHARS = int(os.environ.get('AI_LOG_BODY_MAX_CHARS', 2000))
+AI_LOG_REDACT_FIELDS = [f.strip() for f in os.environ.get('AI_LOG_REDACT_FIELDS', '').split(',') if f.strip()]
+
+ai_call_logger = AICallLogger(
+    body_sample_rate=AI_LOG_BODY_SAMPLE_RATE,
+    body_max_chars=AI_LOG_BODY_MAX_CHARS,
+    redact_fields=AI_LOG_REDACT_FIELDS,
+)
+install_redaction(__name__, 'app.utils.ai_client', ai_call_logger.logger.name)
+
+# 全局共享的AI客户端 (连接池在所有请求间复用)
+ai_client = AIClient(
+    primary=AIEndpoint('primary', DEEPSEEK_API_URL, DEEPSEEK_API_KEY, PRIMARY_MODEL,
+                       CircuitBreaker(AI_BREAKER_THRESHOLD, AI_BREAKER_RESET)),
+    backup=AIEndpoint('backup', BACKUP_API_URL, BACKUP_API_KEY, BACKUP_MODEL,
+                      CircuitBreaker(AI_BREAKER_THRESHOLD, AI_BREAKER_RESET)),
+    connect_timeout=AI_CONNECT_TIMEOUT,
+    read_timeout=AI_READ_TIMEOUT,
+    max_retries=AI_MAX_RETRIES,
+    backoff_base=AI_BACKOFF_BASE,
+    backoff_max=AI_BACKOFF_MAX,
+    pool_size=AI_POOL_SIZE,
+    hedge_delay=AI_HEDGE_DELAY,
+    call_logger=ai_call_logger,
+)
+
+# 行程生成结果缓存: 进程内LRU + MongoDB共享
+AI_TRIP_CACHE_SIZE = int(os.environ.get('AI_TRIP_CACHE_SIZE', 256))
+AI_TRIP_CACHE_TTL = int(os.environ.get('AI_TRIP_CACHE_TTL', 86400))
+AI_TRIP_CACHE_SERVE_NEAREST = os.environ.get('AI_TRIP_CACHE_SERVE_NEAREST', 'false').lower() == 'true'
+
+trip_cache = TripPlanCache(
+    mongo,
+    max_entries=AI_TRIP_CACHE_SIZE,
+    ttl=AI_TRIP_CACHE_TTL,
+    serve_nearest=AI_TRIP_CACHE_SERVE_NEAREST,
+)
+
+# 异步任务执行器: 慢速的行程生成/修改在后台线程中执行，不占用请求线程
+AI_JOB_WORKERS = int(os.environ.get('AI_JOB_WORKERS', 4))
+AI_JOB_MAX_PENDING = int(os.environ.get('AI_JOB_MAX_PENDING', 32))
+AI_JOB_RETRY_AFTER = 5  # 队列满时建议客户端重试的间隔(秒)
+
+ai_job_executor = BoundedJobExecutor(max_workers=AI_JOB_WORKERS, max_pending=AI_JOB_MAX_PENDING)
+
+# 上游准入控制: 并发上限和速率与上游配额一致，登录用户优先，排队超时返回503
+AI_ADMISSION_MAX_CONCURRENCY = max(1, int(os.environ.get('AI_ADMISSION_MAX_CONCURRENCY', 16)))
+AI_ADMISSION_RATE = float(os.environ.get('AI_ADMISSION_RATE', 0))  # 每秒最多发起的上游调用数，0 表示不限
+AI_ADMISSION_BURST = float(os.environ.get('AI_ADMISSION_BURST', 0)) or None  # 令牌桶容量，默认等于速率
+AI_ADMISSION_QUEUE_TIMEOUT = float(os.environ.get('AI_ADMISSION_QUEUE_TIMEOUT', 10))  # 登录用户最长排队时间(秒)
+AI_ADMISSION_ANON_QUEUE_TIMEOUT = float(os.environ.get('AI_ADMISSION_ANON_QUEUE_TIMEOUT', 3))  # 匿名用户和后台任务
+AI_ADMISSION_MAX_QUEUE = int(os.environ.get('AI_ADMISSION_MAX_QUEUE', 64))  # 每个优先级的最大排队数
+
+ai_admission = AdmissionController(
+    max_concurrency=AI_ADMISSION_MAX_CONCURRENCY,
+    rate=AI_ADMISSION_RATE,
+    burst=AI_ADMISSION_BURST,
+    queue_timeouts={PRIORITY_HIGH: AI_ADMISSION_QUEUE_TIMEOUT, PRIORITY_LOW: AI_ADMISSION_ANON_QUEUE_TIMEOUT},
+    max_queue=AI_ADMISSION_MAX_QUEUE,
+)
+
+# 合并相同的进行中请求: 同时到达的相同行程请求只调用一次上游，其余请求共享结果
+AI_SINGLE_FLIGHT_ENABLED = os.environ.get('AI_SINGLE_FLIGHT', 'true').lower() == 'true'
+AI_SINGLE_FLIGHT_SHARED = os.environ.get('AI_SINGLE_FLIGHT_SHARED', 'false').lower() == 'true'  # 通过MongoDB租约在worker之间合并
+AI_SINGLE_FLIGHT_WAIT = float(os.environ.get('AI_SINGLE_FLIGHT_WAIT', AI_READ_TIMEOUT * (AI_MAX_RETRIES + 1)))
+
+single_flight = SingleFlight(
+    mongo if AI_SINGLE_FLIGHT_SHARED else None,
+    wait_timeout=AI_SINGLE_FLIGHT_WAIT
+)
+
+# 批量生成行程: 每个批次使用独立的有界线程池，上游调用仍受准入控制的并发和速率限制
+AI_BATCH_MAX_ITEMS = int(os.environ.get('AI_BATCH_MAX_ITEMS', 500))
+AI_BATCH_CONCURRENCY = int(os.environ.get('AI_BATCH_CONCURRENCY', 8))
+AI_BATCH_QUEUE_TIMEOUT = float(os.environ.get('AI_BATCH_QUEUE_TIMEOUT', 120))  # 批量任务在准入队列中的最长等待(秒)
+
+# AI调用计量: 按用户和路由记录token用量和耗时，缓冲后批量写入MongoDB，并预先汇总为小时/天统计
+AI_USAGE_METERING = os.environ.get('AI_USAGE_METERING', 'true').lower() == 'true'
+AI_USAGE_FLUSH_INTERVAL = float(os.environ.get('AI_USAGE_FLUSH_INTERVAL', 10))  # 后台批量写入的间隔(秒)
+AI_USAGE_FLUSH_SIZE = int(os.environ.get('AI_USAGE_FLUSH_SIZE', 200))  # 缓冲达到该条数时立即写入
+AI_USAGE_RETENTION_DAYS = int(os.environ.get('AI_USAGE_RETENTION_DAYS', 30))  # 调用明细保留天数，汇总不过期
+AI_ADMIN_TOKEN = os.environ.get('AI_ADMIN_TOKEN', '')  # 管理接口的访问令牌，为空时不开放管理接口
+
+usage_meter = UsageMeter(
+    mongo,
+    flush_interval=AI_USAGE_FLUSH_INTERVAL,
+    flush_size=AI_USAGE_FLUSH_SIZE,
+    retention_days=AI_USAGE_RETENTION_DAYS,
+)
+
+# 服务端会话: 发送给模型的历史消息不超过该token预算，更早的消息滚动压缩为摘要
+AI_CHAT_CONTEXT_TOKENS = int(os.environ.get('AI_CHAT_CONTEXT_TOKENS', 3000))
+AI_CHAT_KEEP_TURNS = int(os.environ.get('AI_CHAT_KEEP_TURNS', 6))  # 压缩时保留原文的最近消息条数
+
+# 模型输出JSON提取的策略统计
+json_extraction_stats = JSONExtractionStats()
+
+# 地名/标签词典: 启动时加载一次，编译为多模式匹配自动机
+AI_GAZETTEER_PATH = os.environ.get('AI_GAZETTEER_PATH') or None
+gazetteer = Gazetteer.load(AI_GAZETTEER_PATH)
+
+# 离线地理编码: 复用地名词典中的坐标，生成行程后由服务端填充活动坐标，不再要求模型输出
+AI_GEOCODER_ENABLED = os.environ.get('AI_GEOCODER', 'true').lower() == 'true'
+AI_GEOCODER_COORD_TYPE = os.environ.get('AI_GEOCODER_COORD_TYPE', 'bd09ll').lower()  # wgs84 / gcj02 / bd09ll
+AI_GEOCODER_MAX_DISTANCE_KM = float(os.environ.get('AI_GEOCODER_MAX_DISTANCE_KM', 300))
+geocoder = Geocoder.from_gazetteer(
+    gazetteer,
+    coord_type=AI_GEOCODER_COORD_TYPE,
+    max_distance_km=AI_GEOCODER_MAX_DISTANCE_KM,
+)
+
+# 已发布行程模板: 按目的地、天数和标签匹配方案市场中的真实行程，上游失败或无法解析时代替占位的默认行程；
+# 开启快速路径后，匹配度足够高的请求直接返回模板，不调用上游
+AI_TEMPLATES_ENABLED = os.environ.get('AI_TEMPLATES', 'true').lower() == 'true'
+AI_TEMPLATE_FAST_PATH = os.environ.get('AI_TEMPLATE_FAST_PATH', 'false').lower() == 'true'
+AI_TEMPLATE_MIN_SCORE = float(os.environ.get('AI_TEMPLATE_MIN_SCORE', 0.75))  # 快速路径要求的最低匹配分(0~1)
+AI_TEMPLATE_REFRESH_INTERVAL = int(os.environ.get('AI_TEMPLATE_REFRESH_INTERVAL', 300))
+AI_TEMPLATE_MAX = int(os.environ.get('AI_TEMPLATE_MAX', 5000))  # 索引中最多加载的模板数
+
+template_index = TemplateIndex(
+    mongo,
+    UserTrip.COLLECTION,
+    TripPlan.COLLECTION,
+    resolve_destination=lambda text: template_destination(text),
+    resolve_tags=lambda tags: template_tags(tags),
+    refresh_interval=AI_TEMPLATE_REFRESH_INTERVAL,
+    max_templates=AI_TEMPLATE_MAX,
+)
+
+# 提示词中没有识别到对应信息时使用的默认值
+DEFAULT_DESTINATION = "北京"
+DEFAULT_TRIP_DAYS = 3
+DEFAULT_TRIP_TAGS = ("休闲", "美食")
+
+# 聊天建议选项 (chip)
+TRAVEL_SUGGESTIONS = ["帮我规划详细行程", "有什么美食推荐？", "当地有什么特色景点？"]
+BEIJING_SUGGESTIONS = ["北京长城怎么去？", "北京有什么美食？", "故宫一日游攻略"]
+SHANGHAI_SUGGESTIONS = ["上海迪士尼攻略", "上海外滩附近住宿", "上海必吃美食"]
+PLAN_FOLLOW_UP_SUGGESTIONS = ["这个行程可以再详细点吗？", "有什么特别推荐的景点？", "如何安排交通？"]
+DEFAULT_SUGGESTIONS = ["推荐热门旅游目的地", "国内旅游路线", "亲子游推荐"]
+FALLBACK_SUGGESTIONS = ["推荐热门旅游目的地", "国内旅游", "出国旅游"]
+
+# 不依赖上文的建议选项，回答可以预先生成 (追问类选项的回答取决于之前的对话，不在此列)
+CANNED_CHIP_PROMPTS = list(dict.fromkeys(
+    BEIJING_SUGGESTIONS + SHANGHAI_SUGGESTIONS + DEFAULT_SUGGESTIONS + FALLBACK_SUGGESTIONS
+))
 
 # 旅游系统提示词
 TRAVEL_SYSTEM_PROMPT = '''
@@ -47,114 +237,22 @@ TRAVEL_SYSTEM_PROMPT = '''
 - 合理的预算分配建议
 '''
 
-@api.route('/ai/chat', methods=['POST'])
-@jwt_required(optional=True)
-def ai_chat():
-    """AI聊天接口"""
-    try:
-        data = request.json
-        if not data or 'message' not in data:
-            return jsonify({'error': '无效的请求数据'}), 400
-        
-        user_message = data['message']
-        history = data.get('history', [])
-        
-        # 确保历史记录格式正确
-        formatted_history = []
-        for msg in history:
-            if 'role' in msg and 'content' in msg:
-                # 已经是正确格式
-                formatted_history.append(msg)
-            elif 'isUserMessage' in msg and 'content' in msg:
-                # 需要转换格式
-                role = 'user' if msg['isUserMessage'] else 'assistant'
-                formatted_history.append({'role': role, 'content': msg['content']})
-            elif 'isUserMessage' in msg and 'text' in msg:
-                # 需要转换格式 - 使用text字段
-                role = 'user' if msg['isUserMessage'] else 'assistant'
-                formatted_history.append({'role': role, 'content': msg['text']})
-        
-        # 添加系统提示和当前用户消息
-        messages = [
-            {'role': 'system', 'content': TRAVEL_SYSTEM_PROMPT},
-            *formatted_history,
-            {'role': 'user', 'content': user_message},
-        ]
-        
-        # 记录完整请求消息
-        logger.info(f"AI聊天请求消息: {json.dumps(messages, ensure_ascii=False)}")
-        
-        # 尝试调用主API
-        try:
-            logger.info("调用Deepseek API进行聊天")
-            response = call_api(
-                api_url=DEEPSEEK_API_URL,
-                api_key=DEEPSEEK_API_KEY,
-                model=PRIMARY_MODEL,
-                messages=messages
-            )
-            content = response['choices'][0]['message']['content']
-            
-            # 生成建议回复选项
-            suggestions = generate_chat_suggestions(user_message, content)
-            
-            return jsonify({
-                'content': content,
-                'suggestions': suggestions,
-            })
-            
-        except Exception as e:
-            logger.error(f"Deepseek API调用失败: {str(e)}")
-            return jsonify({
-                'content': '抱歉，我暂时无法连接到AI服务。请问有什么其他旅游相关的问题我可以帮您解决吗？',
-                'suggestions': ['推荐热门旅游目的地', '国内旅游', '出国旅游'],
-                'error': str(e)
-            })
-    
-    except Exception as e:
-        logger.error(f"AI聊天接口错误: {str(e)}")
-        return jsonify({'error': f'处理请求时出错: {str(e)}'}), 500
-
+# 会话摘要提示词
+CONVERSATION_SUMMARY_PROMPT = '''
+你负责压缩旅游助理"途乐乐"与用户的对话记录。请把已有摘要和新增对话合并为一份新的摘要：
+1. 保留用户的目的地、出行日期、天数、预算、同行人、偏好和禁忌
+2. 保留已经确定的行程安排和用户明确否定过的方案
+3. 省略寒暄和重复内容，使用第三人称，不超过300字
+只输出摘要正文。
+'''
 
-@api.route('/ai/generate-trip', methods=['POST'])
-@jwt_required(optional=True)
-def generate_trip_plan():
-    """生成AI旅游行程规划"""
-    try:
-        data = request.json
-        if not data or 'prompt' not in data:
-            return jsonify({'error': '无效的请求数据'}), 400
-        
-        prompt = data['prompt']
-        history = data.get('history', [])
-        
-        # 确保历史记录格式正确
-        formatted_history = []
-        for msg in history:
-            if 'role' in msg and 'content' in msg:
-                # 已经是正确格式
-                formatted_history.append(msg)
-            elif 'isUserMessage' in msg and 'content' in msg:
-                # 需要转换格式
-                role = 'user' if msg['isUserMessage'] else 'assistant'
-                formatted_history.append({'role': role, 'content': msg['content']})
-            elif 'isUserMessage' in msg and 'text' in msg:
-                # 需要转换格式 - 使用text字段
-                role = 'user' if msg['isUserMessage'] else 'assistant'
-                formatted_history.append({'role': role, 'content': msg['text']})
-        
-        # 解析目的地和天数
-        destination = extract_destination(prompt)
-        days = extract_days(prompt)
-        tags = extract_tags(prompt)
-        
-        # 构建行程生成提示词
-        planning_prompt = f'''
-请为用户生成一个详细且具体的{destination}{' '+str(days)+'天' if days > 0 else ''}行程规划。请确保包含真实景点、餐厅和活动。
+# 行程生成/修改的提示词模板: 固定的说明在前、本次请求的数据在后，使上游能命中缓存的前缀
+TRIP_PLAN_TEMPLATE = PromptTemplate(TRAVEL_SYSTEM_PROMPT, '''
+请根据本次请求中的目的地、天数、标签和用户原始请求，生成一个详细且具体的行程规划。请确保包含真实景点、餐厅和活动。
 
 行程必须符合以下格式要求：
-1. 行程名称必须具体明确，例如"{destination}{' '+str(days)+'天' if days > 0 else ''} {tags[0] if tags else ''}之旅"
-2. 目的地必须是"{destination}"
+1. 行程名称必须具体明确，由目的地、天数和主要标签组成，例如"成都3天 美食之旅"
+2. 目的地必须与本次请求中的目的地完全一致
 3. 每天必须有明确的主题，例如"文化探索"或"美食品尝"等
 4. 每个活动必须有具体时间（例如"09:00"）、详细描述和实际存在的地点名称
 5. 每天安排2-5个活动，合理分配在上午、下午和晚上
@@ -163,28 +261,24 @@ def generate_trip_plan():
 请严格按照以下JSON格式返回数据，确保字段名与格式完全匹配，不要省略任何字段：
 
 ```json
-{{
+{
   "name": "行程名称（具体明确）",
-  "destination": "{destination}",
+  "destination": "目的地",
   "tags": ["标签1", "标签2"],
   "description": "整个行程的详细描述",
   "days": [
-    {{
+    {
       "dayNumber": 1,
       "title": "第一天主题（具体）",
       "description": "当天活动的整体描述",
       "date": "YYYY-MM-DD",
       "activities": [
-        {{
+        {
           "id": "act1_1",
           "title": "活动标题（必填）",
           "description": "详细活动描述（必填）",
           "location": "具体地点名称（必填）",
           "address": "详细地址",
-          "coordinates":{{
-              "latitude": "该活动对应地点的纬度",
-              "longitude": "该活动对应地点的经度"
-          }},
           "startTime": "09:00",
           "endTime": "11:00",
           "transportation": "步行/公交/地铁/出租车",
@@ -194,12 +288,12 @@ def generate_trip_plan():
           "bookingInfo": "预订信息",
           "note": "活动备注信息",
           "icon": "景点"
-        }}
+        }
       ],
       "notes": "当天建议和提示"
-    }}
+    }
   ]
-}}
+}
 ```
 
 请务必遵循以下规则：
@@ -208,270 +302,1180 @@ def generate_trip_plan():
 3. 每个活动的startTime和endTime必须填写，格式为"HH:MM"
 4. 每个活动的estimatedCost必须是数字，不要包含货币符号
 5. 所有文本内容必须是中文
-6. 行程天数必须与用户要求匹配，或默认为3天
+6. 行程天数必须与本次请求匹配
 7. 不要添加任何额外的字段或改变字段名称
+''', '''
+本次请求：
+- 目的地必须是"{destination}"
+- 生成{days}天行程规划
+- 标签：{tags}
+- 用户原始请求：{prompt}
+''')
 
-用户原始请求: {prompt}
-'''
+TRIP_MODIFY_TEMPLATE = PromptTemplate(TRAVEL_SYSTEM_PROMPT, '''
+请根据用户的修改要求，对下面给出的旅游行程进行修改。
+
+请遵循以下原则：
+1. 保留行程的基本结构，仅按照用户要求进行修改
+2. 确保修改后的行程仍然合理可行
+3. 返回完整修改后的行程，格式与输入格式保持一致
+4. 确保每个活动都有具体时间、详细描述和地点
+
+请直接返回修改后的完整JSON格式行程，无需额外解释。
+''', '''
+当前行程：
+{current_plan}
+
+用户修改要求：
+{prompt}
+''')
+
+TRIP_PATCH_TEMPLATE = PromptTemplate(TRAVEL_SYSTEM_PROMPT, '''
+请根据用户的要求修改旅游行程。为节省篇幅，只提供了需要修改的天数的完整数据，其余天数只提供概要。
+
+请只返回补丁，不要返回完整行程。补丁必须严格使用以下JSON格式：
+
+```json
+{
+  "operations": [
+    {"op": "replace_day", "dayNumber": 2, "day": {完整的一天数据，字段与输入保持一致}},
+    {"op": "add_day", "dayNumber": 4, "day": {新增的一天数据}},
+    {"op": "remove_day", "dayNumber": 3},
+    {"op": "set", "field": "name", "value": "新的行程名称"}
+  ]
+}
+```
+
+请遵循以下原则：
+1. 只为确实需要变动的天数生成操作，未变动的天数不要出现在补丁中
+2. dayNumber 指修改前的天数；add_day 的 dayNumber 为新一天插入后的位置
+3. set 只能修改 name、description、tags、destination、notes 字段
+4. 确保修改后的行程仍然合理可行，每个活动都有具体时间、详细描述和地点
+
+请直接返回补丁JSON，无需额外解释。
+''', '''
+行程概要：
+{outline}
+
+需要修改的天数（完整数据）：
+{affected_days}
+
+用户修改要求：
+{prompt}
+''')
+
+# 建议选项的预生成回答: 后台定期生成并保存到 aiCannedAnswers 集合，无上文时直接返回
+AI_CANNED_ANSWERS_ENABLED = os.environ.get('AI_CANNED_ANSWERS', 'true').lower() == 'true'
+AI_CANNED_CHECK_INTERVAL = int(os.environ.get('AI_CANNED_CHECK_INTERVAL', 300))
+AI_CANNED_MAX_AGE = int(os.environ.get('AI_CANNED_MAX_AGE', 86400))
+AI_CANNED_REFRESH_BATCH = int(os.environ.get('AI_CANNED_REFRESH_BATCH', 4))
+
+canned_answers = CannedAnswerStore(
+    mongo,
+    CANNED_CHIP_PROMPTS,
+    generate_fn=lambda prompt: generate_canned_answer(prompt),
+    fingerprint=content_hash(f"{PRIMARY_MODEL}\n{TRAVEL_SYSTEM_PROMPT}"),
+    check_interval=AI_CANNED_CHECK_INTERVAL,
+    max_age=AI_CANNED_MAX_AGE,
+    refresh_batch=AI_CANNED_REFRESH_BATCH,
+)
+
+@api.errorhandler(AdmissionRejected)
+def handle_admission_rejected(e):
+    """上游调用排队已满或超时: 返回503和建议的重试间隔"""
+    logger.warning(f"AI请求未获准入({e.priority}, {e.reason})")
+    response = jsonify({'error': 'AI服务繁忙，请稍后重试', 'retry_after': e.retry_after})
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response, 503
+
+
+@api.route('/ai/chat', methods=['POST'])
+@jwt_required(optional=True)
+def ai_chat():
+    """AI聊天接口"""
+    try:
+        data = request.json
+        if not data or 'message' not in data:
+            return jsonify({'error': '无效的请求数据'}), 400
         
-        messages = [
-            {'role': 'system', 'content': TRAVEL_SYSTEM_PROMPT},
-            {'role': 'user', 'content': planning_prompt},
-        ]
+        user_message = data['message']
+        
+        # 携带 session_id 时使用服务端保存的会话，否则使用客户端传来的 history
+        conversation, error_response = load_conversation(data)
+        if error_response:
+            return error_response
+        session_id = conversation['_id'] if conversation else None
+        
+        # 没有上文的建议选项直接返回预生成的回答，不调用上游
+        canned = lookup_canned_answer(user_message, conversation, data.get('history', []))
+        if canned is not None:
+            logger.info(f"AI聊天请求命中预生成回答，会话: {session_id or '无'}")
+            return canned_chat_response(user_message, canned, session_id, data.get('stream'))
         
-        # 记录完整请求消息
-        logger.info(f"生成行程请求消息: {json.dumps(messages, ensure_ascii=False)}")
+        # 添加系统提示、预算内的历史消息和当前用户消息
+        messages = build_chat_messages(user_message, conversation, data.get('history', []))
         
+        logger.info(f"AI聊天请求: {len(messages)}条消息，会话: {session_id or '无'}")
+        
+        # 流式模式：以SSE形式逐段转发模型输出
+        if data.get('stream'):
+            return stream_chat_response(user_message, messages, session_id)
+        
+        # 尝试调用主API
         try:
-            # 调用主API生成行程
-            logger.info("调用Deepseek API生成行程")
-            response = call_api(
-                api_url=DEEPSEEK_API_URL,
-                api_key=DEEPSEEK_API_KEY,
-                model=PRIMARY_MODEL,
-                messages=messages,
-                max_tokens=2048
-            )
-            
+            logger.info("调用Deepseek API进行聊天")
+            response = call_api(messages=messages)
             content = response['choices'][0]['message']['content']
-            trip_data = extract_json_from_content(content)
             
-            if trip_data:
-                logger.info("成功生成行程数据")
-                return jsonify(trip_data)
-            else:
-                logger.error("无法从API响应中提取有效JSON")
-                # 生成默认行程作为备用
-                default_trip = generate_default_trip(destination, days, tags)
-                logger.info("返回默认行程")
-                return jsonify(default_trip)
-                
+            # 生成建议回复选项
+            suggestions = generate_chat_suggestions(user_message, content)
+            record_conversation_turns(session_id, user_message, content)
+            
+            result = {
+                'content': content,
+                'suggestions': suggestions,
+            }
+            if session_id:
+                result['session_id'] = session_id
+            return jsonify(result)
+            
+        except AdmissionRejected:
+            raise
         except Exception as e:
-            logger.error(f"主API生成行程失败: {str(e)}")
+            logger.error(f"Deepseek API调用失败: {str(e)}")
             return jsonify({
-                'error': '抱歉，我暂时无法生成行程规划。请问有什么其他旅游相关的问题我可以帮您解决吗？',
-                'suggestions': ['推荐热门旅游目的地', '国内旅游', '出国旅游'],
+                'content': '抱歉，我暂时无法连接到AI服务。请问有什么其他旅游相关的问题我可以帮您解决吗？',
+                'suggestions': FALLBACK_SUGGESTIONS,
                 'error': str(e)
-            }), 400
+            })
     
+    except AdmissionRejected:
+        raise
     except Exception as e:
-        logger.error(f"生成行程接口错误: {str(e)}")
+        logger.error(f"AI聊天接口错误: {str(e)}")
         return jsonify({'error': f'处理请求时出错: {str(e)}'}), 500
 
 
-@api.route('/ai/modify-trip', methods=['POST'])
+def stream_chat_response(user_message, messages, session_id=None):
+    """以SSE流的形式返回AI聊天回复
+
+    事件依次为: 若干个 delta (增量文本)，最后一个 done (完整内容和建议选项，
+    会话模式下还包含 session_id)；出错时发送 error 事件，内容与非流式接口的兜底回复一致。
+    准入名额在返回响应前申请，排队失败时直接返回503。
+    """
+    ticket = ai_admission.acquire(request_priority())
+    
+    def generate():
+        chunks = []
+        try:
+            logger.info("调用Deepseek API进行流式聊天")
+            for delta in call_api_stream(messages=messages, ticket=ticket):
+                chunks.append(delta)
+                yield sse_event('delta', {'content': delta})
+            
+            content = ''.join(chunks)
+            record_conversation_turns(session_id, user_message, content)
+            done = {
+                'content': content,
+                'suggestions': generate_chat_suggestions(user_message, content),
+            }
+            if session_id:
+                done['session_id'] = session_id
+            yield sse_event('done', done)
+        except Exception as e:
+            logger.error(f"Deepseek API流式调用失败: {str(e)}")
+            yield sse_event('error', {
+                'content': '抱歉，我暂时无法连接到AI服务。请问有什么其他旅游相关的问题我可以帮您解决吗？',
+                'suggestions': FALLBACK_SUGGESTIONS,
+                'error': str(e)
+            })
+    
+    return sse_response(generate(), ticket)
+
+
+def canned_chat_response(user_message, content, session_id, stream=False):
+    """返回预生成的聊天回复，格式与正常回复一致 (流式模式下为一条 delta 和 done 事件)"""
+    record_conversation_turns(session_id, user_message, content)
+    result = {
+        'content': content,
+        'suggestions': generate_chat_suggestions(user_message, content),
+    }
+    if session_id:
+        result['session_id'] = session_id
+    if not stream:
+        return jsonify(result)
+    return sse_response(iter([sse_event('delta', {'content': content}), sse_event('done', result)]))
+
+
+@api.route('/ai/generate-trip', methods=['POST'])
 @jwt_required(optional=True)
-def modify_trip_plan():
-    """修改AI旅游行程规划"""
+def generate_trip_plan():
+    """生成AI旅游行程规划"""
     try:
         data = request.json
-        if not data or 'prompt' not in data or 'currentPlan' not in data:
+        if not data or 'prompt' not in data:
             return jsonify({'error': '无效的请求数据'}), 400
         
-        prompt = data['prompt']
-        current_plan = data['currentPlan']
-        history = data.get('history', [])
+        data, error_response = attach_conversation(data)
+        if error_response:
+            return error_response
         
-        # 确保历史记录格式正确
-        formatted_history = []
-        for msg in history:
-            if 'role' in msg and 'content' in msg:
-                # 已经是正确格式
-                formatted_history.append(msg)
-            elif 'isUserMessage' in msg and 'content' in msg:
-                # 需要转换格式
-                role = 'user' if msg['isUserMessage'] else 'assistant'
-                formatted_history.append({'role': role, 'content': msg['content']})
-            elif 'isUserMessage' in msg and 'text' in msg:
-                # 需要转换格式 - 使用text字段
-                role = 'user' if msg['isUserMessage'] else 'assistant'
-                formatted_history.append({'role': role, 'content': msg['text']})
+        # 流式模式：每生成完一天就以SSE事件推送给客户端
+        if data.get('stream'):
+            return stream_generate_trip_response(data)
         
-        # 将当前行程转换为JSON字符串
-        current_plan_str = json.dumps(current_plan, ensure_ascii=False)
+        # 异步模式：入队后立即返回任务ID，由 /ai/jobs/<job_id> 轮询结果
+        if data.get('async'):
+            return submit_ai_job('generate-trip', data, run_generate_trip)
         
-        # 构建修改行程的提示词
-        modification_prompt = f'''
-请根据用户的要求，对以下旅游行程进行修改：
+        result, status_code = run_generate_trip(data)
+        return jsonify(result), status_code
+    
+    except AdmissionRejected:
+        raise
+    except Exception as e:
+        logger.error(f"生成行程接口错误: {str(e)}")
+        return jsonify({'error': f'处理请求时出错: {str(e)}'}), 500
 
-当前行程：
-{current_plan_str}
 
-用户修改要求：
-{prompt}
+def run_generate_trip(data):
+    """执行行程生成，返回 (响应数据, HTTP状态码)；同步接口和异步任务共用"""
+    prompt = data['prompt']
+    session_id = data.get('session_id')
+    
+    # 解析目的地和天数
+    destination, days, tags = extract_intent(prompt)
+    
+    # 命中缓存时直接返回，无需调用上游
+    use_cache = data.get('use_cache', True)
+    intent_key, prompt_hash = trip_cache.make_key(destination, days, tags, prompt)
+    if use_cache:
+        cached_plan = lookup_trip_cache(intent_key, prompt_hash, prompt, destination, days, tags)
+        if cached_plan is not None:
+            record_conversation_turns(session_id, prompt, describe_plan_reply(cached_plan))
+            return with_session(cached_plan, session_id), 200
+    
+    # 快速路径: 有匹配度足够高的已发布行程时直接返回
+    if data.get('use_template', AI_TEMPLATE_FAST_PATH):
+        template_plan = template_trip_plan(destination, days, tags, fast_path=True)
+        if template_plan is not None:
+            record_conversation_turns(session_id, prompt, describe_plan_reply(template_plan))
+            return with_session(template_plan, session_id), 200
+    
+    try:
+        # 调用主API生成行程
+        logger.info("调用Deepseek API生成行程")
+        (trip_data, cacheable), shared = coalesced(
+            'generate-trip', [intent_key, prompt_hash],
+            lambda: request_trip_plan(prompt, destination, days, tags)
+        )
+        
+        if trip_data:
+            logger.info("成功生成行程数据")
+            if cacheable and not shared:
+                trip_cache.set(intent_key, prompt_hash, trip_data)
+            record_conversation_turns(session_id, prompt, describe_plan_reply(trip_data))
+            return with_session(trip_data, session_id), 200
+        else:
+            logger.error("无法从API响应中提取有效JSON")
+            # 优先用已发布的行程模板兜底，没有时生成默认行程
+            default_trip = fallback_trip_plan(destination, days, tags)
+            logger.info("返回备用行程")
+            record_conversation_turns(session_id, prompt, describe_plan_reply(default_trip))
+            return with_session(default_trip, session_id), 200
+            
+    except AdmissionRejected:
+        raise
+    except Exception as e:
+        logger.error(f"主API生成行程失败: {str(e)}")
+        template_plan = template_trip_plan(destination, days, tags)
+        if template_plan is not None:
+            record_conversation_turns(session_id, prompt, describe_plan_reply(template_plan))
+            return with_session(template_plan, session_id), 200
+        return {
+            'error': '抱歉，我暂时无法生成行程规划。请问有什么其他旅游相关的问题我可以帮您解决吗？',
+            'suggestions': FALLBACK_SUGGESTIONS,
+            'error': str(e)
+        }, 400
 
-请遵循以下原则：
-1. 保留行程的基本结构，仅按照用户要求进行修改
-2. 确保修改后的行程仍然合理可行
-3. 返回完整修改后的行程，格式与输入格式保持一致
-4. 确保每个活动都有具体时间、详细描述和地点
 
-请直接返回修改后的完整JSON格式行程，无需额外解释。
-'''
+def stream_generate_trip_response(data):
+    """以SSE流的形式逐天返回生成的行程
+
+    每当模型输出完 days 数组中的一天，就推送一个 day 事件 ({"index": 0, "day": {...}})；
+    全部完成后推送 done 事件 ({"plan": 完整行程})。无法解析时 done 中返回默认行程，
+    上游出错时推送 error 事件，内容与非流式接口的错误响应一致。
+    缓存未命中时才申请准入名额，排队失败时直接返回503。
+    """
+    prompt = data['prompt']
+    session_id = data.get('session_id')
+    destination, days, tags = extract_intent(prompt)
+    use_cache = data.get('use_cache', True)
+    intent_key, prompt_hash = trip_cache.make_key(destination, days, tags, prompt)
+    
+    def done_event(plan):
+        record_conversation_turns(session_id, prompt, describe_plan_reply(plan))
+        payload = {'plan': plan}
+        if session_id:
+            payload['session_id'] = session_id
+        return sse_event('done', payload)
+    
+    cached_plan = None
+    if use_cache:
+        cached_plan = lookup_trip_cache(intent_key, prompt_hash, prompt, destination, days, tags)
+    if cached_plan is None and data.get('use_template', AI_TEMPLATE_FAST_PATH):
+        cached_plan = template_trip_plan(destination, days, tags, fast_path=True)
+    if cached_plan is not None:
+        def replay():
+            for index, day in enumerate(cached_plan.get('days') or []):
+                yield sse_event('day', {'index': index, 'day': day})
+            yield done_event(cached_plan)
+        return sse_response(replay())
+    
+    ticket = ai_admission.acquire(request_priority())
+    
+    def generate():
+        parser = IncrementalDaysParser()
+        try:
+            logger.info("调用Deepseek API流式生成行程")
+            messages = build_trip_messages(prompt, destination, days, tags)
+            for delta in call_api_stream(messages=messages, max_tokens=2048, ticket=ticket):
+                for day in parser.feed(delta):
+                    if AI_GEOCODER_ENABLED:
+                        geocoder.fill_days([day], destination)
+                    yield sse_event('day', {'index': parser.emitted - 1, 'day': day})
+        except Exception as e:
+            logger.error(f"主API流式生成行程失败: {str(e)}")
+            # 尚未推送任何一天时可以整体改用模板
+            template_plan = template_trip_plan(destination, days, tags) if parser.emitted == 0 else None
+            if template_plan is not None:
+                for index, day in enumerate(template_plan['days']):
+                    yield sse_event('day', {'index': index, 'day': day})
+                yield done_event(template_plan)
+                return
+            yield sse_event('error', {
+                'error': str(e),
+                'suggestions': FALLBACK_SUGGESTIONS,
+            })
+            return
         
-        messages = [
-            {'role': 'system', 'content': TRAVEL_SYSTEM_PROMPT},
-            {'role': 'user', 'content': modification_prompt},
-        ]
+        trip_data, strategy = extract_json_from_content(parser.text, expected_keys=('days',))
+        trip_data = finalize_trip_plan(trip_data)
+        if trip_data:
+            logger.info(f"成功流式生成行程数据，共推送{parser.emitted}天")
+            if is_cacheable_plan(trip_data, strategy, days):
+                trip_cache.set(intent_key, prompt_hash, trip_data)
+            yield done_event(trip_data)
+        else:
+            logger.error("无法从API响应中提取有效JSON，返回备用行程")
+            yield done_event(fallback_trip_plan(destination, days, tags))
+    
+    return sse_response(generate(), ticket)
+
+
+@api.route('/ai/modify-trip', methods=['POST'])
+@jwt_required(optional=True)
+def modify_trip_plan():
+    """修改AI旅游行程规划"""
+    try:
+        data = request.json
+        if not data or 'prompt' not in data:
+            return jsonify({'error': '无效的请求数据'}), 400
+        # 补丁模式可以直接修改已保存的行程 (planId)，否则需要提供 currentPlan
+        if 'currentPlan' not in data and not (data.get('mode') == 'patch' and data.get('planId')):
+            return jsonify({'error': '无效的请求数据'}), 400
         
-        # 记录完整请求消息
-        logger.info(f"修改行程请求消息: {json.dumps(messages, ensure_ascii=False)}")
+        data, error_response = attach_conversation(data)
+        if error_response:
+            return error_response
         
-        try:
-            # 调用主API修改行程
-            logger.info("调用Deepseek API修改行程")
-            response = call_api(
-                api_url=DEEPSEEK_API_URL,
-                api_key=DEEPSEEK_API_KEY,
-                model=PRIMARY_MODEL,
-                messages=messages,
-                max_tokens=2048
-            )
-            
-            content = response['choices'][0]['message']['content']
-            modified_plan = extract_json_from_content(content)
-            
-            if modified_plan:
-                logger.info("成功修改行程数据")
-                return jsonify(modified_plan)
-            else:
-                logger.error("无法从API响应中提取有效JSON")
-                return jsonify({
-                    "error": "无法修改行程，请重新尝试或提供更明确的修改指令"
-                }), 400
-                
-        except Exception as e:
-            logger.error(f"主API修改行程失败: {str(e)}")
-            return jsonify({
-                'error': '抱歉，我暂时无法修改行程规划。请问有什么其他旅游相关的问题我可以帮您解决吗？',
-                'suggestions': ['推荐热门旅游目的地', '国内旅游', '出国旅游'],
-                'error': str(e)
-            }), 400
+        # 异步模式：入队后立即返回任务ID，由 /ai/jobs/<job_id> 轮询结果
+        if data.get('async'):
+            return submit_ai_job('modify-trip', data, run_modify_trip)
+        
+        result, status_code = run_modify_trip(data)
+        return jsonify(result), status_code
     
+    except AdmissionRejected:
+        raise
     except Exception as e:
         logger.error(f"修改行程接口错误: {str(e)}")
         return jsonify({'error': f'处理请求时出错: {str(e)}'}), 500
 
 
-# 工具函数
-
-def call_api(api_url, api_key, model, messages, max_tokens=1024, use_extended_params=False):
-    """调用AI API - 仅DeepSeek版本"""
-    if not api_key or api_key.strip() == '':
-        error_msg = f"API密钥未设置或为空，无法调用API: {api_url}"
-        logger.error(error_msg)
-        raise Exception(error_msg)
+def run_modify_trip(data):
+    """执行行程修改，返回 (响应数据, HTTP状态码)；同步接口和异步任务共用"""
+    if data.get('mode') == 'patch':
+        return run_patch_modify_trip(data)
     
-    # 检查消息格式
-    if not messages or not isinstance(messages, list) or len(messages) == 0:
-        error_msg = "消息列表为空或格式错误"
-        logger.error(error_msg)
-        raise Exception(error_msg)
+    prompt = data['prompt']
+    current_plan = data['currentPlan']
+    session_id = data.get('session_id')
     
-    # 检查每条消息的格式
-    for msg in messages:
-        if not isinstance(msg, dict) or 'role' not in msg or 'content' not in msg:
-            error_msg = f"消息格式错误: {msg}"
-            logger.error(error_msg)
-            raise Exception(error_msg)
+    try:
+        modified_plan = request_modified_plan(json.dumps(strip_analysis(current_plan), ensure_ascii=False), prompt)
         
-    headers = {
-        'Content-Type': 'application/json',
-        'Authorization': f'Bearer {api_key}',
-    }
+        if modified_plan:
+            logger.info("成功修改行程数据")
+            record_conversation_turns(session_id, prompt, describe_plan_reply(modified_plan, modified=True))
+            return with_session(modified_plan, session_id), 200
+        else:
+            logger.error("无法从API响应中提取有效JSON")
+            return {
+                "error": "无法修改行程，请重新尝试或提供更明确的修改指令"
+            }, 400
+            
+    except AdmissionRejected:
+        raise
+    except Exception as e:
+        logger.error(f"主API修改行程失败: {str(e)}")
+        return {
+            'error': '抱歉，我暂时无法修改行程规划。请问有什么其他旅游相关的问题我可以帮您解决吗？',
+            'suggestions': FALLBACK_SUGGESTIONS,
+            'error': str(e)
+        }, 400
+
+
+def request_modified_plan(current_plan_json, prompt):
+    """把完整行程发送给模型修改，返回修改后的行程；无法提取有效JSON时返回 None"""
+    messages = TRIP_MODIFY_TEMPLATE.messages(current_plan=current_plan_json, prompt=prompt)
+    # 调用主API修改行程
+    logger.info("调用Deepseek API修改行程")
+    # 修改结果必须完整，截断的行程会丢失天数，不做修复
+    modified_plan, _ = coalesced(
+        'modify-trip', messages,
+        lambda: finalize_trip_plan(request_model_json(messages, expected_keys=('days',), allow_repair=False)[0])
+    )
+    return modified_plan
+
+
+def run_patch_modify_trip(data):
+    """以补丁方式修改行程
+
+    只把指令涉及的天数完整发送给模型，其余天数只发送概要；模型返回补丁，
+    由服务端应用到行程上。提供 planId 时直接修改已保存的 TripPlan。
+    补丁替换或删除了范围外的天数时不应用补丁，改为发送完整行程修改 (响应中 patch 为 null)。
+    """
+    prompt = data['prompt']
+    plan_id = data.get('planId')
     
-    # 基础请求格式 - 只使用DeepSeek API所需的格式
-    payload = {
-        'model': model,
-        'messages': messages,
-        'stream': False  # 明确指定非流式响应
-    }
+    if plan_id:
+        base_plan = TripPlan.get_trip_plan_by_id(mongo, plan_id)
+        if not base_plan:
+            return {'error': '未找到该旅行规划'}, 404
+    else:
+        base_plan = data['currentPlan']
     
-    # 仅在需要更多token时添加max_tokens
-    if max_tokens > 1024:
-        payload['max_tokens'] = int(max_tokens)
+    # 未识别出具体天数时，视为针对整个行程的修改
+    affected_days = select_target_days(base_plan, prompt)
+    if not affected_days:
+        affected_days = list(range(1, len(base_plan.get('days') or []) + 1))
     
-    # 调试输出
-    logger.info(f"正在调用DeepSeek API: {api_url}，模型: {model}")
-    logger.info(f"请求头: {headers}")
-    logger.info(f"请求体: {json.dumps(payload, ensure_ascii=False)}")
+    messages = build_patch_messages(base_plan, prompt, affected_days)
     
     try:
-        response = requests.post(
-            api_url,
-            headers=headers,
-            json=payload,
-            timeout=120  # 60秒超时
+        logger.info(f"调用Deepseek API以补丁方式修改行程，涉及天数: {affected_days}")
+        patch, _ = coalesced(
+            'patch-trip', messages,
+            lambda: request_model_json(messages, expected_keys=('operations',), allow_repair=False)[0]
         )
-        
-        # 详细记录响应
-        logger.info(f"API响应状态码: {response.status_code}")
-        logger.info(f"API响应内容: {response.text[:500]}...")  # 截取前500个字符避免日志过长
-        
-        if response.status_code == 200:
-            logger.info("API调用成功")
-            return response.json()
-        elif response.status_code == 401:
-            error_message = f"API认证失败: 无效的API密钥或未授权。请检查DeepSeek API密钥是否正确和有效。"
-            logger.error(error_message)
-            raise Exception(error_message)
-        elif response.status_code == 400:
-            error_message = f"API请求参数错误: {response.text}"
-            logger.error(error_message)
-            raise Exception(error_message)
-        elif response.status_code == 422:
-            error_message = f"API请求格式错误或签名验证失败: {response.text}。请检查DeepSeek API密钥和请求参数。"
-            logger.error(error_message)
-            raise Exception(error_message)
-        elif response.status_code == 429:
-            error_message = f"API请求频率超限: {response.text}"
-            logger.error(error_message)
-            raise Exception(error_message)
-        else:
-            error_message = f"API请求失败: {response.status_code} - {response.text}"
-            logger.error(error_message)
-            raise Exception(error_message)
-            
-    except requests.RequestException as e:
-        logger.error(f"请求异常: {str(e)}")
-        raise Exception(f"API请求异常: {str(e)}")
+        if not patch:
+            logger.error("无法从API响应中提取有效的补丁JSON")
+            return {"error": "无法修改行程，请重新尝试或提供更明确的修改指令"}, 400
+        try:
+            patched_plan = finalize_trip_plan(apply_trip_patch(base_plan, patch, affected_days))
+        except PatchScopeError as e:
+            logger.warning(f"{e}，改为发送完整行程修改")
+            patch = None
+            affected_days = list(range(1, len(base_plan.get('days') or []) + 1))
+            patched_plan = request_modified_plan(to_prompt_json(strip_analysis(base_plan)), prompt)
+            if not patched_plan:
+                logger.error("无法从API响应中提取有效JSON")
+                return {"error": "无法修改行程，请重新尝试或提供更明确的修改指令"}, 400
+    except ValueError as e:
+        logger.error(f"行程补丁无效: {str(e)}")
+        return {"error": f"无法修改行程，请重新尝试或提供更明确的修改指令: {str(e)}"}, 400
+    except AdmissionRejected:
+        raise
     except Exception as e:
-        logger.error(f"未知错误: {str(e)}")
-        raise Exception(f"API调用时发生未知错误: {str(e)}")
+        logger.error(f"主API修改行程失败: {str(e)}")
+        return {
+            'error': '抱歉，我暂时无法修改行程规划。请问有什么其他旅游相关的问题我可以帮您解决吗？',
+            'suggestions': FALLBACK_SUGGESTIONS,
+        }, 400
+    
+    operations = patch.get('operations') if isinstance(patch, dict) else patch
+    if plan_id:
+        update_data = {'days': patched_plan['days']}
+        if operations is None:
+            # 完整修改: 写回允许补丁修改的字段
+            update_data.update({field: patched_plan[field] for field in PATCHABLE_FIELDS if field in patched_plan})
+        for op in operations or []:
+            if op.get('op') == 'set':
+                update_data[op['field']] = op.get('value')
+        TripPlan.update_trip_plan(mongo, plan_id, update_data)
+        patched_plan = TripPlan.to_json(TripPlan.get_trip_plan_by_id(mongo, plan_id))
+    
+    logger.info("成功以补丁方式修改行程数据")
+    record_conversation_turns(data.get('session_id'), prompt, describe_plan_reply(patched_plan, modified=True))
+    return with_session({
+        'plan': patched_plan,
+        'patch': operations,
+        'affectedDays': affected_days,
+    }, data.get('session_id')), 200
+
 
+@api.route('/ai/generate-trips/batch', methods=['POST'])
+@jwt_required()
+def batch_generate_trips():
+    """批量生成行程，以NDJSON流的形式逐条返回结果
 
-def extract_json_from_content(content):
-    """从内容中提取JSON"""
+    items 中每项可以是提示词字符串，或 {"prompt"} / {"destination", "days", "tags"}；
+    save 为真时把生成的行程直接保存为 TripPlan。
+    """
+    data = request.json or {}
+    items = data.get('items')
+    if not isinstance(items, list) or not items:
+        return jsonify({'error': '无效的请求数据: items 必须是非空列表'}), 400
+    if len(items) > AI_BATCH_MAX_ITEMS:
+        return jsonify({'error': f'单次最多生成 {AI_BATCH_MAX_ITEMS} 个行程'}), 400
+    
+    specs = []
+    for index, item in enumerate(items):
+        spec = resolve_batch_spec(item)
+        if spec is None:
+            return jsonify({'error': f'第 {index + 1} 项格式错误'}), 400
+        specs.append(spec)
+    
     try:
-        # 尝试直接解析整个内容
-        return json.loads(content)
-    except:
-        pass
+        concurrency = max(1, min(int(data.get('concurrency') or AI_BATCH_CONCURRENCY), AI_BATCH_CONCURRENCY))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'concurrency 必须是整数'}), 400
+    options = {
+        'save': bool(data.get('save')),
+        'use_cache': data.get('use_cache', True),
+        'creator_id': current_user_id(),
+        'usage_scope': metering_context(),
+    }
+    logger.info(f"批量生成行程: {len(specs)} 项，并发 {concurrency}，保存: {options['save']}")
     
-    # 尝试从Markdown代码块中提取JSON
-    json_pattern = r'```(?:json)?\s*([\s\S]*?)\s*```'
-    import re
-    matches = re.findall(json_pattern, content)
+    def generate():
+        started = time.monotonic()
+        counts = {'succeeded': 0, 'failed': 0}
+        executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='ai-batch')
+        try:
+            futures = {
+                executor.submit(run_batch_item, spec, options): index
+                for index, spec in enumerate(specs)
+            }
+            for future in as_completed(futures):
+                line = dict(future.result(), index=futures[future])
+                counts['succeeded' if line['status'] != 'failed' else 'failed'] += 1
+                yield json.dumps(line, ensure_ascii=False, default=str) + '\n'
+            yield json.dumps({
+                'done': True,
+                'total': len(specs),
+                **counts,
+                'elapsed_ms': round((time.monotonic() - started) * 1000),
+            }) + '\n'
+        finally:
+            # 客户端断开时取消尚未开始的项
+            executor.shutdown(wait=False, cancel_futures=True)
     
-    if matches:
-        for match in matches:
-            try:
-                return json.loads(match)
-            except:
-                continue
+    return Response(
+        stream_with_context(generate()),
+        mimetype='application/x-ndjson',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+def resolve_batch_spec(item):
+    """把批量生成的一项规范化为 (prompt, destination, days, tags)；格式错误时返回None
+
+    只给出目的地等信息时据此生成提示词；同时给出提示词和目的地等信息时，以显式给出的为准。
+    """
+    if isinstance(item, str):
+        item = {'prompt': item}
+    if not isinstance(item, dict):
+        return None
+    prompt = item.get('prompt')
+    if not prompt and not item.get('destination'):
+        return None
+    
+    destination, days, tags = extract_intent(prompt) if prompt else (None, DEFAULT_TRIP_DAYS, list(DEFAULT_TRIP_TAGS))
+    destination = item.get('destination') or destination
+    try:
+        days = max(1, min(int(item.get('days') or days), 30))
+    except (TypeError, ValueError):
+        return None
+    if isinstance(item.get('tags'), list) and item['tags']:
+        tags = [str(tag) for tag in item['tags']]
+    if not prompt:
+        prompt = f"帮我规划一个{destination}{days}天的{'、'.join(tags)}之旅"
+    return prompt, destination, days, tags
+
+
+def run_batch_item(spec, options):
+    """生成批量中的一项 (在批次线程池中执行)，返回NDJSON的一行
+
+    与 generate-trip 共用缓存和请求合并；生成失败时不使用默认行程，直接标记为失败。
+    """
+    prompt, destination, days, tags = spec
+    line = {'prompt': prompt, 'destination': destination, 'days': days}
+    try:
+        # 批量任务以低优先级排队，不挤占交互请求，但允许更长的排队时间
+        with ai_admission.priority_scope(PRIORITY_LOW, AI_BATCH_QUEUE_TIMEOUT), \
+                usage_meter.scope(*options['usage_scope']):
+            intent_key, prompt_hash = trip_cache.make_key(destination, days, tags, prompt)
+            plan, source = None, 'generated'
+            if options['use_cache']:
+                plan = lookup_trip_cache(intent_key, prompt_hash, prompt, destination, days, tags)
+                source = 'cached'
+            if plan is None:
+                (plan, cacheable), shared = coalesced(
+                    'generate-trip', [intent_key, prompt_hash],
+                    lambda: request_trip_plan(prompt, destination, days, tags)
+                )
+                source = 'generated'
+                if plan and cacheable and not shared:
+                    trip_cache.set(intent_key, prompt_hash, plan)
+    except Exception as e:
+        logger.warning(f"批量生成行程失败({destination}): {e}")
+        return dict(line, status='failed', error=str(e))
+    
+    if not plan:
+        return dict(line, status='failed', error='无法从API响应中提取有效JSON')
+    
+    line.update(status=source, plan=plan)
+    if options['save']:
+        # create_trip_plan 会就地转换日期并写入 _id，缓存中的对象不能直接传入
+        plan_data = copy.deepcopy(plan)
+        plan_data.setdefault('destination', destination)
+        plan_data['source'] = 'ai_batch'
+        if options['creator_id']:
+            plan_data['creator_id'] = options['creator_id']
+        try:
+            line['plan_id'] = str(TripPlan.create_trip_plan(mongo, plan_data))
+        except Exception as e:
+            # 保存失败只影响这一项，生成的行程仍然返回，批次继续
+            logger.warning(f"批量生成的行程保存失败({destination}): {e}")
+            line.update(status='failed', error=f'保存行程失败: {e}')
+    return line
+
+
+@api.route('/ai/jobs/<job_id>', methods=['GET'])
+@jwt_required(optional=True)
+def get_ai_job(job_id):
+    """查询AI异步任务的状态或结果"""
+    job = AIJob.get_job_by_id(mongo, job_id)
+    if not job:
+        return jsonify({'error': '任务不存在或已过期'}), 404
     
-    # 尝试提取任意花括号包围的JSON
-    json_pattern = r'(\{[\s\S]*\})'
-    matches = re.findall(json_pattern, content)
+    # 登录用户创建的任务只允许本人查询
+    if job.get('user_id') and job['user_id'] != current_user_id():
+        return jsonify({'error': '无权查看该任务'}), 403
     
-    if matches:
-        for match in matches:
-            try:
-                return json.loads(match)
-            except:
-                continue
+    return jsonify(AIJob.to_json(job))
+
+
+@api.route('/ai/conversations/<session_id>', methods=['GET'])
+@jwt_required(optional=True)
+def get_conversation(session_id):
+    """查询会话的摘要和保存的消息"""
+    conversation = Conversation.get_conversation_by_id(mongo, session_id)
+    if not conversation or not can_access_conversation(conversation):
+        return jsonify({'error': '会话不存在或已过期'}), 404
+    return jsonify(Conversation.to_json(conversation))
+
+
+@api.route('/ai/conversations/<session_id>', methods=['DELETE'])
+@jwt_required(optional=True)
+def delete_conversation(session_id):
+    """删除会话"""
+    conversation = Conversation.get_conversation_by_id(mongo, session_id)
+    if not conversation or not can_access_conversation(conversation):
+        return jsonify({'error': '会话不存在或已过期'}), 404
+    Conversation.delete_conversation(mongo, session_id)
+    return jsonify({'message': '会话已删除'})
+
+
+def submit_ai_job(job_type, data, runner):
+    """创建异步任务并提交到后台执行器，返回202响应"""
+    job_id = AIJob.create_job(mongo, job_type, data, current_user_id())
+    if not ai_job_executor.submit(execute_ai_job, job_id, runner, data, request_priority(), metering_context()):
+        logger.warning(f"AI任务队列已满，拒绝任务: {job_id}")
+        AIJob.mark_finished(mongo, job_id, {'error': 'AI任务队列已满，请稍后重试'}, 503)
+        response = jsonify({'error': 'AI任务队列已满，请稍后重试'})
+        response.headers['Retry-After'] = str(AI_JOB_RETRY_AFTER)
+        return response, 503
     
-    return None
+    return jsonify({
+        'job_id': job_id,
+        'status': AIJob.STATUS_PENDING,
+        'status_url': url_for('api.get_ai_job', job_id=job_id),
+    }), 202
+
+
+def execute_ai_job(job_id, runner, data, priority=PRIORITY_LOW, usage_scope=(None, 'ai_job')):
+    """在后台线程中执行任务并持久化结果 (上游调用沿用提交任务的用户的优先级，计入提交任务的用户和路由)"""
+    AIJob.mark_running(mongo, job_id)
+    try:
+        with ai_admission.priority_scope(priority), usage_meter.scope(*usage_scope):
+            result, status_code = runner(data)
+    except AdmissionRejected as e:
+        result, status_code = {'error': 'AI服务繁忙，请稍后重试', 'retry_after': e.retry_after}, 503
+    except Exception as e:
+        logger.error(f"AI任务 {job_id} 执行失败: {str(e)}")
+        result, status_code = {'error': f'处理请求时出错: {str(e)}'}, 500
+    AIJob.mark_finished(mongo, job_id, result, status_code)
+
+
+@api.route('/ai/stats', methods=['GET'])
+def ai_stats():
+    """AI服务运行指标 (缓存命中率、上游端点状态、JSON提取策略、调用汇总、预生成回答、请求合并、准入控制)"""
+    return jsonify({
+        'trip_cache': trip_cache.stats(),
+        'upstream': ai_client.status(),
+        'jobs': ai_job_executor.stats(),
+        'json_extraction': json_extraction_stats.stats(),
+        'calls': ai_call_logger.stats(),
+        'canned_answers': canned_answers.stats(),
+        'single_flight': single_flight.stats(),
+        'admission': ai_admission.stats(),
+        'geocoder': geocoder.stats(),
+        'usage_meter': usage_meter.stats(),
+        'templates': template_index.stats(),
+    })
+
+
+@api.route('/ai/usage', methods=['GET'])
+def ai_usage():
+    """AI调用计量汇总 (管理接口，请求头 X-Admin-Token 须与 AI_ADMIN_TOKEN 一致)
+
+    查询参数: period=hour|day，since/until 为ISO时间(UTC)，可按 user_id、route 过滤，
+    group_by=user|route 时额外返回按用户或路由合并整个时间范围后的排行 (前 limit 项)。
+    """
+    if not AI_ADMIN_TOKEN:
+        return jsonify({'error': '管理接口未开放'}), 404
+    if not hmac.compare_digest(request.headers.get('X-Admin-Token', ''), AI_ADMIN_TOKEN):
+        return jsonify({'error': '无权访问'}), 403
+    
+    period = request.args.get('period', PERIOD_HOUR)
+    if period not in PERIODS:
+        return jsonify({'error': f"period 必须是 {'、'.join(PERIODS)} 之一"}), 400
+    group_by = request.args.get('group_by')
+    if group_by not in (None, 'user', 'route'):
+        return jsonify({'error': 'group_by 必须是 user 或 route'}), 400
+    try:
+        since = parse_utc_time(request.args.get('since'))
+        until = parse_utc_time(request.args.get('until'))
+    except ValueError:
+        return jsonify({'error': 'since/until 必须是ISO格式的时间'}), 400
+    if since is None:
+        # 默认查询最近24小时的小时汇总，或最近30天的天汇总
+        since = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(
+            days=30 if period == PERIOD_DAY else 1)
+    limit = max(1, min(request.args.get('limit', 200, type=int), 2000))
+    
+    filters = (period, since, until, request.args.get('user_id'), request.args.get('route'))
+    result = {'period': period, 'since': since.isoformat(), 'rollups': usage_meter.rollups(*filters, limit)}
+    if group_by:
+        # 在数据库中按整个时间范围合并，不受 rollups 条数限制的影响
+        result['groups'] = usage_meter.grouped(group_by, *filters, limit)
+    return jsonify(result)
+
+
+def parse_utc_time(value):
+    """解析ISO时间，未带时区的按UTC处理；为空时返回None，格式错误时抛出 ValueError"""
+    if not value:
+        return None
+    parsed = datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+    return parsed.astimezone(datetime.timezone.utc)
+
+
+@api.route('/ai/geocode', methods=['GET'])
+def ai_geocode():
+    """离线地理编码: q 按名称查找 (可选 near 指定所在目的地)，或 lat/lng 反查附近的地点"""
+    query = request.args.get('q', '').strip()
+    if query:
+        name = geocoder.lookup(query, request.args.get('near'))
+        if not name:
+            return jsonify({'error': '未找到该地点'}), 404
+        return jsonify(describe_place(name))
+    
+    coord = parse_coordinates({'latitude': request.args.get('lat'), 'longitude': request.args.get('lng')})
+    if coord is None:
+        return jsonify({'error': '需要提供 q 或有效的 lat/lng'}), 400
+    limit = min(request.args.get('limit', 5, type=int), 20)
+    radius = min(request.args.get('radius', 50, type=float), 500)
+    places = [
+        dict(describe_place(name), distance_km=distance)
+        for distance, name in geocoder.nearest(coord[0], coord[1], limit=limit, max_km=radius)
+    ]
+    return jsonify({'region': geocoder.reverse(*coord), 'places': places})
+
+
+def describe_place(name):
+    place = geocoder.places[name]
+    return {
+        'name': name,
+        'type': place.get('type'),
+        'city': place.get('city'),
+        'province': place.get('province'),
+        'country': place.get('country'),
+        'coordinates': geocoder.coordinates(name),
+    }
+
+
+# 工具函数
+
+def request_priority():
+    """上游调用的优先级: 请求中登录用户为高优先级，匿名用户为低优先级；
+    不在请求上下文中时返回None，沿用 priority_scope 设置的优先级 (默认低优先级)"""
+    if not has_request_context():
+        return None
+    return PRIORITY_HIGH if current_user_id() else PRIORITY_LOW
+
+
+def current_user_id():
+    """返回当前登录用户的ID，未登录时返回None"""
+    identity = get_jwt_identity()
+    if isinstance(identity, dict):
+        return identity.get('user_id')
+    return identity
+
+
+def metering_context():
+    """计量用的 (用户, 路由): 优先使用 usage_meter.scope 设置的值，其次取当前请求的用户和视图函数名"""
+    scope = usage_meter.current_scope()
+    if scope:
+        return scope
+    if has_request_context():
+        return current_user_id(), (request.endpoint or request.path).rpartition('.')[2]
+    return None, 'background'
+
+
+def record_usage(context, started, max_tokens, usage=None, model=None, finish_reason=None,
+                 stream=False, error=None):
+    """把一次上游调用计入 usage_meter (计量关闭时忽略)"""
+    if not AI_USAGE_METERING:
+        return
+    user_id, route = context
+    usage_meter.record(
+        route, user_id=user_id, model=model, usage=usage,
+        latency_ms=(time.monotonic() - started) * 1000, error=error,
+        stream=stream, max_tokens=max_tokens, finish_reason=finish_reason,
+    )
+
+
+def build_trip_messages(prompt, destination, days, tags):
+    """构建行程生成的消息列表"""
+    return TRIP_PLAN_TEMPLATE.messages(
+        destination=destination,
+        days=days,
+        tags='、'.join(tags) if tags else '无',
+        prompt=prompt,
+    )
+
+
+def can_access_conversation(conversation):
+    """登录用户创建的会话只允许本人访问"""
+    return not conversation.get('user_id') or conversation['user_id'] == current_user_id()
+
+
+def load_conversation(data):
+    """根据请求中的 session_id 取得会话，返回 (conversation, 错误响应)
+
+    请求中没有 session_id 字段时返回 (None, None)，沿用客户端传来的 history；
+    session_id 为空时为当前用户新建一个会话。
+    """
+    if 'session_id' not in data:
+        return None, None
+    session_id = data.get('session_id')
+    if not session_id:
+        session_id = Conversation.create_conversation(mongo, current_user_id())
+    conversation = Conversation.get_conversation_by_id(mongo, session_id)
+    if not conversation or not can_access_conversation(conversation):
+        return None, (jsonify({'error': '会话不存在或已过期'}), 404)
+    return conversation, None
+
+
+def attach_conversation(data):
+    """行程生成/修改接口使用: 校验会话并把 (可能新建的) 会话ID写回请求数据
+
+    行程接口可能在后台线程中执行，因此在请求上下文中完成校验。
+    """
+    conversation, error_response = load_conversation(data)
+    if conversation is not None:
+        data = dict(data, session_id=conversation['_id'])
+    return data, error_response
+
+
+def build_chat_messages(user_message, conversation, history):
+    """组装聊天消息: 会话模式使用摘要和服务端保存的消息，否则使用客户端的 history，均受token预算限制"""
+    if conversation is not None:
+        return build_context_messages(
+            TRAVEL_SYSTEM_PROMPT, unsummarized_turns(conversation), user_message,
+            AI_CHAT_CONTEXT_TOKENS, summary=conversation.get('summary')
+        )
+    return build_context_messages(
+        TRAVEL_SYSTEM_PROMPT, normalize_history(history), user_message, AI_CHAT_CONTEXT_TOKENS
+    )
+
+
+def lookup_canned_answer(user_message, conversation, history):
+    """聊天消息为建议选项且没有实质上文时，返回预生成的回答，否则返回None"""
+    if not AI_CANNED_ANSWERS_ENABLED:
+        return None
+    canned_answers.start()
+    if conversation is not None:
+        if conversation.get('summary'):
+            return None
+        history = unsummarized_turns(conversation)
+    else:
+        history = normalize_history(history)
+    return canned_answers.lookup(user_message, history)
+
+
+def generate_canned_answer(prompt):
+    """为建议选项生成回答 (在后台刷新线程中执行)"""
+    messages = [
+        {'role': 'system', 'content': TRAVEL_SYSTEM_PROMPT},
+        {'role': 'user', 'content': prompt},
+    ]
+    with usage_meter.scope(None, 'canned_answers'):
+        response = call_api(messages=messages)
+    return response['choices'][0]['message']['content']
+
+
+def record_conversation_turns(session_id, user_content, assistant_content):
+    """把一轮对话写入会话；未压缩的消息超出预算时在后台生成摘要"""
+    if not session_id:
+        return
+    try:
+        Conversation.append_turns(mongo, session_id, [
+            {'role': 'user', 'content': user_content},
+            {'role': 'assistant', 'content': assistant_content},
+        ])
+        conversation = Conversation.get_conversation_by_id(mongo, session_id)
+        if conversation and plan_summarization(conversation, AI_CHAT_CONTEXT_TOKENS, AI_CHAT_KEEP_TURNS):
+            ai_job_executor.submit(summarize_conversation, session_id)
+    except Exception as e:
+        logger.warning(f"保存会话消息失败: {e}")
+
+
+def summarize_conversation(session_id):
+    """把会话中较早的消息与已有摘要合并为新的摘要 (在后台线程中执行)"""
+    conversation = Conversation.get_conversation_by_id(mongo, session_id)
+    if not conversation:
+        return
+    plan = plan_summarization(conversation, AI_CHAT_CONTEXT_TOKENS, AI_CHAT_KEEP_TURNS)
+    if not plan:
+        return
+    turns, summarized_count = plan
+    
+    transcript = '\n'.join(
+        f"{'用户' if turn['role'] == 'user' else '助手'}：{turn['content']}" for turn in turns
+    )
+    messages = [
+        {'role': 'system', 'content': CONVERSATION_SUMMARY_PROMPT},
+        {'role': 'user', 'content': f"已有摘要：\n{conversation.get('summary') or '无'}\n\n新增对话：\n{transcript}"},
+    ]
+    with usage_meter.scope(conversation.get('user_id'), 'summarize_conversation'):
+        response = call_api(messages=messages, max_tokens=512)
+    summary = response['choices'][0]['message']['content'].strip()
+    
+    previous_count = conversation.get('summarized_count') or 0
+    if Conversation.update_summary(mongo, session_id, summary, summarized_count, previous_count):
+        logger.info(f"会话 {session_id} 已压缩前 {summarized_count} 条消息")
+
+
+def describe_plan_reply(plan, modified=False):
+    """行程接口写入会话的助手回复: 只记录行程概要，避免把整个行程JSON放进上下文"""
+    action = '已修改行程' if modified else '已生成行程'
+    days = plan.get('days') or []
+    return f"{action}《{plan.get('name', '')}》，目的地{plan.get('destination', '')}，共{len(days)}天。"
+
+
+def with_session(result, session_id):
+    """会话模式下在响应中附带 session_id (不修改缓存中的原对象)"""
+    if not session_id:
+        return result
+    return dict(result, session_id=session_id)
+
+
+def build_patch_messages(plan, prompt, affected_days):
+    """构建补丁模式的行程修改消息：受影响的天数完整发送，其余只发送概要"""
+    return TRIP_PATCH_TEMPLATE.messages(
+        outline=build_plan_outline(plan, affected_days),
+        affected_days=to_prompt_json(selected_days_payload(plan, affected_days)),
+        prompt=prompt,
+    )
+
+
+def lookup_trip_cache(intent_key, prompt_hash, prompt, destination, days, tags):
+    """查询行程缓存；命中近似结果时在后台为当前提示词重新生成"""
+    cached_plan, match = trip_cache.get(intent_key, prompt_hash)
+    if cached_plan is None:
+        return None
+    
+    logger.info(f"行程缓存命中({match}): {intent_key}")
+    if match == 'nearest':
+        def regenerate():
+            plan, cacheable = request_trip_plan(prompt, destination, days, tags)
+            return plan if cacheable else None
+        
+        trip_cache.refresh_async(intent_key, prompt_hash, regenerate)
+    return cached_plan
+
+
+def request_trip_plan(prompt, destination, days, tags):
+    """调用AI生成行程，返回 (行程数据, 是否可以写入缓存)；无法提取JSON时行程为None"""
+    messages = build_trip_messages(prompt, destination, days, tags)
+    plan, strategy = request_model_json(messages, expected_keys=('days',))
+    plan = finalize_trip_plan(plan)
+    return plan, is_cacheable_plan(plan, strategy, days)
+
+
+def is_cacheable_plan(plan, strategy, days):
+    """行程是否可以写入缓存: 由截断输出修复而来或天数与请求不符的行程只返回给本次请求，不缓存"""
+    if not plan or strategy == STRATEGY_REPAIRED:
+        return False
+    return len(plan.get('days') or []) == days
+
+
+def finalize_trip_plan(plan):
+    """模型返回的行程在服务端补全: 填充/校验活动坐标，计算行程分析"""
+    if AI_GEOCODER_ENABLED and isinstance(plan, dict):
+        geocoder.fill_plan(plan)
+    return attach_analysis(plan)
+
+
+def request_model_json(messages, expected_keys=None, allow_repair=True, max_tokens=2048):
+    """调用AI并从回复中提取JSON，返回 (value, strategy)；无法提取时返回 (None, None)"""
+    response = call_api(messages=messages, max_tokens=max_tokens)
+    content = response['choices'][0]['message']['content']
+    return extract_json_from_content(content, expected_keys=expected_keys, allow_repair=allow_repair)
+
+
+def coalesced(kind, payload, fn):
+    """合并相同的进行中请求，返回 (result, shared)
+
+    payload 为规范化后的请求内容；相同 kind 和 payload 的请求正在执行时，
+    等待其完成并共享结果，shared 为真表示结果来自其他请求的调用。
+    """
+    if not AI_SINGLE_FLIGHT_ENABLED:
+        return fn(), False
+    result, shared = single_flight.do(make_flight_key(kind, payload), fn)
+    if shared:
+        logger.info(f"合并了相同的进行中请求: {kind}")
+    return result, shared
+
+
+def call_api(messages, max_tokens=1024):
+    """调用AI API - 通过共享的AI客户端 (主端点失败时自动切换到备用端点)"""
+    validate_messages(messages)
+    
+    # 先经过准入控制排队，名额不足时抛出 AdmissionRejected
+    # 请求/响应体和调用摘要由 ai_call_logger 记录 (抽样、延迟序列化、脱敏)
+    # 每次调用的token用量和耗时按用户和路由计入 usage_meter
+    context = metering_context()
+    with ai_admission.admit(request_priority()):
+        started = time.monotonic()
+        try:
+            response = ai_client.chat_completion(messages, max_tokens=max_tokens)
+        except AIClientError as e:
+            record_usage(context, started, max_tokens, error=e)
+            raise
+        except Exception as e:
+            record_usage(context, started, max_tokens, error=e)
+            logger.error(f"未知错误: {str(e)}")
+            raise Exception(f"API调用时发生未知错误: {str(e)}")
+    
+    choice = (response.get('choices') or [{}])[0]
+    record_usage(context, started, max_tokens, usage=response.get('usage'), model=response.get('model'),
+                 finish_reason=choice.get('finish_reason'))
+    return response
+
+
+def call_api_stream(messages, max_tokens=1024, ticket=None):
+    """以流式方式调用AI API，逐个产出模型生成的增量文本
+
+    ticket 为调用方预先获得的准入名额 (流式接口在返回响应前申请，以便直接返回503)；
+    未提供时在这里申请。名额在流结束后释放。
+    """
+    validate_messages(messages)
+    if ticket is None:
+        ticket = ai_admission.acquire(request_priority())
+    context = metering_context()
+    
+    def generate():
+        started = time.monotonic()
+        result, error = {}, None
+        try:
+            result = yield from ai_client.stream_chat_completion(messages, max_tokens=max_tokens)
+        except GeneratorExit:
+            error = '客户端断开'
+            raise
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            ticket.release()
+            record_usage(context, started, max_tokens, stream=True, error=error, **(result or {}))
+    
+    return generate()
+
+
+def sse_response(generator, ticket=None):
+    """把SSE事件生成器包装为流式响应；响应关闭时释放准入名额"""
+    response = Response(
+        stream_with_context(generator),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no',  # 禁止nginx等反向代理缓冲SSE
+        }
+    )
+    if ticket is not None:
+        response.call_on_close(ticket.release)
+    return response
+
+
+def validate_messages(messages):
+    """检查消息列表格式，格式错误时抛出异常"""
+    if not messages or not isinstance(messages, list) or len(messages) == 0:
+        error_msg = "消息列表为空或格式错误"
+        logger.error(error_msg)
+        raise Exception(error_msg)
+    
+    # 检查每条消息的格式
+    for msg in messages:
+        if not isinstance(msg, dict) or 'role' not in msg or 'content' not in msg:
+            error_msg = f"消息格式错误: {msg}"
+            logger.error(error_msg)
+            raise Exception(error_msg)
+
+
+def sse_event(event, data):
+    """将数据编码为一条SSE事件"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def extract_json_from_content(content, expected_keys=None, allow_repair=True):
+    """从内容中提取JSON，返回 (value, strategy)
+
+    单次扫描找出平衡的JSON对象并挑选最合适的一个，使用的策略计入 /ai/stats；
+    allow_repair 为真时，被截断的输出会补全括号后再解析 (strategy 为 STRATEGY_REPAIRED)。
+    """
+    value, strategy = json_extraction_stats.timed_extract(content, expected_keys, allow_repair)
+    if strategy == STRATEGY_REPAIRED:
+        logger.warning("模型输出不完整，已截断到最近的完整字段并补全括号")
+    elif strategy is None:
+        logger.warning(f"无法从模型输出中提取JSON，内容长度: {len(content or '')}")
+    return value, strategy
 
 
 def generate_chat_suggestions(user_message, ai_response):
@@ -480,79 +1484,73 @@ def generate_chat_suggestions(user_message, ai_response):
     
     # 基于用户消息和AI回复的内容生成建议
     if "旅游" in user_message or "旅行" in user_message or "行程" in user_message:
-        return ["帮我规划详细行程", "有什么美食推荐？", "当地有什么特色景点？"]
+        return list(TRAVEL_SUGGESTIONS)
     
     if "北京" in user_message:
-        return ["北京长城怎么去？", "北京有什么美食？", "故宫一日游攻略"]
+        return list(BEIJING_SUGGESTIONS)
     
     if "上海" in user_message:
-        return ["上海迪士尼攻略", "上海外滩附近住宿", "上海必吃美食"]
+        return list(SHANGHAI_SUGGESTIONS)
     
     if "规划" in ai_response or "行程" in ai_response:
-        return ["这个行程可以再详细点吗？", "有什么特别推荐的景点？", "如何安排交通？"]
+        return list(PLAN_FOLLOW_UP_SUGGESTIONS)
     
     # 默认建议
-    return ["推荐热门旅游目的地", "国内旅游路线", "亲子游推荐"]
-
-
-def extract_destination(prompt):
-    """从提示中提取目的地"""
-    # 简单实现：常见城市匹配
-    common_cities = ["北京", "上海", "广州", "深圳", "成都", "重庆", "西安", "杭州", "南京", 
-                    "武汉", "长沙", "厦门", "青岛", "大连", "三亚", "丽江", "桂林", "昆明",
-                    "兰州", "西宁", "拉萨", "呼和浩特", "乌鲁木齐"]
-    
-    for city in common_cities:
-        if city in prompt:
-            return city
-    
-    # 模式匹配
-    destination_patterns = [
-        r'去([\u4e00-\u9fa5]{2,4})旅游',
-        r'去([\u4e00-\u9fa5]{2,4})玩',
-        r'([\u4e00-\u9fa5]{2,4})之旅',
-        r'([\u4e00-\u9fa5]{2,4})游玩',
-        r'([\u4e00-\u9fa5]{2,4})旅行'
-    ]
-    
-    import re
-    for pattern in destination_patterns:
-        match = re.search(pattern, prompt)
-        if match:
-            return match.group(1)
-    
-    # 默认返回
-    return "北京"
+    return list(DEFAULT_SUGGESTIONS)
 
 
-def extract_days(prompt):
-    """从提示中提取天数"""
-    # 模式匹配
-    import re
-    days_pattern = r'(\d+)\s*[天日]'
-    match = re.search(days_pattern, prompt)
-    if match:
-        days = int(match.group(1))
-        return days if 1 <= days <= 30 else 3  # 合理范围检查
-    
-    return 3  # 默认3天
+def template_destination(text):
+    """把模板的目的地文本规范化为与 extract_intent 相同的目的地名称"""
+    if not text or not isinstance(text, str):
+        return None
+    return gazetteer.extract(text)['destination'] or text.strip()
 
 
-def extract_tags(prompt):
-    """从提示中提取标签"""
-    common_tags = ["文化", "美食", "购物", "亲子", "自然", "历史", "古迹", "艺术", "休闲", 
-                  "冒险", "户外", "摄影", "温泉", "海滩", "山川", "乡村", "城市"]
-    
-    tags = []
-    for tag in common_tags:
-        if tag in prompt:
-            tags.append(tag)
+def template_tags(tags):
+    """模板标签: 同义词归一为词典中的标准标签，都无法识别时原样保留"""
+    raw = [tag for tag in tags if isinstance(tag, str) and tag]
+    return gazetteer.extract('，'.join(raw))['tags'] or raw
+
+
+def template_trip_plan(destination, days, tags, fast_path=False):
+    """从已发布行程模板中取一个行程，没有合适的模板时返回None
+
+    快速路径只接受匹配分不低于 AI_TEMPLATE_MIN_SCORE 且天数足够的模板；
+    兜底时接受同一目的地的最佳模板，天数不足的部分用默认行程补齐。
+    """
+    if not AI_TEMPLATES_ENABLED:
+        return None
+    template, score = template_index.match(
+        destination, days, tags,
+        min_score=AI_TEMPLATE_MIN_SCORE if fast_path else 0.0,
+        allow_shorter=not fast_path,
+    )
+    if template is None:
+        if fast_path:
+            template_index.record('misses')
+        return None
     
+    plan = template_index.instantiate(template, destination, days, tags)
+    if len(plan['days']) < days:
+        plan['days'].extend(generate_default_trip(destination, days, tags)['days'][len(plan['days']):])
+    template_index.record('hits' if fast_path else 'fallbacks')
+    logger.info(f"使用行程模板 {template.trip_id} ({destination}{days}天，匹配分 {score})")
+    return finalize_trip_plan(plan)
+
+
+def fallback_trip_plan(destination, days, tags):
+    """无法得到模型生成的行程时的备用行程: 优先使用已发布的行程模板，其次是默认行程"""
+    return template_trip_plan(destination, days, tags) or generate_default_trip(destination, days, tags)
+
+
+def extract_intent(prompt):
+    """从提示中一次性提取目的地、天数和标签，返回 (destination, days, tags)"""
+    intent = gazetteer.extract(prompt)
+    destination = intent['destination'] or DEFAULT_DESTINATION
+    days = intent['days'] or DEFAULT_TRIP_DAYS
     # 默认添加通用标签
-    if not tags:
-        tags = ["休闲", "美食"]
-    
-    return tags
+    tags = intent['tags'] or list(DEFAULT_TRIP_TAGS)
+    return destination, days, tags
 
 
 def generate_default_trip(destination, days, tags):
@@ -637,13 +1635,13 @@ def generate_default_trip(destination, days, tags):
             "notes": "这是自动生成的基础行程，建议根据实际情况调整时间和活动安排。"
         })
     
-    return {
+    return attach_analysis({
         "name": trip_name,
         "destination": destination,
         "tags": tags,
         "days": days_list,
         "note": "由于API响应问题，这是系统生成的基础行程。您可以在APP中进一步编辑和完善。"
-    }
+    })
 
 
 def get_day_theme(day, total_days):
@@ -1,10 +1,12 @@
 from flask import jsonify, request
 from . import api # 从同级目录的 __init__.py 导入 api Blueprint
-from ..models import TripPlan, UserTrip # 从父级目录的 models 导入
+from ..models import TripPlan, UserTrip, TripItem # 从父级目录的 models 导入
 from .. import mongo # 从父级目录的 __init__.py 导入 mongo
 import datetime
 from bson.json_util import dumps # 用于更可靠的 MongoDB 到 JSON 转换
 from bson import ObjectId # 用于处理 ObjectId
+from ..utils.pagination import page_size
+from ..utils.projection import build_projection
 
 # --- TripPlan Endpoints (旅行规划模板) ---
 
@@ -14,6 +16,7 @@ def get_trip_plans():
     limit = int(request.args.get('limit', 20))
     skip = int(request.args.get('skip', 0))
     sort_by = request.args.get('sort_by', None) # 例如 'rating', 'updated_at'
+    search = request.args.get('q', '').strip() or None
     
     filters = {}
     if 'destination' in request.args:
@@ -23,16 +26,28 @@ def get_trip_plans():
     elif 'tags' in request.args: # 如果前端可能传多个tag，用 getlist
         filters['tags'] = {'$in': request.args.getlist('tag')}
     
-    trip_plans_cursor = TripPlan.get_trip_plans(mongo, filters=filters, limit=limit, skip=skip, sort_by=sort_by)
+    # view=summary 只返回列表卡片需要的字段，fields=name,destination 指定返回的字段
+    # cursor 为上一页返回的 next_cursor，按排序键定位下一页 (skip 仍然可用，但深翻页较慢)
+    try:
+        projection = build_projection(request.args.get('view'), request.args.get('fields'),
+                                      TripPlan.SUMMARY_FIELDS, nested=None)
+        trip_plans_cursor, next_cursor = TripPlan.get_trip_plans(
+            mongo, filters=filters, limit=limit, skip=skip, sort_by=sort_by,
+            projection=projection.fields, cursor=request.args.get('cursor') or None,
+            search=search # q: 按名称、目的地、描述、标签和活动地点搜索，默认按相关度排序
+        )
+    except ValueError as ve:
+        return jsonify({'error': str(ve)}), 400
     
-    # 如果需要获取总数用于分页
-    # total_plans = mongo.db[TripPlan.COLLECTION].count_documents(filters)
+    # 总数按过滤条件缓存；没有过滤条件时为估算值 (total_exact=false)
+    total_plans, total_exact = TripPlan.count_trip_plans(mongo, filters, search)
 
     trip_plans_list = [TripPlan.to_json(plan) for plan in trip_plans_cursor]
     
     return jsonify({
-        # 'total': total_plans, # 如果实现了总数获取
-        'total': len(trip_plans_list), # 当前列表的长度，并非总数
+        'total': total_plans,
+        'total_exact': total_exact,
+        'next_cursor': next_cursor,
         'plans': trip_plans_list
     })
 
@@ -104,6 +119,15 @@ def delete_trip_plan_route(plan_id): # 重命名函数
 
 # --- UserTrip Endpoints (用户具体行程实例) ---
 
+def trip_list_projection():
+    """解析行程列表的 view / fields 参数，参数不合法时抛出 ValueError
+
+    view=summary 只返回列表卡片需要的字段 (plan_details 同样只含摘要字段)；
+    fields=name,destination,plan_details.coverImage 指定返回的字段，优先于 view。
+    """
+    return build_projection(request.args.get('view'), request.args.get('fields'),
+                            UserTrip.SUMMARY_FIELDS, TripPlan.SUMMARY_FIELDS)
+
 @api.route('/trips/user-trips', methods=['GET'])
 def get_user_trips():
     """获取用户相关的旅行方案列表 (自己创建的或作为成员的)"""
@@ -116,23 +140,25 @@ def get_user_trips():
     
     # **处理 populate_plan 参数**
     populate_plan_arg = request.args.get('populate_plan', 'false').lower() == 'true'
-    
-    user_trips_cursor = UserTrip.get_user_trips_by_user(
-        mongo, 
-        user_id, 
-        limit=limit, 
-        skip=skip, 
-        populate_plan=populate_plan_arg # **传递给模型方法**
-    )
+    try:
+        user_trips_cursor, next_cursor = UserTrip.get_user_trips_by_user(
+            mongo, 
+            user_id, 
+            limit=limit, 
+            skip=skip, 
+            populate_plan=populate_plan_arg, # **传递给模型方法**
+            projection=trip_list_projection(),
+            cursor=request.args.get('cursor') or None # 上一页返回的 next_cursor
+        )
+    except ValueError as ve:
+        return jsonify({'error': str(ve)}), 400
     user_trips_list = [UserTrip.to_json(trip) for trip in user_trips_cursor]
-    
-    # 如果需要总数
-    # query_filters_for_count = {'$or': [{'creator_id': user_id}, {'members.userId': user_id}]}
-    # total_user_trips = mongo.db[UserTrip.COLLECTION].count_documents(query_filters_for_count)
+    total_user_trips, total_exact = UserTrip.count_user_trips_by_user(mongo, user_id)
 
     return jsonify({
-        # 'total': total_user_trips,
-        'total': len(user_trips_list),
+        'total': total_user_trips,
+        'total_exact': total_exact,
+        'next_cursor': next_cursor,
         'trips': user_trips_list
     })
 
@@ -143,6 +169,7 @@ def get_market_user_trips():
     limit = int(request.args.get('limit', 10))
     skip = int(request.args.get('skip', 0))
     sort_by = request.args.get('sort_by', None) # 例如 'rating', 'popularity'
+    search = request.args.get('q', '').strip() or None
     
     filters = {}
     if 'destination' in request.args:
@@ -155,25 +182,27 @@ def get_market_user_trips():
     # populate_plan 默认为 True 在 UserTrip.get_published_user_trips 中
     # 但前端可以显式传递，这里可以解析并传递，或者依赖模型的默认值
     populate_plan_arg = request.args.get('populate_plan', 'true').lower() == 'true'
-
-    published_trips_cursor = UserTrip.get_published_user_trips(
-        mongo, 
-        filters=filters, 
-        limit=limit, 
-        skip=skip, 
-        sort_by=sort_by,
-        populate_plan=populate_plan_arg # **传递给模型方法**
-    )
+    try:
+        published_trips_cursor, next_cursor = UserTrip.get_published_user_trips(
+            mongo, 
+            filters=filters, 
+            limit=limit, 
+            skip=skip, 
+            sort_by=sort_by,
+            populate_plan=populate_plan_arg, # **传递给模型方法**
+            projection=trip_list_projection(),
+            cursor=request.args.get('cursor') or None, # 上一页返回的 next_cursor，无限滚动时每页代价相同
+            search=search # q: 按名称、目的地、描述、标签和活动地点搜索，默认按相关度排序
+        )
+    except ValueError as ve:
+        return jsonify({'error': str(ve)}), 400
     published_trips_list = [UserTrip.to_json(trip) for trip in published_trips_cursor]
-
-    # 如果需要总数
-    # query_filters_for_count = {'publish_status': 'published'}
-    # if filters: query_filters_for_count.update(filters)
-    # total_published_trips = mongo.db[UserTrip.COLLECTION].count_documents(query_filters_for_count)
+    total_published_trips, total_exact = UserTrip.count_published_user_trips(mongo, filters, search)
     
     return jsonify({
-        # 'total': total_published_trips,
-        'total': len(published_trips_list),
+        'total': total_published_trips,
+        'total_exact': total_exact,
+        'next_cursor': next_cursor,
         'trips': published_trips_list
     })
 
@@ -325,6 +354,68 @@ def add_user_trip_feed(trip_id):
         return jsonify({'message': '动态添加成功'}), 200
     return jsonify({'error': '动态添加失败'}), 500
 
+def list_trip_items(trip_id, kind):
+    """按时间倒序分页返回行程的消息、动态或笔记
+
+    查询参数: limit (每页条数，默认20，最多100)，cursor (上一页返回的 next_cursor)
+    """
+    if not ObjectId.is_valid(trip_id): return jsonify({'error': '未找到该旅行方案'}), 404
+    total = TripItem.count_items(mongo, kind, trip_id)
+    if total is None: return jsonify({'error': '未找到该旅行方案'}), 404
+
+    try:
+        items, next_cursor = TripItem.list_items(
+            mongo, kind, trip_id,
+            limit=page_size(request.args.get('limit')),
+            cursor=request.args.get('cursor') or None
+        )
+    except ValueError as ve:
+        return jsonify({'error': str(ve)}), 400
+    return jsonify({
+        'items': [TripItem.to_json(item) for item in items],
+        'next_cursor': next_cursor,
+        'total': total
+    })
+
+@api.route('/trips/user-trips/<trip_id>/messages', methods=['GET'])
+def get_user_trip_messages(trip_id):
+    """分页获取旅行消息"""
+    return list_trip_items(trip_id, TripItem.MESSAGES)
+
+@api.route('/trips/user-trips/<trip_id>/notes', methods=['GET'])
+def get_user_trip_notes(trip_id):
+    """分页获取行程级旅行笔记"""
+    return list_trip_items(trip_id, TripItem.NOTES)
+
+@api.route('/trips/user-trips/<trip_id>/feeds', methods=['GET'])
+def get_user_trip_feeds(trip_id):
+    """分页获取旅行动态 (Feed)"""
+    return list_trip_items(trip_id, TripItem.FEEDS)
+
+def delete_trip_item(trip_id, kind, item_id):
+    """删除行程的一条消息、动态或笔记 (按记录的 id)"""
+    if not ObjectId.is_valid(trip_id): return jsonify({'error': '未找到该旅行方案'}), 404
+    if TripItem.count_items(mongo, kind, trip_id) is None: return jsonify({'error': '未找到该旅行方案'}), 404
+
+    if TripItem.delete_item(mongo, kind, trip_id, item_id):
+        return jsonify({'message': '删除成功'}), 200
+    return jsonify({'error': '未找到该记录'}), 404
+
+@api.route('/trips/user-trips/<trip_id>/messages/<item_id>', methods=['DELETE'])
+def delete_user_trip_message(trip_id, item_id):
+    """删除旅行消息"""
+    return delete_trip_item(trip_id, TripItem.MESSAGES, item_id)
+
+@api.route('/trips/user-trips/<trip_id>/notes/<item_id>', methods=['DELETE'])
+def delete_user_trip_note(trip_id, item_id):
+    """删除行程级旅行笔记"""
+    return delete_trip_item(trip_id, TripItem.NOTES, item_id)
+
+@api.route('/trips/user-trips/<trip_id>/feeds/<item_id>', methods=['DELETE'])
+def delete_user_trip_feed(trip_id, item_id):
+    """删除旅行动态 (Feed)"""
+    return delete_trip_item(trip_id, TripItem.FEEDS, item_id)
+
 # --- 行程分享功能 API端点 ---
 
 @api.route('/trips/sharing/invitations', methods=['POST'])
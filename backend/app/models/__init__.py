@@ -1,4 +1,4 @@
 # 数据模型包初始化
 
-from .trips import TripPlan, UserTrip, ShareInvitation
+from .trips import TripPlan, UserTrip, ShareInvitation, TripItem
 from .user import User 
\ No newline at end of file
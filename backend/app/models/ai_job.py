@@ -0,0 +1,88 @@
+import datetime
+import uuid
+from ..utils.type_parsers import parse_mongo_doc
+
+class AIJob:
+    """AI异步任务模型
+
+    记录异步执行的行程生成/修改任务的状态和结果，任何worker都可以据此响应轮询。
+    状态流转: pending -> running -> succeeded / failed
+    """
+
+    COLLECTION = 'aiJobs'
+
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_SUCCEEDED = 'succeeded'
+    STATUS_FAILED = 'failed'
+
+    # 任务记录保留时长（小时），过期后由TTL索引自动清理
+    EXPIRY_HOURS = 24
+
+    @staticmethod
+    def create_job(mongo, job_type, request_data, user_id=None):
+        """创建新任务，返回任务ID"""
+        now = datetime.datetime.now(datetime.timezone.utc)
+        job_id = uuid.uuid4().hex
+
+        mongo.db[AIJob.COLLECTION].insert_one({
+            '_id': job_id,
+            'type': job_type,
+            'status': AIJob.STATUS_PENDING,
+            'user_id': user_id,
+            'request': request_data,
+            'result': None,
+            'status_code': None,
+            'created_at': now,
+            'updated_at': now,
+            'expires_at': now + datetime.timedelta(hours=AIJob.EXPIRY_HOURS)
+        })
+        return job_id
+
+    @staticmethod
+    def get_job_by_id(mongo, job_id):
+        """通过ID获取任务"""
+        return mongo.db[AIJob.COLLECTION].find_one({'_id': job_id})
+
+    @staticmethod
+    def mark_running(mongo, job_id):
+        """标记任务开始执行"""
+        now = datetime.datetime.now(datetime.timezone.utc)
+        mongo.db[AIJob.COLLECTION].update_one(
+            {'_id': job_id},
+            {'$set': {'status': AIJob.STATUS_RUNNING, 'started_at': now, 'updated_at': now}}
+        )
+
+    @staticmethod
+    def mark_finished(mongo, job_id, result, status_code):
+        """记录任务结果，status_code 为同步接口对应的HTTP状态码"""
+        now = datetime.datetime.now(datetime.timezone.utc)
+        status = AIJob.STATUS_SUCCEEDED if status_code < 400 else AIJob.STATUS_FAILED
+        mongo.db[AIJob.COLLECTION].update_one(
+            {'_id': job_id},
+            {'$set': {
+                'status': status,
+                'result': result,
+                'status_code': status_code,
+                'finished_at': now,
+                'updated_at': now
+            }}
+        )
+
+    @staticmethod
+    def to_json(job_doc):
+        """将任务文档转换为返回给客户端的格式 (不包含原始请求)"""
+        if not job_doc:
+            return None
+        job = parse_mongo_doc(job_doc)
+        # result 本身来自JSON，直接原样返回 (parse_mongo_doc 会把空列表转换为None)
+        return {
+            'job_id': job['_id'],
+            'type': job.get('type'),
+            'status': job.get('status'),
+            'result': job_doc.get('result'),
+            'status_code': job.get('status_code'),
+            'created_at': job.get('created_at'),
+            'started_at': job.get('started_at'),
+            'finished_at': job.get('finished_at')
+        }
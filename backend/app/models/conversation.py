@@ -0,0 +1,97 @@
+import datetime
+import uuid
+from ..utils.type_parsers import parse_mongo_doc
+
+class Conversation:
+    """AI对话会话模型
+
+    在服务端保存一个会话的消息，客户端只需发送 session_id 和新消息。
+    turns 只保留最近 MAX_STORED_TURNS 条；turn_count 为累计追加的消息数，
+    summarized_count 表示前多少条消息已经被压缩进 summary。
+    """
+
+    COLLECTION = 'aiConversations'
+
+    # 文档中最多保留的消息条数，更早的消息只以摘要形式存在
+    MAX_STORED_TURNS = 200
+
+    # 会话在最后一次活动后保留的天数，过期后由TTL索引自动清理
+    EXPIRY_DAYS = 30
+
+    @staticmethod
+    def create_conversation(mongo, user_id=None):
+        """创建新会话，返回会话ID"""
+        now = datetime.datetime.now(datetime.timezone.utc)
+        session_id = uuid.uuid4().hex
+
+        mongo.db[Conversation.COLLECTION].insert_one({
+            '_id': session_id,
+            'user_id': user_id,
+            'turns': [],
+            'turn_count': 0,
+            'summary': '',
+            'summarized_count': 0,
+            'created_at': now,
+            'updated_at': now,
+            'expires_at': now + datetime.timedelta(days=Conversation.EXPIRY_DAYS)
+        })
+        return session_id
+
+    @staticmethod
+    def get_conversation_by_id(mongo, session_id):
+        """通过ID获取会话"""
+        return mongo.db[Conversation.COLLECTION].find_one({'_id': session_id})
+
+    @staticmethod
+    def append_turns(mongo, session_id, turns):
+        """追加消息 (每条为 {'role', 'content'})，并顺延过期时间"""
+        now = datetime.datetime.now(datetime.timezone.utc)
+        stamped = [{'role': t['role'], 'content': t['content'], 'created_at': now} for t in turns]
+        mongo.db[Conversation.COLLECTION].update_one(
+            {'_id': session_id},
+            {
+                '$push': {'turns': {'$each': stamped, '$slice': -Conversation.MAX_STORED_TURNS}},
+                '$inc': {'turn_count': len(stamped)},
+                '$set': {
+                    'updated_at': now,
+                    'expires_at': now + datetime.timedelta(days=Conversation.EXPIRY_DAYS)
+                }
+            }
+        )
+
+    @staticmethod
+    def update_summary(mongo, session_id, summary, summarized_count, previous_count):
+        """写入新的摘要；previous_count 与当前值不一致 (已被其他请求更新) 时不写入，返回是否成功"""
+        result = mongo.db[Conversation.COLLECTION].update_one(
+            {'_id': session_id, 'summarized_count': previous_count},
+            {'$set': {
+                'summary': summary,
+                'summarized_count': summarized_count,
+                'summarized_at': datetime.datetime.now(datetime.timezone.utc)
+            }}
+        )
+        return result.modified_count > 0
+
+    @staticmethod
+    def delete_conversation(mongo, session_id):
+        """删除会话"""
+        return mongo.db[Conversation.COLLECTION].delete_one({'_id': session_id})
+
+    @staticmethod
+    def to_json(conversation_doc):
+        """将会话文档转换为返回给客户端的格式"""
+        if not conversation_doc:
+            return None
+        conversation = parse_mongo_doc(conversation_doc)
+        return {
+            'session_id': conversation['_id'],
+            'summary': conversation_doc.get('summary') or '',
+            'turns': [
+                {'role': t.get('role'), 'content': t.get('content')}
+                for t in conversation_doc.get('turns') or []
+            ],
+            'turn_count': conversation.get('turn_count') or 0,
+            'summarized_count': conversation.get('summarized_count') or 0,
+            'created_at': conversation.get('created_at'),
+            'updated_at': conversation.get('updated_at')
+        }
@@ -3,5 +3,6 @@
 from .trip_plan import TripPlan
 from .user_trip import UserTrip
 from .share_invitation import ShareInvitation
+from .trip_item import TripItem
 
-__all__ = ['TripPlan', 'UserTrip', 'ShareInvitation'] 
\ No newline at end of file
+__all__ = ['TripPlan', 'UserTrip', 'ShareInvitation', 'TripItem'] 
\ No newline at end of file
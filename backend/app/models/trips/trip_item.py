@@ -0,0 +1,227 @@
+# app/models/trips/trip_item.py
+import datetime
+import hashlib
+from bson import ObjectId, json_util
+from pymongo import UpdateOne
+from ...utils.type_parsers import parse_mongo_doc
+from ...utils.pagination import cursor_filter, split_page
+
+
+class TripItem:
+    """用户行程的子资源: 消息、动态和行程级笔记
+
+    每条记录单独存放在各自的集合中，按 (trip_id, timestamp) 建索引并分页读取；
+    userTrips 文档只保留各类的计数 (message_count 等) 和最近 RECENT_LIMIT 条记录，
+    活跃的团队行程不会无限增长。
+    旧数据直接嵌在 userTrips 的数组中，启动时由一次性迁移 (migrate_all) 转移到独立集合。
+    """
+
+    MESSAGES = 'messages'
+    FEEDS = 'feeds'
+    NOTES = 'notes'
+
+    COLLECTIONS = {
+        MESSAGES: 'tripMessages',
+        FEEDS: 'tripFeeds',
+        NOTES: 'tripNotes',
+    }
+    COUNT_FIELDS = {
+        MESSAGES: 'message_count',
+        FEEDS: 'feed_count',
+        NOTES: 'note_count',
+    }
+
+    # userTrips 文档中保留的最近记录条数
+    RECENT_LIMIT = 20
+
+    # 分页顺序: 最新的在前
+    SORT = [('timestamp', -1), ('_id', -1)]
+
+    @staticmethod
+    def add_item(mongo, kind, trip_id, item_data):
+        """添加一条记录: 写入独立集合，并更新行程文档中的计数和最近记录；行程不存在时返回 False"""
+        trip_oid = ObjectId(trip_id)
+        now = datetime.datetime.now(datetime.timezone.utc)
+        if not item_data.get('id'):
+            item_data['id'] = str(ObjectId())
+        item_data['timestamp'] = TripItem._parse_timestamp(item_data.get('timestamp')) or now
+
+        doc = dict(item_data, trip_id=trip_oid)
+        inserted_id = mongo.db[TripItem.COLLECTIONS[kind]].insert_one(doc).inserted_id
+        result = _user_trips(mongo).update_one(
+            {'_id': trip_oid},
+            {
+                '$push': {kind: {'$each': [item_data], '$slice': -TripItem.RECENT_LIMIT}},
+                '$inc': {TripItem.COUNT_FIELDS[kind]: 1},
+                '$set': {'updated_at': now},
+            }
+        )
+        if result.matched_count == 0:
+            mongo.db[TripItem.COLLECTIONS[kind]].delete_one({'_id': inserted_id})
+            return False
+        return True
+
+    @staticmethod
+    def list_items(mongo, kind, trip_id, limit=20, cursor=None):
+        """按时间倒序分页读取，返回 (记录列表, 下一页游标)；没有更多记录时游标为 None
+
+        cursor 格式错误时抛出 ValueError。
+        """
+        query = {'trip_id': ObjectId(trip_id)}
+        if cursor:
+            query.update(cursor_filter(cursor, TripItem.SORT))
+        docs = list(
+            mongo.db[TripItem.COLLECTIONS[kind]].find(query).sort(TripItem.SORT).limit(limit + 1)
+        )
+        return split_page(docs, TripItem.SORT, limit)
+
+    @staticmethod
+    def count_items(mongo, kind, trip_id):
+        """返回行程中该类记录的总数 (读取行程文档中的计数)；行程不存在时返回 None"""
+        count_field = TripItem.COUNT_FIELDS[kind]
+        trip = _user_trips(mongo).find_one({'_id': ObjectId(trip_id)}, {count_field: 1})
+        if trip is None:
+            return None
+        return trip.get(count_field, 0)
+
+    @staticmethod
+    def migrate_all(mongo):
+        """把所有行程中嵌入的旧记录迁移到独立集合 (一次性迁移，见 utils.migrations)，返回处理的行程数"""
+        pending = {'$or': [{field: {'$exists': False}} for field in TripItem.COUNT_FIELDS.values()]}
+        migrated = 0
+        for trip in _user_trips(mongo).find(pending, {'_id': 1}):
+            for kind in TripItem.COLLECTIONS:
+                TripItem.migrate_embedded(mongo, kind, trip['_id'])
+            migrated += 1
+        return migrated
+
+    @staticmethod
+    def migrate_embedded(mongo, kind, trip_oid):
+        """把行程文档中嵌入的旧记录迁移到独立集合 (已迁移或行程不存在时什么都不做)
+
+        按 (trip_id, id) 幂等写入，多个请求同时迁移同一行程也不会产生重复记录。
+        """
+        count_field = TripItem.COUNT_FIELDS[kind]
+        trip = _user_trips(mongo).find_one(
+            {'_id': trip_oid, count_field: {'$exists': False}}, {kind: 1}
+        )
+        if not trip:
+            return
+
+        items = [item for item in trip.get(kind) or [] if isinstance(item, dict)]
+        operations = []
+        for item in items:
+            item = dict(item)
+            if not item.get('id'):
+                item['id'] = TripItem.content_id(item)
+            item['timestamp'] = TripItem._parse_timestamp(item.get('timestamp')) or trip_oid.generation_time
+            operations.append(UpdateOne(
+                {'trip_id': trip_oid, 'id': item['id']},
+                {'$setOnInsert': dict(item, trip_id=trip_oid)},
+                upsert=True
+            ))
+        if operations:
+            mongo.db[TripItem.COLLECTIONS[kind]].bulk_write(operations, ordered=False)
+        _user_trips(mongo).update_one(
+            {'_id': trip_oid, count_field: {'$exists': False}},
+            {'$set': {count_field: len(items), kind: items[-TripItem.RECENT_LIMIT:]}}
+        )
+
+    @staticmethod
+    def merge_items(mongo, kind, trip_id, items):
+        """合并客户端随整个行程提交的记录列表: 只添加独立集合中还没有的记录 (按 id 判断)
+
+        客户端保存行程时会带上本地的 messages 等数组 (通常只有最近的记录)，这里不再整体覆盖，
+        以免丢失较早的记录；删除记录使用 delete_item。
+        没有 id 的记录按内容生成 id (见 content_id)，同一条记录重复提交不会重复添加。
+        返回新增的条数。
+        """
+        trip_oid = ObjectId(trip_id)
+        items = [dict(item) for item in items or [] if isinstance(item, dict)]
+        for item in items:
+            if not item.get('id'):
+                item['id'] = TripItem.content_id(item)
+        items = list({item['id']: item for item in items}.values())
+        ids = [item['id'] for item in items]
+        existing = set()
+        if ids:
+            existing = {
+                doc['id'] for doc in mongo.db[TripItem.COLLECTIONS[kind]].find(
+                    {'trip_id': trip_oid, 'id': {'$in': ids}}, {'id': 1}
+                )
+            }
+        added = 0
+        for item in items:
+            if item.get('id') in existing:
+                continue
+            if TripItem.add_item(mongo, kind, trip_oid, item):
+                added += 1
+        return added
+
+    @staticmethod
+    def delete_item(mongo, kind, trip_id, item_id):
+        """删除一条记录 (按 id)，并更新行程文档中的计数和最近记录；记录不存在时返回 False"""
+        trip_oid = ObjectId(trip_id)
+        collection = mongo.db[TripItem.COLLECTIONS[kind]]
+        result = collection.delete_one({'trip_id': trip_oid, 'id': item_id})
+        if result.deleted_count == 0:
+            return False
+        # 被删除的记录可能在最近记录中，按独立集合重新取最近的 RECENT_LIMIT 条 (时间正序，与 add_item 一致)
+        recent = list(
+            collection.find({'trip_id': trip_oid}, {'_id': 0, 'trip_id': 0})
+            .sort(TripItem.SORT).limit(TripItem.RECENT_LIMIT)
+        )
+        recent.reverse()
+        _user_trips(mongo).update_one(
+            {'_id': trip_oid},
+            {
+                '$set': {kind: recent, 'updated_at': datetime.datetime.now(datetime.timezone.utc)},
+                '$inc': {TripItem.COUNT_FIELDS[kind]: -1},
+            }
+        )
+        return True
+
+    @staticmethod
+    def delete_for_trip(mongo, trip_id):
+        """删除行程的全部子资源"""
+        trip_oid = ObjectId(trip_id)
+        for collection in TripItem.COLLECTIONS.values():
+            mongo.db[collection].delete_many({'trip_id': trip_oid})
+
+    @staticmethod
+    def content_id(item):
+        """由记录内容 (发送者、内容、时间等全部字段) 生成稳定的 id，用于客户端没有提供 id 的记录"""
+        content = {key: value for key, value in item.items() if key != 'id'}
+        timestamp = TripItem._parse_timestamp(content.get('timestamp'))
+        if timestamp:
+            content['timestamp'] = timestamp.isoformat() # ISO字符串和 datetime 得到相同的 id
+        raw = json_util.dumps(content, sort_keys=True).encode('utf-8')
+        return 'c' + hashlib.sha1(raw).hexdigest()[:24]
+
+    @staticmethod
+    def _parse_timestamp(value):
+        """客户端可能传入ISO字符串，统一转换为 datetime 以便排序；无法解析时返回 None"""
+        if isinstance(value, datetime.datetime):
+            return value if value.tzinfo else value.replace(tzinfo=datetime.timezone.utc)
+        if isinstance(value, str):
+            try:
+                parsed = datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+            except ValueError:
+                return None
+            return parsed if parsed.tzinfo else parsed.replace(tzinfo=datetime.timezone.utc)
+        return None
+
+    @staticmethod
+    def to_json(item_doc):
+        """将记录转换为JSON友好的格式"""
+        if not item_doc:
+            return None
+        doc = parse_mongo_doc(item_doc)
+        doc.pop('_id', None)
+        return doc
+
+
+def _user_trips(mongo):
+    """行程集合 (user_trip 模块导入了本模块，在函数内导入以避免循环导入)"""
+    from .user_trip import UserTrip
+    return mongo.db[UserTrip.COLLECTION]
@@ -3,6 +3,14 @@ import datetime
 from bson import ObjectId
 # 假设 utils 文件夹与 models 文件夹同级，都在 app 目录下
 from ...utils.type_parsers import parse_mongo_doc # 从 type_parsers 导入
+from ...utils.itinerary_analysis import attach_analysis
+from ...utils.pagination import cursor_filter, split_page
+from ...utils.projection import to_projection
+from ...utils.count_cache import listing_counts
+from ...utils.search_index import (
+    SOURCE_FIELDS, INTERNAL_FIELDS, attach_search_keywords, strip_search_keywords, refresh_keywords,
+    search_filter, relevance_stage, strip_relevance,
+)
 
 class TripPlan:
     """旅行规划模型
@@ -10,6 +18,23 @@ class TripPlan:
     """
     
     COLLECTION = 'tripPlans' # 集合名称
+
+    # 列表摘要视图 (view=summary) 返回的字段: 卡片展示所需的基本信息、评分和 analysis 中的统计
+    SUMMARY_FIELDS = (
+        'name', 'origin', 'destination', 'startDate', 'endDate', 'duration_days', 'tags',
+        'description', 'coverImage', 'creator_id', 'creator_name',
+        'rating', 'average_rating', 'review_count', 'sales_volume', 'usage_count',
+        'platform_price', 'estimated_cost_range', 'created_at', 'updated_at',
+        'analysis.dayCount', 'analysis.activityCount', 'analysis.totalCost',
+    )
+
+    # 列表的排序方式，均以 _id 结尾保证顺序唯一，游标分页按这些键定位
+    SORTS = {
+        'updated_at': [('updated_at', -1), ('_id', -1)],
+        'rating': [('rating', -1), ('updated_at', -1), ('_id', -1)],
+        'relevance': [('relevance', -1), ('updated_at', -1), ('_id', -1)], # 仅用于搜索 (q)
+    }
+    DEFAULT_SORT = 'updated_at'
     
     @staticmethod
     def create_trip_plan(mongo, plan_data):
@@ -32,14 +57,19 @@ class TripPlan:
                         day['date'] = datetime.datetime.strptime(day['date'], '%Y-%m-%d').replace(tzinfo=datetime.timezone.utc)
                     except ValueError:
                         day['date'] = None
+            # 费用汇总、时间冲突等分析结果随文档保存，客户端无需每次重新计算
+            attach_analysis(plan_data)
         
         plan_data['created_at'] = now
         plan_data['updated_at'] = now
+        # 名称、目的地、描述、标签和活动地点的检索关键词 (见 search_index)
+        attach_search_keywords(plan_data)
         
         # 可以添加创建者信息，如果一个计划模板也有创建者
         # plan_data['creator_id'] = 'some_user_id_who_created_template'
 
         result = mongo.db[TripPlan.COLLECTION].insert_one(plan_data)
+        listing_counts.invalidate(TripPlan.COLLECTION)
         return result.inserted_id
     
     @staticmethod
@@ -51,23 +81,65 @@ class TripPlan:
             return None
     
     @staticmethod
-    def get_trip_plans(mongo, filters=None, limit=20, skip=0, sort_by=None):
-        """获取旅行规划列表 (例如用于模板市场或热门推荐)"""
-        query_filters = filters if filters else {}
+    def get_trip_plans(mongo, filters=None, limit=20, skip=0, sort_by=None, projection=None, cursor=None,
+                       search=None):
+        """获取旅行规划列表 (例如用于模板市场或热门推荐)，返回 (规划列表, 下一页游标)
+
+        projection 为MongoDB投影 (如 {'name': 1})，为 None 时返回完整文档。
+        提供 cursor (上一页返回的游标) 时按排序键定位，忽略 skip；cursor 或 search 无效时抛出 ValueError。
+        search 为搜索词，按关键词索引检索，未指定 sort_by 时按相关度排序。
+        """
+        query_filters = TripPlan.search_query(filters, search)
         
-        sort_criteria = [('updated_at', -1)] # 默认排序
-        if sort_by == 'rating': # 假设 TripPlan 也有评分，如果作为模板被评级
-            sort_criteria = [('rating', -1), ('updated_at', -1)]
-        # 可以添加更多排序选项
+        if search and sort_by is None:
+            sort_by = 'relevance'
+        if sort_by not in TripPlan.SORTS or (sort_by == 'relevance' and not search): # 默认按更新时间排序
+            sort_by = TripPlan.DEFAULT_SORT
+        sort_criteria = TripPlan.SORTS[sort_by]
+        keyset = cursor_filter(cursor, sort_criteria, tag=sort_by) if cursor else None
+        if keyset:
+            skip = 0
+        if projection is not None:
+            # 生成下一页游标需要排序字段
+            projection = to_projection(list(projection) + [field for field, _ in sort_criteria])
+
+        if sort_by == 'relevance':
+            # 相关度是计算字段，先按关键词索引取出候选，再计算、排序
+            pipeline = [{'$match': query_filters}, relevance_stage(search)]
+            if keyset:
+                pipeline.append({'$match': keyset})
+            pipeline.extend([{'$sort': dict(sort_criteria)}, {'$skip': skip}, {'$limit': limit + 1}])
+            if projection is not None:
+                pipeline.append({'$project': projection})
+            docs = mongo.db[TripPlan.COLLECTION].aggregate(pipeline)
+        else:
+            if keyset:
+                query_filters = {'$and': [query_filters, keyset]}
+            docs = mongo.db[TripPlan.COLLECTION].find(query_filters, projection).sort(sort_criteria).skip(skip).limit(limit + 1)
+        docs, next_cursor = split_page(list(docs), sort_criteria, limit, tag=sort_by)
+        return strip_relevance(docs), next_cursor
 
-        cursor = mongo.db[TripPlan.COLLECTION].find(query_filters).sort(sort_criteria).skip(skip).limit(limit)
-        return list(cursor)
+    @staticmethod
+    def search_query(filters=None, search=None):
+        """合并过滤条件和搜索词的查询条件"""
+        query_filters = dict(filters) if filters else {}
+        if search:
+            condition = search_filter(search)
+            query_filters = {'$and': [query_filters, condition]} if query_filters else condition
+        return query_filters
+
+    @staticmethod
+    def count_trip_plans(mongo, filters=None, search=None):
+        """旅行规划总数，返回 (总数, 是否精确)，结果短时间缓存"""
+        return listing_counts.count(mongo, TripPlan.COLLECTION, TripPlan.search_query(filters, search))
     
     @staticmethod
     def update_trip_plan(mongo, plan_id, update_data):
         """更新旅行规划"""
         if '_id' in update_data:
             del update_data['_id']
+        for field in INTERNAL_FIELDS: # 检索关键词由服务端生成
+            update_data.pop(field, None)
             
         update_data['updated_at'] = datetime.datetime.now(datetime.timezone.utc)
 
@@ -86,17 +158,24 @@ class TripPlan:
                         day['date'] = datetime.datetime.strptime(day['date'], '%Y-%m-%d').replace(tzinfo=datetime.timezone.utc)
                     except ValueError:
                         day['date'] = None
+            attach_analysis(update_data)
                         
         result = mongo.db[TripPlan.COLLECTION].update_one(
             {'_id': ObjectId(plan_id)},
             {'$set': update_data}
         )
+        if any(field in update_data for field in SOURCE_FIELDS):
+            # 部分字段更新时按完整文档重新生成关键词，引用该方案的用户行程也一并更新
+            refresh_keywords(mongo, TripPlan.COLLECTION, {'_id': ObjectId(plan_id)})
+            refresh_keywords(mongo, 'userTrips', {'plan_id': ObjectId(plan_id)}, plans_collection=TripPlan.COLLECTION)
+        listing_counts.invalidate(TripPlan.COLLECTION)
         return result.modified_count > 0
     
     @staticmethod
     def delete_trip_plan(mongo, plan_id):
         """删除旅行规划"""
         result = mongo.db[TripPlan.COLLECTION].delete_one({'_id': ObjectId(plan_id)})
+        listing_counts.invalidate(TripPlan.COLLECTION)
         # 注意：如果 UserTrip 正在引用此 plan_id，删除策略需要考虑
         # 可能是软删除，或者不允许删除被引用的计划
         return result.deleted_count > 0
@@ -106,4 +185,4 @@ class TripPlan:
         """将TripPlan文档转换为JSON友好的格式"""
         if not trip_plan_doc:
             return None
-        return parse_mongo_doc(trip_plan_doc)
\ No newline at end of file
+        return strip_search_keywords(parse_mongo_doc(trip_plan_doc))
\ No newline at end of file
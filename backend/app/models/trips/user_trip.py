@@ -2,6 +2,15 @@
 import datetime
 from bson import ObjectId
 from ...utils.type_parsers import parse_mongo_doc # 从 type_parsers 导入
+from ...utils.itinerary_analysis import attach_analysis
+from ...utils.pagination import cursor_filter, split_page
+from ...utils.projection import to_projection
+from ...utils.count_cache import listing_counts
+from ...utils.search_index import (
+    SOURCE_FIELDS, INTERNAL_FIELDS, attach_search_keywords, strip_search_keywords, refresh_keywords,
+    search_filter, relevance_stage, strip_relevance,
+)
+from .trip_item import TripItem
 
 class UserTrip:
     """用户旅行方案模型
@@ -10,6 +19,25 @@ class UserTrip:
     """
     
     COLLECTION = 'userTrips'
+
+    # 列表摘要视图 (view=summary) 返回的字段: 卡片展示所需的基本信息、评分和计数，
+    # 不含 days、members、messages、tickets 等大数组
+    SUMMARY_FIELDS = (
+        'plan_id', 'creator_id', 'creator_name', 'creator_avatar', 'user_trip_name_override',
+        'name', 'origin', 'destination', 'startDate', 'endDate', 'tags', 'coverImage',
+        'rating', 'reviewCount', 'price_when_published', 'publish_status', 'travel_status',
+        'message_count', 'feed_count', 'note_count', 'created_at', 'updated_at',
+        'analysis.dayCount', 'analysis.activityCount', 'analysis.totalCost',
+    )
+
+    # 列表的排序方式，均以 _id 结尾保证顺序唯一，游标分页按这些键定位 (对应的复合索引见 mongo_utils)
+    SORTS = {
+        'updated_at': [('updated_at', -1), ('_id', -1)],
+        'rating': [('rating', -1), ('updated_at', -1), ('_id', -1)],
+        'popularity': [('reviewCount', -1), ('updated_at', -1), ('_id', -1)],
+        'relevance': [('relevance', -1), ('updated_at', -1), ('_id', -1)], # 仅用于搜索 (q)
+    }
+    DEFAULT_SORT = 'updated_at'
     
     @staticmethod
     def create_user_trip(mongo, user_trip_data):
@@ -46,6 +74,13 @@ class UserTrip:
         for field in ['members', 'messages', 'tickets', 'feeds', 'notes']:
             if field not in user_trip_data or user_trip_data[field] is None:
                 user_trip_data[field] = []
+
+        # 消息、动态和笔记存放在独立集合中 (见 TripItem)，行程文档只保留计数和最近的记录
+        initial_items = {}
+        for kind, count_field in TripItem.COUNT_FIELDS.items():
+            initial_items[kind] = [item for item in user_trip_data[kind] if isinstance(item, dict)]
+            user_trip_data[kind] = []
+            user_trip_data[count_field] = 0
         
         # 确保创建者是成员之一 (如果业务逻辑需要)
         is_creator_member = False
@@ -62,7 +97,20 @@ class UserTrip:
                     "role": "owner" # 或 'leader'
                 })
         
+        # 独立行程 (不基于模板) 自带 days 时，同样保存分析结果
+        attach_analysis(user_trip_data)
+        # 检索关键词: 行程自身缺少的名称、目的地等取自关联的方案
+        plan = None
+        if isinstance(user_trip_data.get('plan_id'), ObjectId):
+            plan = mongo.db['tripPlans'].find_one({'_id': user_trip_data['plan_id']},
+                                                  {field: 1 for field in SOURCE_FIELDS})
+        attach_search_keywords(user_trip_data, plan)
+        
         result = mongo.db[UserTrip.COLLECTION].insert_one(user_trip_data)
+        listing_counts.invalidate(UserTrip.COLLECTION)
+        for kind, items in initial_items.items():
+            for item in items:
+                TripItem.add_item(mongo, kind, result.inserted_id, item)
         return result.inserted_id
     
     @staticmethod
@@ -99,77 +147,142 @@ class UserTrip:
             return mongo.db[UserTrip.COLLECTION].find_one({'_id': object_id})
             
     @staticmethod
-    def get_user_trips_by_user(mongo, user_id, limit=20, skip=0, populate_plan=False):
-        """获取用户相关的旅行方案 (自己创建的或作为成员的)"""
-        query_filters = {
+    def plan_lookup_stages(plan_projection=None):
+        """关联 TripPlan 的聚合阶段，结果放在 plan_details 字段
+
+        plan_projection 不为 None 时在 $lookup 子管道中投影，只从 tripPlans 取需要的字段。
+        """
+        if plan_projection is None:
+            lookup = {
+                'from': 'tripPlans',  # TripPlan 集合的名称
+                'localField': 'plan_id',
+                'foreignField': '_id',
+                'as': 'plan_details_array' # 结果会是一个数组
+            }
+        else:
+            lookup = {
+                'from': 'tripPlans',
+                'let': {'plan_id': '$plan_id'},
+                'pipeline': [
+                    {'$match': {'$expr': {'$eq': ['$_id', '$$plan_id']}}}, # 等值匹配可以使用 _id 索引
+                    {'$project': plan_projection}
+                ],
+                'as': 'plan_details_array'
+            }
+        return [
+            {'$lookup': lookup},
+            # 将 plan_details_array (通常只有一个元素) 转换为对象
+            {'$addFields': {'plan_details': {'$arrayElemAt': ['$plan_details_array', 0]}}},
+            {'$project': {'plan_details_array': 0}} # 移除临时的数组字段
+        ]
+
+    @staticmethod
+    def find_trips(mongo, query_filters, sort_by, limit, skip, populate_plan, projection=None, cursor=None,
+                   search=None):
+        """按条件分页查询行程，返回 (行程列表, 下一页游标)；没有更多结果时游标为 None
+
+        sort_by 为 SORTS 中的排序方式 (relevance 需要同时提供搜索词 search)；
+        projection 为 ListProjection (None 表示完整文档)。
+        提供 cursor (上一页返回的游标) 时按排序键定位，不再使用 skip，深翻页的代价与第一页相同；
+        cursor 无效时抛出 ValueError。
+        """
+        sort_criteria = UserTrip.SORTS[sort_by]
+        keyset = cursor_filter(cursor, sort_criteria, tag=sort_by) if cursor else None
+        if keyset:
+            skip = 0
+        relevance = relevance_stage(search) if sort_by == 'relevance' else None
+        if keyset and not relevance:
+            query_filters = {'$and': [query_filters, keyset]}
+
+        fields = projection.fields if projection else None
+        plan_fields = projection.plan_fields if projection else None
+        if projection and not projection.include_plan:
+            populate_plan = False
+        if fields is not None:
+            # 生成下一页游标需要排序字段
+            fields = to_projection(list(fields) + [field for field, _ in sort_criteria])
+
+        if populate_plan or relevance:
+            # 使用聚合操作来联接 TripPlan 数据，先分页再关联，只为当前页的行程查询方案
+            pipeline = [{'$match': query_filters}]
+            if relevance:
+                # 相关度是计算字段，先按关键词索引取出候选，再计算、按游标定位
+                pipeline.append(relevance)
+                if keyset:
+                    pipeline.append({'$match': keyset})
+            pipeline.extend([
+                {'$sort': dict(sort_criteria)}, # sort 需要字典
+                {'$skip': skip},
+                {'$limit': limit + 1},
+            ])
+            if populate_plan:
+                pipeline.extend(UserTrip.plan_lookup_stages(plan_fields))
+            elif fields is not None:
+                fields = {name: 1 for name in fields if name != 'plan_details'}
+            if fields is not None:
+                pipeline.append({'$project': fields})
+            docs = list(mongo.db[UserTrip.COLLECTION].aggregate(pipeline))
+        else:
+            if fields is not None:
+                fields = {name: 1 for name in fields if name != 'plan_details'}
+            docs = list(
+                mongo.db[UserTrip.COLLECTION].find(query_filters, fields).sort(sort_criteria).skip(skip).limit(limit + 1)
+            )
+        docs, next_cursor = split_page(docs, sort_criteria, limit, tag=sort_by)
+        return strip_relevance(docs), next_cursor
+
+    @staticmethod
+    def user_trips_filter(user_id):
+        """用户相关的行程 (自己创建的或作为成员的) 的查询条件"""
+        return {
             '$or': [
                 {'creator_id': user_id},
                 {'members.userId': user_id}
             ]
         }
-        
-        if populate_plan:
-            # 使用聚合操作来联接 TripPlan 数据
-            pipeline = [
-                {'$match': query_filters},
-                {'$sort': {'updated_at': -1}},
-                {'$skip': skip},
-                {'$limit': limit},
-                {
-                    '$lookup': {
-                        'from': 'tripPlans',  # TripPlan 集合的名称
-                        'localField': 'plan_id',
-                        'foreignField': '_id',
-                        'as': 'plan_details_array' # 结果会是一个数组
-                    }
-                },
-                { # 将 plan_details_array (通常只有一个元素) 转换为对象或保留数组
-                    '$addFields': {
-                        'plan_details': {'$arrayElemAt': ['$plan_details_array', 0]}
-                    }
-                },
-                {'$project': {'plan_details_array': 0}} # 移除临时的数组字段
-            ]
-            cursor = mongo.db[UserTrip.COLLECTION].aggregate(pipeline)
-        else:
-            cursor = mongo.db[UserTrip.COLLECTION].find(query_filters).sort('updated_at', -1).skip(skip).limit(limit)
-        
-        return list(cursor)
 
     @staticmethod
-    def get_published_user_trips(mongo, filters=None, limit=20, skip=0, sort_by=None, populate_plan=True):
-        """获取已发布的旅行方案 (用于方案市场)，并默认填充计划详情"""
+    def published_filter(filters=None, search=None):
+        """方案市场中已发布行程的查询条件；search 为搜索词 (按关键词索引检索)"""
         query_filters = {'publish_status': 'published'}
         if filters:
             query_filters.update(filters)
-        
-        sort_criteria = [('updated_at', -1)]
-        if sort_by == 'rating':
-            sort_criteria = [('rating', -1), ('updated_at', -1)] # 假设 UserTrip 有 rating
-        elif sort_by == 'popularity':
-             sort_criteria = [('reviewCount', -1), ('updated_at', -1)] # 假设 UserTrip 有 reviewCount
+        if search:
+            query_filters = {'$and': [query_filters, search_filter(search)]}
+        return query_filters
 
-        if populate_plan:
-            pipeline = [
-                {'$match': query_filters},
-                {'$sort': dict(sort_criteria)}, # sort 需要字典
-                {'$skip': skip},
-                {'$limit': limit},
-                {
-                    '$lookup': {
-                        'from': 'tripPlans',
-                        'localField': 'plan_id',
-                        'foreignField': '_id',
-                        'as': 'plan_details_array'
-                    }
-                },
-                {'$addFields': {'plan_details': {'$arrayElemAt': ['$plan_details_array', 0]}}},
-                {'$project': {'plan_details_array': 0}}
-            ]
-            cursor = mongo.db[UserTrip.COLLECTION].aggregate(pipeline)
-        else:
-            cursor = mongo.db[UserTrip.COLLECTION].find(query_filters).sort(sort_criteria).skip(skip).limit(limit)
-        return list(cursor)
+    @staticmethod
+    def get_user_trips_by_user(mongo, user_id, limit=20, skip=0, populate_plan=False, projection=None, cursor=None):
+        """获取用户相关的旅行方案 (自己创建的或作为成员的)，返回 (行程列表, 下一页游标)"""
+        query_filters = UserTrip.user_trips_filter(user_id)
+        return UserTrip.find_trips(mongo, query_filters, UserTrip.DEFAULT_SORT, limit, skip,
+                                   populate_plan, projection, cursor)
+
+    @staticmethod
+    def count_user_trips_by_user(mongo, user_id):
+        """用户相关的行程总数，返回 (总数, 是否精确)，结果短时间缓存"""
+        return listing_counts.count(mongo, UserTrip.COLLECTION, UserTrip.user_trips_filter(user_id))
+
+    @staticmethod
+    def get_published_user_trips(mongo, filters=None, limit=20, skip=0, sort_by=None, populate_plan=True,
+                                 projection=None, cursor=None, search=None):
+        """获取已发布的旅行方案 (用于方案市场)，并默认填充计划详情，返回 (行程列表, 下一页游标)
+
+        search 为搜索词，按关键词索引检索，未指定 sort_by 时按相关度排序；搜索词无效时抛出 ValueError。
+        """
+        query_filters = UserTrip.published_filter(filters, search)
+
+        if search and sort_by is None:
+            sort_by = 'relevance'
+        if sort_by not in UserTrip.SORTS or (sort_by == 'relevance' and not search):
+            sort_by = UserTrip.DEFAULT_SORT
+        return UserTrip.find_trips(mongo, query_filters, sort_by, limit, skip,
+                                   populate_plan, projection, cursor, search)
+
+    @staticmethod
+    def count_published_user_trips(mongo, filters=None, search=None):
+        """已发布行程的总数，返回 (总数, 是否精确)，结果短时间缓存"""
+        return listing_counts.count(mongo, UserTrip.COLLECTION, UserTrip.published_filter(filters, search))
     
     @staticmethod
     def update_user_trip(mongo, trip_id, update_data):
@@ -178,40 +291,52 @@ class UserTrip:
             del update_data['_id']
         if 'plan_id' in update_data: # 通常不应更新plan_id，除非是特殊操作
             del update_data['plan_id'] 
+        for field in INTERNAL_FIELDS: # 检索关键词由服务端生成
+            update_data.pop(field, None)
+
+        # 消息、动态和笔记不整体覆盖，只合并新增的记录；计数由 TripItem 维护
+        added = 0
+        for kind, count_field in TripItem.COUNT_FIELDS.items():
+            update_data.pop(count_field, None)
+            if kind in update_data:
+                added += TripItem.merge_items(mongo, kind, trip_id, update_data.pop(kind))
             
         update_data['updated_at'] = datetime.datetime.now(datetime.timezone.utc)
+        attach_analysis(update_data)
         
         result = mongo.db[UserTrip.COLLECTION].update_one(
             {'_id': ObjectId(trip_id)},
             {'$set': update_data}
         )
-        return result.modified_count > 0
+        if any(field in update_data for field in SOURCE_FIELDS):
+            # 部分字段更新时按完整文档 (及关联的方案) 重新生成检索关键词
+            refresh_keywords(mongo, UserTrip.COLLECTION, {'_id': ObjectId(trip_id)}, plans_collection='tripPlans')
+        listing_counts.invalidate(UserTrip.COLLECTION)
+        return result.modified_count > 0 or added > 0
     
     @staticmethod
     def delete_user_trip(mongo, trip_id):
         """删除用户旅行方案"""
         result = mongo.db[UserTrip.COLLECTION].delete_one({'_id': ObjectId(trip_id)})
+        if result.deleted_count > 0:
+            TripItem.delete_for_trip(mongo, trip_id)
+            listing_counts.invalidate(UserTrip.COLLECTION)
         return result.deleted_count > 0
         
     # --- 子文档操作方法 (add_member, add_message, etc.) ---
-    # 这些方法现在直接操作 UserTrip 中的数组字段，与之前类似
+    # 成员和票务直接操作 UserTrip 中的数组字段；消息、笔记和动态写入独立集合 (见 TripItem)
     @staticmethod
     def add_member(mongo, trip_id, member_data):
         result = mongo.db[UserTrip.COLLECTION].update_one(
             {'_id': ObjectId(trip_id)},
             {'$push': {'members': member_data}, '$set': {'updated_at': datetime.datetime.now(datetime.timezone.utc)}}
         )
+        listing_counts.invalidate(UserTrip.COLLECTION) # 成员变化影响 "我的行程" 的总数
         return result.modified_count > 0
     
     @staticmethod
     def add_message(mongo, trip_id, message_data):
-        if 'timestamp' not in message_data: message_data['timestamp'] = datetime.datetime.now(datetime.timezone.utc)
-        if 'id' not in message_data: message_data['id'] = str(ObjectId())
-        result = mongo.db[UserTrip.COLLECTION].update_one(
-            {'_id': ObjectId(trip_id)},
-            {'$push': {'messages': message_data}, '$set': {'updated_at': datetime.datetime.now(datetime.timezone.utc)}}
-        )
-        return result.modified_count > 0
+        return TripItem.add_item(mongo, TripItem.MESSAGES, trip_id, message_data)
 
     @staticmethod
     def add_ticket(mongo, trip_id, ticket_data):
@@ -224,27 +349,18 @@ class UserTrip:
 
     @staticmethod
     def add_note(mongo, trip_id, note_data): # 行程级笔记
-        if 'timestamp' not in note_data: note_data['timestamp'] = datetime.datetime.now(datetime.timezone.utc)
-        if 'id' not in note_data: note_data['id'] = str(ObjectId())
-        result = mongo.db[UserTrip.COLLECTION].update_one(
-            {'_id': ObjectId(trip_id)},
-            {'$push': {'notes': note_data}, '$set': {'updated_at': datetime.datetime.now(datetime.timezone.utc)}}
-        )
-        return result.modified_count > 0
+        return TripItem.add_item(mongo, TripItem.NOTES, trip_id, note_data)
     
     @staticmethod
     def add_feed(mongo, trip_id, feed_data):
-        if 'timestamp' not in feed_data: feed_data['timestamp'] = datetime.datetime.now(datetime.timezone.utc)
-        if 'id' not in feed_data: feed_data['id'] = str(ObjectId())
-        result = mongo.db[UserTrip.COLLECTION].update_one(
-            {'_id': ObjectId(trip_id)},
-            {'$push': {'feeds': feed_data}, '$set': {'updated_at': datetime.datetime.now(datetime.timezone.utc)}}
-        )
-        return result.modified_count > 0
+        return TripItem.add_item(mongo, TripItem.FEEDS, trip_id, feed_data)
 
     @staticmethod
     def to_json(user_trip_doc):
         """将UserTrip文档转换为JSON友好的格式"""
         if not user_trip_doc:
             return None
-        return parse_mongo_doc(user_trip_doc)
\ No newline at end of file
+        doc = strip_search_keywords(parse_mongo_doc(user_trip_doc))
+        if isinstance(doc.get('plan_details'), dict):
+            strip_search_keywords(doc['plan_details'])
+        return doc
\ No newline at end of file
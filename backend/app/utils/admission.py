@@ -0,0 +1,195 @@
+# app/utils/admission.py
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# 优先级: 登录用户的请求优先于匿名用户和后台任务
+PRIORITY_HIGH = 'high'
+PRIORITY_LOW = 'low'
+PRIORITIES = (PRIORITY_HIGH, PRIORITY_LOW)
+
+# 拒绝原因
+REJECT_QUEUE_FULL = 'queue_full'
+REJECT_TIMEOUT = 'timeout'
+
+# 建议客户端重试间隔(秒)的上下限
+_MIN_RETRY_AFTER = 1
+_MAX_RETRY_AFTER = 60
+
+
+class AdmissionRejected(Exception):
+    """排队已满或排队超时，调用方应返回503并带上 Retry-After"""
+
+    def __init__(self, reason, retry_after, priority):
+        super().__init__(f"AI服务繁忙({reason})，请{retry_after}秒后重试")
+        self.reason = reason
+        self.retry_after = retry_after
+        self.priority = priority
+
+
+class TokenBucket:
+    """令牌桶限流: 每秒补充 rate 个令牌，最多积累 capacity 个"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = max(1.0, float(capacity))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def try_take(self, now):
+        """取一个令牌，成功返回0，否则返回还需等待的秒数 (调用方负责加锁)"""
+        if self.rate <= 0:
+            return 0
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class AdmissionTicket:
+    """已获准的上游调用名额，调用结束后 release (重复调用无副作用)"""
+
+    __slots__ = ('_controller', '_admitted_at', '_released')
+
+    def __init__(self, controller, admitted_at):
+        self._controller = controller
+        self._admitted_at = admitted_at
+        self._released = False
+
+    def release(self):
+        if self._released:
+            return
+        self._released = True
+        self._controller._release(time.monotonic() - self._admitted_at)
+
+
+class AdmissionController:
+    """上游AI调用的准入控制
+
+    - 全局并发上限 max_concurrency 和令牌桶速率 (rate 次/秒，burst 为可积累的突发量)，
+      与上游配额保持一致，超出部分在本地排队而不是触发上游429
+    - 高、低两个优先级各有一个先进先出的队列，只有高优先级队列为空时才放行低优先级请求
+    - 每个优先级有各自的最长排队时间和队列长度，超出时立即抛出 AdmissionRejected，
+      由调用方返回503和 Retry-After
+    - 统计队列深度、排队耗时、放行和拒绝次数
+    """
+
+    def __init__(self, max_concurrency=16, rate=0, burst=None, queue_timeouts=None, max_queue=64):
+        self.max_concurrency = max_concurrency
+        self.bucket = TokenBucket(rate, burst or rate)
+        self.queue_timeouts = dict({PRIORITY_HIGH: 10.0, PRIORITY_LOW: 3.0}, **(queue_timeouts or {}))
+        self.max_queue = max_queue
+        self._queues = {p: deque() for p in PRIORITIES}
+        self._in_flight = 0
+        self._avg_hold = 1.0  # 单次调用占用名额的平均时长(秒)，用于估算 Retry-After
+        self._cond = threading.Condition()
+        self._local = threading.local()
+        self._stats = {
+            p: {'admitted': 0, REJECT_QUEUE_FULL: 0, REJECT_TIMEOUT: 0, 'wait_ms_total': 0.0, 'wait_ms_max': 0.0}
+            for p in PRIORITIES
+        }
+
+    @contextmanager
+    def priority_scope(self, priority, queue_timeout=None):
+        """在当前线程内设置默认优先级和最长排队时间 (用于后台任务代表用户调用上游)"""
+        previous = (getattr(self._local, 'priority', None), getattr(self._local, 'queue_timeout', None))
+        self._local.priority, self._local.queue_timeout = priority, queue_timeout
+        try:
+            yield
+        finally:
+            self._local.priority, self._local.queue_timeout = previous
+
+    @contextmanager
+    def admit(self, priority=None, timeout=None):
+        """获取名额后执行代码块，结束时自动释放"""
+        ticket = self.acquire(priority, timeout)
+        try:
+            yield ticket
+        finally:
+            ticket.release()
+
+    def acquire(self, priority=None, timeout=None):
+        """排队等待名额，返回 AdmissionTicket；排队已满或超时抛出 AdmissionRejected"""
+        priority = priority or getattr(self._local, 'priority', None) or PRIORITY_LOW
+        if timeout is None:
+            timeout = getattr(self._local, 'queue_timeout', None) or self.queue_timeouts[priority]
+        started = time.monotonic()
+        deadline = started + timeout
+        queue = self._queues[priority]
+
+        with self._cond:
+            if len(queue) >= self.max_queue:
+                self._stats[priority][REJECT_QUEUE_FULL] += 1
+                raise AdmissionRejected(REJECT_QUEUE_FULL, self._retry_after_locked(), priority)
+
+            waiter = object()
+            queue.append(waiter)
+            try:
+                while True:
+                    now = time.monotonic()
+                    token_wait = None
+                    if self._is_next_locked(waiter, priority) and self._in_flight < self.max_concurrency:
+                        token_wait = self.bucket.try_take(now)
+                        if token_wait == 0:
+                            break
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        self._stats[priority][REJECT_TIMEOUT] += 1
+                        raise AdmissionRejected(REJECT_TIMEOUT, self._retry_after_locked(), priority)
+                    self._cond.wait(min(remaining, token_wait) if token_wait else remaining)
+            finally:
+                queue.remove(waiter)
+                self._cond.notify_all()
+
+            self._in_flight += 1
+            waited_ms = (time.monotonic() - started) * 1000
+            stats = self._stats[priority]
+            stats['admitted'] += 1
+            stats['wait_ms_total'] += waited_ms
+            stats['wait_ms_max'] = max(stats['wait_ms_max'], waited_ms)
+
+        return AdmissionTicket(self, time.monotonic())
+
+    def _is_next_locked(self, waiter, priority):
+        """waiter 是否排在所有等待者的最前面"""
+        for p in PRIORITIES:
+            if p == priority:
+                return self._queues[p][0] is waiter
+            if self._queues[p]:
+                return False
+        return False
+
+    def _release(self, held):
+        with self._cond:
+            self._in_flight -= 1
+            self._avg_hold = self._avg_hold * 0.9 + held * 0.1
+            self._cond.notify_all()
+
+    def _retry_after_locked(self):
+        """按排队人数、并发上限和速率估算多久之后可能有空闲名额"""
+        queued = sum(len(q) for q in self._queues.values()) + 1
+        estimate = queued * self._avg_hold / max(1, self.max_concurrency)
+        if self.bucket.rate > 0:
+            estimate = max(estimate, queued / self.bucket.rate)
+        return int(min(_MAX_RETRY_AFTER, max(_MIN_RETRY_AFTER, math.ceil(estimate))))
+
+    def stats(self):
+        with self._cond:
+            result = {
+                'in_flight': self._in_flight,
+                'max_concurrency': self.max_concurrency,
+                'rate': self.bucket.rate,
+                'avg_hold_ms': round(self._avg_hold * 1000, 1),
+            }
+            for p in PRIORITIES:
+                stats = dict(self._stats[p])
+                wait_total = stats.pop('wait_ms_total')
+                stats['queued'] = len(self._queues[p])
+                stats['avg_wait_ms'] = round(wait_total / stats['admitted'], 1) if stats['admitted'] else 0.0
+                stats['wait_ms_max'] = round(stats['wait_ms_max'], 1)
+                result[p] = stats
+        return result
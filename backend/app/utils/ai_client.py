@@ -0,0 +1,401 @@
+# app/utils/ai_client.py
+import json
+import random
+import threading
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .ai_logging import AICallLogger
+
+logger = logging.getLogger(__name__)
+
+# 可重试的HTTP状态码: 频率超限和服务端错误
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+# 频率超限说明端点正常工作，只退避重试，不计入熔断器的失败次数
+BREAKER_EXEMPT_STATUS_CODES = {429}
+
+
+class AIClientError(Exception):
+    """AI API调用异常
+
+    status_code 为上游返回的HTTP状态码，网络异常时为None；
+    retryable 表示该错误是否值得重试或切换到备用端点。
+    """
+
+    def __init__(self, message, status_code=None, retryable=False, retry_after=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+    @property
+    def counts_as_failure(self):
+        """是否计入熔断器的失败次数: 可重试的错误中，频率超限 (429) 不计入"""
+        return self.retryable and self.status_code not in BREAKER_EXEMPT_STATUS_CODES
+
+
+class CircuitBreaker:
+    """简单的熔断器
+
+    连续失败次数达到阈值后进入 open 状态，在 reset_timeout 秒内拒绝请求；
+    之后进入 half_open 状态放行一个试探请求，成功则恢复 closed。
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state_locked()
+
+    def _state_locked(self):
+        if self._opened_at is None:
+            return 'closed'
+        if time.monotonic() - self._opened_at >= self.reset_timeout:
+            return 'half_open'
+        return 'open'
+
+    def allow_request(self):
+        """当前是否允许向该端点发送请求"""
+        with self._lock:
+            state = self._state_locked()
+            if state == 'closed':
+                return True
+            if state == 'half_open' and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def release_trial(self):
+        """试探请求以不计入失败的错误 (如429) 结束时，允许下一个请求继续试探"""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                # half_open 试探失败或失败次数达到阈值，重新打开熔断器
+                self._opened_at = time.monotonic()
+
+
+class AIEndpoint:
+    """一个OpenAI兼容的上游端点 (URL + 密钥 + 模型)"""
+
+    def __init__(self, name, api_url, api_key, model, breaker=None):
+        self.name = name
+        self.api_url = api_url
+        self.api_key = api_key
+        self.model = model
+        self.breaker = breaker or CircuitBreaker()
+
+    def is_configured(self):
+        return bool(self.api_url) and bool(self.api_key and self.api_key.strip())
+
+    def same_target(self, other):
+        return (self.api_url, self.api_key, self.model) == (other.api_url, other.api_key, other.model)
+
+
+class AIClient:
+    """带连接池、重试退避、熔断切换和对冲请求的AI API客户端
+
+    所有请求共用一个 requests.Session，以复用TCP/TLS连接。
+    主端点失败(重试耗尽或熔断打开)时自动切换到备用端点；
+    设置 hedge_delay 后，主端点超过该时长未返回时会并行向备用端点发起对冲请求，取先返回的结果。
+    """
+
+    def __init__(self, primary, backup=None, connect_timeout=5, read_timeout=60,
+                 max_retries=2, backoff_base=0.5, backoff_max=8, pool_size=20,
+                 hedge_delay=None, call_logger=None):
+        self.primary = primary
+        # 备用端点与主端点完全相同时，切换没有意义
+        if backup is not None and (not backup.is_configured() or backup.same_target(primary)):
+            backup = None
+        self.backup = backup
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge_delay = hedge_delay if hedge_delay and hedge_delay > 0 else None
+        self.call_logger = call_logger or AICallLogger()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self._hedge_executor = None
+        if self.hedge_delay and self.backup:
+            self._hedge_executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix='ai-hedge')
+
+    def endpoints(self):
+        """按优先级返回已配置密钥的端点"""
+        endpoints = [ep for ep in (self.primary, self.backup) if ep is not None and ep.is_configured()]
+        if not endpoints:
+            message = f"API密钥未设置或为空，无法调用API: {self.primary.api_url}"
+            logger.error(message)
+            raise AIClientError(message)
+        return endpoints
+
+    def status(self):
+        """返回各端点的熔断状态，用于监控"""
+        return {ep.name: ep.breaker.state for ep in (self.primary, self.backup) if ep is not None}
+
+    # --- 非流式调用 ---
+
+    def chat_completion(self, messages, max_tokens=1024):
+        """发起一次非流式对话补全请求，返回解析后的JSON响应"""
+        if self._hedge_executor and self.primary.is_configured() and self.primary.breaker.allow_request():
+            return self._hedged_completion(messages, max_tokens)
+
+        last_error = None
+        for endpoint in self.endpoints():
+            if not endpoint.breaker.allow_request():
+                logger.warning(f"AI端点 {endpoint.name} 熔断中，跳过")
+                continue
+            try:
+                return self._call_with_retries(endpoint, messages, max_tokens)
+            except AIClientError as e:
+                last_error = e
+                if not e.retryable:
+                    raise
+                logger.warning(f"AI端点 {endpoint.name} 调用失败，尝试切换: {e}")
+
+        raise last_error or AIClientError("所有AI端点均不可用(熔断中)", retryable=True)
+
+    def _hedged_completion(self, messages, max_tokens):
+        """主端点先行，超过 hedge_delay 未返回时并行请求备用端点"""
+        futures = {self._hedge_executor.submit(self._call_with_retries, self.primary, messages, max_tokens): self.primary}
+        done, _ = wait(futures, timeout=self.hedge_delay)
+        if not done and self.backup.breaker.allow_request():
+            logger.info(f"主端点 {self.hedge_delay}s 内未返回，向备用端点发起对冲请求")
+            futures[self._hedge_executor.submit(self._call_with_retries, self.backup, messages, max_tokens)] = self.backup
+
+        last_error = None
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    return future.result()
+                except AIClientError as e:
+                    last_error = e
+                    if not e.retryable:
+                        raise
+
+        # 主端点失败且尚未对冲时，退回到普通的切换逻辑
+        if len(futures) == 1 and self.backup.breaker.allow_request():
+            return self._call_with_retries(self.backup, messages, max_tokens)
+        raise last_error
+
+    def _call_with_retries(self, endpoint, messages, max_tokens):
+        payload = self._build_payload(endpoint, messages, max_tokens, stream=False)
+        sampled = self.call_logger.should_sample()
+        self.call_logger.log_body('AI请求体', payload, sampled)
+        attempt = 0
+        while True:
+            started = time.monotonic()
+            try:
+                response = self._post(endpoint, payload, stream=False, attempt=attempt)
+                try:
+                    data = response.json()
+                except ValueError:
+                    error = AIClientError(f"API响应不是有效的JSON: {response.text[:200]}",
+                                          status_code=response.status_code, retryable=True)
+                    self.call_logger.log_call(endpoint.name, endpoint.model, response.status_code,
+                                              (time.monotonic() - started) * 1000, attempt=attempt, error=error)
+                    raise error
+                endpoint.breaker.record_success()
+                self.call_logger.log_call(endpoint.name, endpoint.model, response.status_code,
+                                          (time.monotonic() - started) * 1000,
+                                          usage=data.get('usage'), attempt=attempt)
+                self.call_logger.log_body('AI响应体', data, sampled)
+                return data
+            except AIClientError as e:
+                if e.counts_as_failure:
+                    endpoint.breaker.record_failure()
+                else:
+                    endpoint.breaker.release_trial()
+                if not e.retryable or attempt >= self.max_retries or endpoint.breaker.state == 'open':
+                    raise
+                delay = self._backoff_delay(attempt, e.retry_after)
+                logger.warning(f"AI端点 {endpoint.name} 第{attempt + 1}次调用失败，{delay:.2f}s 后重试: {e}")
+                time.sleep(delay)
+                attempt += 1
+
+    # --- 流式调用 ---
+
+    def stream_chat_completion(self, messages, max_tokens=1024):
+        """发起流式对话补全请求，逐个产出增量文本
+
+        只在收到首个字节之前进行重试和端点切换，开始输出后不再重试。
+        生成器结束时返回 {'usage': ..., 'finish_reason': ..., 'model': ...}，
+        调用方可以通过 `result = yield from ...` 取得。
+        """
+        response, endpoint, started, attempt = self._open_stream(messages, max_tokens)
+        usage = None
+        finish_reason = None
+        chunks = 0
+        with response:
+            try:
+                # OpenAI兼容的SSE格式: 每行 "data: {...}"，以 "data: [DONE]" 结束
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    line = line.decode('utf-8')
+                    if not line.startswith('data:'):
+                        continue
+                    data = line[len('data:'):].strip()
+                    if data == '[DONE]':
+                        break
+                    try:
+                        chunk = json.loads(data)
+                    except ValueError:
+                        logger.warning(f"无法解析流式响应片段: {data[:200]}")
+                        continue
+                    # 开启 include_usage 后，最后一个片段携带整次调用的token用量
+                    usage = chunk.get('usage') or usage
+                    choices = chunk.get('choices') or []
+                    if not choices:
+                        continue
+                    finish_reason = choices[0].get('finish_reason') or finish_reason
+                    delta = (choices[0].get('delta') or {}).get('content')
+                    if delta:
+                        chunks += 1
+                        yield delta
+            except requests.RequestException as e:
+                self.call_logger.log_call(endpoint.name, endpoint.model, response.status_code,
+                                          (time.monotonic() - started) * 1000, usage=usage,
+                                          stream=True, attempt=attempt, error=e)
+                raise AIClientError(f"API流式读取异常: {str(e)}", retryable=True)
+        self.call_logger.log_call(endpoint.name, endpoint.model, response.status_code,
+                                  (time.monotonic() - started) * 1000, usage=usage,
+                                  stream=True, attempt=attempt)
+        return {'usage': usage, 'finish_reason': finish_reason, 'model': endpoint.model}
+
+    def _open_stream(self, messages, max_tokens):
+        """建立流式连接，返回 (response, endpoint, 开始时间, 重试次数)"""
+        last_error = None
+        for endpoint in self.endpoints():
+            if not endpoint.breaker.allow_request():
+                logger.warning(f"AI端点 {endpoint.name} 熔断中，跳过")
+                continue
+            payload = self._build_payload(endpoint, messages, max_tokens, stream=True)
+            self.call_logger.log_body('AI流式请求体', payload)
+            attempt = 0
+            while True:
+                started = time.monotonic()
+                try:
+                    response = self._post(endpoint, payload, stream=True, attempt=attempt)
+                    endpoint.breaker.record_success()
+                    return response, endpoint, started, attempt
+                except AIClientError as e:
+                    last_error = e
+                    if not e.counts_as_failure:
+                        endpoint.breaker.release_trial()
+                    if not e.retryable:
+                        raise
+                    if e.counts_as_failure:
+                        endpoint.breaker.record_failure()
+                    if attempt >= self.max_retries or endpoint.breaker.state == 'open':
+                        break
+                    time.sleep(self._backoff_delay(attempt, e.retry_after))
+                    attempt += 1
+        raise last_error or AIClientError("所有AI端点均不可用(熔断中)", retryable=True)
+
+    # --- 底层请求 ---
+
+    def _build_payload(self, endpoint, messages, max_tokens, stream):
+        payload = {
+            'model': endpoint.model,
+            'messages': messages,
+            'stream': stream,
+        }
+        # 仅在需要更多token时添加max_tokens
+        if max_tokens > 1024:
+            payload['max_tokens'] = int(max_tokens)
+        if stream:
+            # 让流式响应在最后返回token用量，用于调用日志
+            payload['stream_options'] = {'include_usage': True}
+        return payload
+
+    def _post(self, endpoint, payload, stream, attempt=0):
+        headers = {
+            'Content-Type': 'application/json',
+            'Authorization': f'Bearer {endpoint.api_key}',
+        }
+        logger.debug(f"正在调用AI端点 {endpoint.name}: {endpoint.api_url}，模型: {endpoint.model}")
+        started = time.monotonic()
+        try:
+            response = self.session.post(
+                endpoint.api_url,
+                headers=headers,
+                json=payload,
+                timeout=self.timeout,
+                stream=stream,
+            )
+        except requests.RequestException as e:
+            self.call_logger.log_call(endpoint.name, endpoint.model, None,
+                                      (time.monotonic() - started) * 1000,
+                                      stream=stream, attempt=attempt, error=e)
+            raise AIClientError(f"API请求异常: {str(e)}", retryable=True)
+
+        if response.status_code == 200:
+            return response
+        try:
+            error = self._error_from_response(response)
+            self.call_logger.log_call(endpoint.name, endpoint.model, response.status_code,
+                                      (time.monotonic() - started) * 1000,
+                                      stream=stream, attempt=attempt, error=error)
+            raise error
+        finally:
+            response.close()
+
+    @staticmethod
+    def _error_from_response(response):
+        status = response.status_code
+        if status == 401:
+            message = "API认证失败: 无效的API密钥或未授权。请检查DeepSeek API密钥是否正确和有效。"
+        elif status == 400:
+            message = f"API请求参数错误: {response.text}"
+        elif status == 422:
+            message = f"API请求格式错误或签名验证失败: {response.text}。请检查DeepSeek API密钥和请求参数。"
+        elif status == 429:
+            message = f"API请求频率超限: {response.text}"
+        else:
+            message = f"API请求失败: {status} - {response.text}"
+
+        retry_after = None
+        header = response.headers.get('Retry-After') if response.headers else None
+        if header:
+            try:
+                retry_after = float(header)
+            except ValueError:
+                retry_after = None
+        return AIClientError(message, status_code=status,
+                             retryable=status in RETRYABLE_STATUS_CODES,
+                             retry_after=retry_after)
+
+    def _backoff_delay(self, attempt, retry_after=None):
+        """指数退避 (带抖动)，优先遵循上游的 Retry-After"""
+        if retry_after is not None:
+            return min(retry_after, self.backoff_max)
+        delay = min(self.backoff_base * (2 ** attempt), self.backoff_max)
+        return delay * (0.5 + random.random() / 2)
@@ -0,0 +1,172 @@
+# app/utils/ai_logging.py
+import json
+import logging
+import random
+import re
+import threading
+
+# 默认脱敏的字段名 (不区分大小写)
+DEFAULT_REDACT_FIELDS = ('authorization', 'api_key', 'apikey', 'password', 'token',
+                         'access_token', 'refresh_token', 'secret')
+
+# 字符串中的密钥写法: "Bearer xxx" 与 "sk-xxx"
+_SECRET_RE = re.compile(r'(Bearer\s+)[A-Za-z0-9._\-]+|\bsk-[A-Za-z0-9]{8,}')
+REDACTED = '***'
+
+
+def redact_text(text):
+    """把文本中的 Bearer 令牌和 sk- 密钥替换为 ***"""
+    return _SECRET_RE.sub(lambda m: (m.group(1) or '') + REDACTED, text)
+
+
+def redact(value, fields=DEFAULT_REDACT_FIELDS):
+    """递归复制数据，将敏感字段的值替换为 ***"""
+    if isinstance(value, dict):
+        return {
+            k: REDACTED if isinstance(k, str) and k.lower() in fields else redact(v, fields)
+            for k, v in value.items()
+        }
+    if isinstance(value, (list, tuple)):
+        return [redact(v, fields) for v in value]
+    if isinstance(value, str):
+        return redact_text(value)
+    return value
+
+
+class LazyJSON:
+    """延迟序列化的日志参数
+
+    作为 logger.xxx("%s", LazyJSON(obj)) 的参数传入，只有日志真正输出时才会
+    执行脱敏和 json.dumps，级别被过滤掉的日志不产生任何序列化开销。
+    """
+
+    __slots__ = ('value', 'max_chars', 'fields')
+
+    def __init__(self, value, max_chars=2000, fields=DEFAULT_REDACT_FIELDS):
+        self.value = value
+        self.max_chars = max_chars
+        self.fields = fields
+
+    def __str__(self):
+        try:
+            text = json.dumps(redact(self.value, self.fields), ensure_ascii=False, default=str)
+        except (TypeError, ValueError):
+            text = redact_text(repr(self.value))
+        if self.max_chars and len(text) > self.max_chars:
+            return f"{text[:self.max_chars]}...(共{len(text)}字符)"
+        return text
+
+
+class RedactingFilter(logging.Filter):
+    """兜底的日志过滤器: 输出前去掉消息文本中的密钥"""
+
+    def filter(self, record):
+        message = record.getMessage()
+        redacted = redact_text(message)
+        if redacted != message:
+            record.msg = redacted
+            record.args = None
+        return True
+
+
+class AICallLogger:
+    """AI上游调用的结构化日志
+
+    - 每次上游调用输出一条紧凑的摘要 (端点、模型、状态、耗时、token用量)，
+      结构化字段同时放在 record.ai_call 中，便于JSON格式的日志处理器采集
+    - 请求/响应体按 body_sample_rate 抽样以 INFO 级别输出，未抽中时只在 DEBUG 级别输出；
+      两者都是延迟序列化并经过脱敏的
+    - 累计调用次数、失败次数和token用量，供 /api/ai/stats 展示；上游返回的
+      prompt_cache_hit_tokens/prompt_cache_miss_tokens 单独累计，得到提示词缓存命中率
+    """
+
+    def __init__(self, logger=None, body_sample_rate=0.0, body_max_chars=2000, redact_fields=None):
+        self.logger = logger or logging.getLogger('app.ai.calls')
+        self.body_sample_rate = body_sample_rate
+        self.body_max_chars = body_max_chars
+        self.redact_fields = tuple(DEFAULT_REDACT_FIELDS) + tuple(
+            f.lower() for f in (redact_fields or ()) if f
+        )
+        self._lock = threading.Lock()
+        self._stats = {
+            'calls': 0,
+            'errors': 0,
+            'prompt_tokens': 0,
+            'completion_tokens': 0,
+            'prompt_cache_hit_tokens': 0,
+            'prompt_cache_miss_tokens': 0,
+            'latency_ms_total': 0.0,
+        }
+
+    def should_sample(self):
+        """本次调用是否记录完整的请求/响应体"""
+        return self.body_sample_rate > 0 and random.random() < self.body_sample_rate
+
+    def log_body(self, label, value, sampled=None):
+        """记录请求或响应体；sampled 为 None 时按抽样率决定"""
+        if sampled is None:
+            sampled = self.should_sample()
+        level = logging.INFO if sampled else logging.DEBUG
+        if self.logger.isEnabledFor(level):
+            self.logger.log(level, "%s: %s", label, LazyJSON(value, self.body_max_chars, self.redact_fields))
+
+    def log_call(self, endpoint, model, status, latency_ms, usage=None, stream=False,
+                 attempt=0, error=None):
+        """记录一次上游调用的摘要"""
+        usage = usage or {}
+        record = {
+            'endpoint': endpoint,
+            'model': model,
+            'status': status,
+            'latency_ms': round(latency_ms, 1),
+            'prompt_tokens': usage.get('prompt_tokens'),
+            'completion_tokens': usage.get('completion_tokens'),
+            'prompt_cache_hit_tokens': usage.get('prompt_cache_hit_tokens'),
+            'prompt_cache_miss_tokens': usage.get('prompt_cache_miss_tokens'),
+            'stream': stream,
+            'attempt': attempt,
+        }
+        if error:
+            record['error'] = redact_text(str(error))[:200]
+
+        with self._lock:
+            self._stats['calls'] += 1
+            if error or status != 200:
+                self._stats['errors'] += 1
+            self._stats['prompt_tokens'] += usage.get('prompt_tokens') or 0
+            self._stats['completion_tokens'] += usage.get('completion_tokens') or 0
+            self._stats['prompt_cache_hit_tokens'] += usage.get('prompt_cache_hit_tokens') or 0
+            self._stats['prompt_cache_miss_tokens'] += usage.get('prompt_cache_miss_tokens') or 0
+            self._stats['latency_ms_total'] += latency_ms
+
+        level = logging.WARNING if error else logging.INFO
+        if self.logger.isEnabledFor(level):
+            self.logger.log(
+                level,
+                "ai_call endpoint=%s model=%s status=%s latency_ms=%.0f prompt_tokens=%s "
+                "completion_tokens=%s cache_hit_tokens=%s cache_miss_tokens=%s stream=%s attempt=%s%s",
+                endpoint, model, status, latency_ms, record['prompt_tokens'],
+                record['completion_tokens'], record['prompt_cache_hit_tokens'],
+                record['prompt_cache_miss_tokens'], stream, attempt,
+                f" error={record['error']}" if error else '',
+                extra={'ai_call': record},
+            )
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        calls = stats.pop('calls')
+        latency_total = stats.pop('latency_ms_total')
+        stats['calls'] = calls
+        stats['avg_latency_ms'] = round(latency_total / calls, 1) if calls else 0.0
+        cached = stats['prompt_cache_hit_tokens'] + stats['prompt_cache_miss_tokens']
+        stats['prompt_cache_hit_rate'] = round(stats['prompt_cache_hit_tokens'] / cached, 4) if cached else 0.0
+        return stats
+
+
+def install_redaction(*logger_names):
+    """为指定的 logger 安装脱敏过滤器 (重复调用不会重复安装)"""
+    for name in logger_names:
+        target = logging.getLogger(name)
+        if not any(isinstance(f, RedactingFilter) for f in target.filters):
+            target.addFilter(RedactingFilter())
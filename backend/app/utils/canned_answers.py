@@ -0,0 +1,240 @@
+# app/utils/canned_answers.py
+import datetime
+import hashlib
+import re
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+_CHIP_NORMALIZE_RE = re.compile(r'[\s?？!！。.]+')
+
+
+def normalize_chip(text):
+    """规范化建议选项文本: 去掉空白和结尾标点，英文转小写"""
+    return _CHIP_NORMALIZE_RE.sub('', (text or '')).lower()
+
+
+def content_hash(text):
+    return hashlib.sha256((text or '').encode('utf-8')).hexdigest()[:16]
+
+
+class CannedAnswerStore:
+    """建议选项 (chip) 的预生成回答
+
+    固定的建议选项对所有用户都是相同的输入，回答在后台按计划预先生成并带版本号，
+    保存在内存和 MongoDB 中 (多个worker共享)。聊天历史为空，或历史只由预生成的
+    问答组成时，直接从内存返回，不调用上游。
+    后台线程定期: 从MongoDB加载其他worker生成的新版本、写回使用次数、
+    重新生成缺失/提示词已变化的回答，以及最近被使用过且已过期的回答；
+    没人使用的选项不会被刷新。
+    """
+
+    COLLECTION = 'aiCannedAnswers'
+
+    # 刷新租约时长(秒): 同一选项同时只有一个worker在生成
+    LEASE_SECONDS = 300
+
+    def __init__(self, mongo, prompts, generate_fn, fingerprint='', check_interval=300,
+                 max_age=86400, refresh_batch=4):
+        self.mongo = mongo
+        self.prompts = {normalize_chip(p): p for p in prompts}
+        self.generate_fn = generate_fn
+        self.fingerprint = fingerprint  # 系统提示词和模型变化后，旧版本回答视为过期
+        self.check_interval = check_interval
+        self.max_age = max_age
+        self.refresh_batch = refresh_batch
+        self._answers = {}            # key -> {'answer', 'version', 'fingerprint', 'generated_at'}
+        self._answer_hashes = set()   # 当前各回答的哈希，用于判断历史是否只含预生成问答
+        self._pending_usage = {}      # 尚未写回MongoDB的使用次数
+        self._recent_usage = {}       # 自上次刷新以来的使用次数，用于决定刷新哪些选项
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self._stats = {'served': 0, 'misses': 0, 'refreshes': 0, 'refresh_failures': 0}
+
+    # --- 查询 ---
+
+    def lookup(self, message, history=None):
+        """返回预生成的回答；不满足条件时返回 None"""
+        key = normalize_chip(message)
+        if key not in self.prompts:
+            return None
+        with self._lock:
+            self._recent_usage[key] = self._recent_usage.get(key, 0) + 1
+            self._pending_usage[key] = self._pending_usage.get(key, 0) + 1
+            entry = self._answers.get(key)
+            if entry is None or not self._history_is_canned(history):
+                self._stats['misses'] += 1
+                return None
+            self._stats['served'] += 1
+            return entry['answer']
+
+    def _history_is_canned(self, history):
+        """历史为空，或只包含预生成的问答 (用户消息为建议选项、助手回复为当前版本的回答)"""
+        for turn in history or []:
+            content = turn.get('content')
+            if turn.get('role') == 'user':
+                if normalize_chip(content) not in self.prompts:
+                    return False
+            elif content_hash(content) not in self._answer_hashes:
+                return False
+        return True
+
+    # --- 后台刷新 ---
+
+    def start(self):
+        """启动后台刷新线程 (重复调用无副作用)"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='canned-answers', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.refresh_once()
+            except Exception as e:
+                logger.warning(f"刷新预生成回答失败: {e}")
+            self._stop.wait(self.check_interval)
+
+    def refresh_once(self):
+        """执行一轮: 加载、写回使用次数、生成需要刷新的回答"""
+        self._load()
+        self._flush_usage()
+        for key in self._select_for_refresh():
+            self._refresh(key)
+
+    def _load(self):
+        if self.mongo is None:
+            return
+        docs = self.mongo.db[self.COLLECTION].find(
+            {'_id': {'$in': list(self.prompts)}, 'answer': {'$ne': None}}
+        )
+        with self._lock:
+            for doc in docs:
+                current = self._answers.get(doc['_id'])
+                if current is None or doc.get('version', 0) > current['version']:
+                    self._set_answer_locked(doc['_id'], doc)
+
+    def _flush_usage(self):
+        with self._lock:
+            pending, self._pending_usage = self._pending_usage, {}
+        if self.mongo is None or not pending:
+            return
+        now = datetime.datetime.now(datetime.timezone.utc)
+        for key, count in pending.items():
+            try:
+                self.mongo.db[self.COLLECTION].update_one(
+                    {'_id': key},
+                    {'$inc': {'usage_count': count}, '$set': {'last_used_at': now},
+                     '$setOnInsert': {'prompt': self.prompts[key], 'version': 0}},
+                    upsert=True
+                )
+            except Exception as e:
+                logger.warning(f"写回预生成回答使用次数失败: {e}")
+
+    def _select_for_refresh(self):
+        """缺失或提示词已变化的优先；其余按最近使用次数从高到低选取已过期的回答"""
+        now = time.time()
+        with self._lock:
+            missing = [k for k in self.prompts
+                       if k not in self._answers or self._answers[k]['fingerprint'] != self.fingerprint]
+            expired = [k for k, count in sorted(self._recent_usage.items(), key=lambda item: -item[1])
+                       if count > 0 and k in self._answers and k not in missing
+                       and now - self._answers[k]['generated_at'] >= self.max_age]
+        return (missing + expired)[:self.refresh_batch]
+
+    def _refresh(self, key):
+        if not self._acquire_lease(key):
+            return
+        try:
+            answer = self.generate_fn(self.prompts[key])
+        except Exception as e:
+            logger.warning(f"生成预生成回答失败({self.prompts[key]}): {e}")
+            with self._lock:
+                self._stats['refresh_failures'] += 1
+            self._release_lease(key)
+            return
+        if not answer:
+            self._release_lease(key)
+            return
+
+        now = datetime.datetime.now(datetime.timezone.utc)
+        doc = {'_id': key, 'answer': answer, 'fingerprint': self.fingerprint, 'generated_at': now}
+        if self.mongo is not None:
+            saved = self.mongo.db[self.COLLECTION].find_one_and_update(
+                {'_id': key},
+                {'$set': {'answer': answer, 'fingerprint': self.fingerprint, 'prompt': self.prompts[key],
+                          'generated_at': now, 'lease_until': None},
+                 '$inc': {'version': 1}},
+                upsert=True, return_document=True
+            )
+            doc['version'] = saved.get('version', 1) if saved else 1
+        else:
+            doc['version'] = self._answers.get(key, {}).get('version', 0) + 1
+
+        with self._lock:
+            self._set_answer_locked(key, doc)
+            self._recent_usage[key] = 0
+            self._stats['refreshes'] += 1
+        logger.info(f"预生成回答已更新: {self.prompts[key]} (版本 {doc['version']})")
+
+    def _acquire_lease(self, key):
+        if self.mongo is None:
+            return True
+        now = datetime.datetime.now(datetime.timezone.utc)
+        try:
+            self.mongo.db[self.COLLECTION].update_one(
+                {'_id': key},
+                {'$setOnInsert': {'prompt': self.prompts[key], 'version': 0, 'lease_until': None}},
+                upsert=True
+            )
+            result = self.mongo.db[self.COLLECTION].update_one(
+                {'_id': key, '$or': [{'lease_until': None}, {'lease_until': {'$lt': now}}]},
+                {'$set': {'lease_until': now + datetime.timedelta(seconds=self.LEASE_SECONDS)}}
+            )
+        except Exception as e:
+            logger.warning(f"获取预生成回答刷新租约失败: {e}")
+            return False
+        return result.modified_count > 0
+
+    def _release_lease(self, key):
+        if self.mongo is None:
+            return
+        try:
+            self.mongo.db[self.COLLECTION].update_one({'_id': key}, {'$set': {'lease_until': None}})
+        except Exception as e:
+            logger.warning(f"释放预生成回答刷新租约失败: {e}")
+
+    def _set_answer_locked(self, key, doc):
+        generated_at = doc.get('generated_at')
+        if isinstance(generated_at, datetime.datetime):
+            if generated_at.tzinfo is None:
+                generated_at = generated_at.replace(tzinfo=datetime.timezone.utc)
+            generated_at = generated_at.timestamp()
+        self._answers[key] = {
+            'answer': doc['answer'],
+            'version': doc.get('version', 0),
+            'fingerprint': doc.get('fingerprint', ''),
+            'generated_at': generated_at or time.time(),
+        }
+        self._answer_hashes = {content_hash(entry['answer']) for entry in self._answers.values()}
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._answers)
+            stats['chips'] = {
+                self.prompts[key]: {
+                    'version': self._answers[key]['version'] if key in self._answers else None,
+                    'recent_usage': self._recent_usage.get(key, 0),
+                }
+                for key in self.prompts
+            }
+        return stats
@@ -0,0 +1,96 @@
+# app/utils/chat_context.py
+import re
+
+# 中日韩字符按每字约一个token估算，其余字符按每4个字符一个token估算
+_CJK_RE = re.compile(r'[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uff00-\uffef]')
+
+# 每条消息的固定开销 (角色、分隔符等)
+_MESSAGE_OVERHEAD = 4
+
+
+def normalize_history(history):
+    """把客户端传来的历史记录统一为 [{'role', 'content'}]
+
+    兼容三种写法: {'role', 'content'}、{'isUserMessage', 'content'}、
+    {'isUserMessage', 'text'}；无法识别的条目直接丢弃。
+    """
+    formatted_history = []
+    for msg in history or []:
+        if not isinstance(msg, dict):
+            continue
+        if 'role' in msg and 'content' in msg:
+            # 已经是正确格式
+            formatted_history.append({'role': msg['role'], 'content': msg['content']})
+        elif 'isUserMessage' in msg and 'content' in msg:
+            role = 'user' if msg['isUserMessage'] else 'assistant'
+            formatted_history.append({'role': role, 'content': msg['content']})
+        elif 'isUserMessage' in msg and 'text' in msg:
+            # 使用text字段
+            role = 'user' if msg['isUserMessage'] else 'assistant'
+            formatted_history.append({'role': role, 'content': msg['text']})
+    return formatted_history
+
+
+def estimate_tokens(text):
+    """粗略估算文本的token数，用于控制上下文长度"""
+    if not text:
+        return 0
+    text = str(text)
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def message_tokens(message):
+    return estimate_tokens(message.get('content')) + _MESSAGE_OVERHEAD
+
+
+def fit_to_budget(turns, budget):
+    """从最新的消息往前保留，直到超出 token 预算；至少保留最后一条"""
+    kept = []
+    used = 0
+    for turn in reversed(turns):
+        cost = message_tokens(turn)
+        if kept and used + cost > budget:
+            break
+        kept.append(turn)
+        used += cost
+    kept.reverse()
+    # 不以助手消息开头，避免上下文从半轮对话开始
+    while len(kept) > 1 and kept[0].get('role') == 'assistant':
+        kept.pop(0)
+    return kept
+
+
+def build_context_messages(system_prompt, turns, user_message, budget, summary=None):
+    """组装发送给模型的消息: 系统提示、历史摘要、预算内的最近消息和当前消息"""
+    messages = [{'role': 'system', 'content': system_prompt}]
+    if summary:
+        messages.append({'role': 'system', 'content': f"此前对话的摘要：\n{summary}"})
+        budget -= estimate_tokens(summary) + _MESSAGE_OVERHEAD
+    if turns and budget > 0:
+        messages.extend({'role': t['role'], 'content': t['content']} for t in fit_to_budget(turns, budget))
+    messages.append({'role': 'user', 'content': user_message})
+    return messages
+
+
+def unsummarized_turns(conversation):
+    """返回会话中尚未压缩进摘要、且仍保存在文档中的消息"""
+    turns = conversation.get('turns') or []
+    turn_count = conversation.get('turn_count') or len(turns)
+    first_stored = turn_count - len(turns)  # turns[0] 对应的累计序号
+    skip = max(0, (conversation.get('summarized_count') or 0) - first_stored)
+    return turns[skip:]
+
+
+def plan_summarization(conversation, budget, keep_turns):
+    """判断会话是否需要压缩
+
+    未压缩的消息超过预算时，返回 (需要压缩的消息, 压缩后的 summarized_count)，
+    最近的 keep_turns 条消息保留原文；不需要压缩时返回 None。
+    """
+    pending = unsummarized_turns(conversation)
+    if sum(message_tokens(t) for t in pending) <= budget or len(pending) <= keep_turns:
+        return None
+    to_summarize = pending[:len(pending) - keep_turns]
+    turn_count = conversation.get('turn_count') or len(conversation.get('turns') or [])
+    return to_summarize, turn_count - keep_turns
@@ -0,0 +1,110 @@
+# app/utils/count_cache.py
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from bson import json_util
+from pymongo.errors import ExecutionTimeout
+
+logger = logging.getLogger(__name__)
+
+# 顺序无关的数组运算符，规范化时对其中的值排序
+_UNORDERED_OPERATORS = ('$in', '$nin', '$all')
+
+
+def normalize_filter(value):
+    """把查询条件转换为稳定的形式: 键按字母排序，$in 等运算符中的值排序
+
+    键顺序或 $in 中值的顺序不同的等价条件会得到相同的缓存键。
+    """
+    if isinstance(value, dict):
+        return {
+            key: (sorted((normalize_filter(v) for v in item), key=json_util.dumps)
+                  if key in _UNORDERED_OPERATORS and isinstance(item, list) else normalize_filter(item))
+            for key, item in sorted(value.items())
+        }
+    if isinstance(value, list):
+        return [normalize_filter(item) for item in value]
+    return value
+
+
+class CountCache:
+    """列表总数的缓存
+
+    - 有过滤条件时用 count_documents 精确计数，按 (集合, 规范化的条件) 缓存 ttl 秒；
+      计数超过 max_time_ms 时放弃，返回之前缓存的结果或集合的估算总数 (标记为非精确)
+    - 没有过滤条件时用 estimated_document_count (读取集合元数据，不扫描文档)，标记为非精确
+    - 本进程对集合的写操作通过 invalidate 清除该集合的缓存；其他进程的写入最多延迟 ttl 秒反映
+    """
+
+    def __init__(self, ttl=30, max_time_ms=2000, max_entries=1000):
+        self.ttl = ttl
+        self.max_time_ms = max_time_ms
+        self.max_entries = max_entries
+        self._entries = OrderedDict()   # (集合, 条件) -> (总数, 是否精确, 写入时间)
+        self._stale = {}                # 被清除或过期的结果，计数超时时作为兜底
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'estimated': 0, 'timeouts': 0, 'invalidations': 0}
+
+    def count(self, mongo, collection, filters=None):
+        """返回 (总数, 是否精确)"""
+        filters = filters or {}
+        key = (collection, json_util.dumps(normalize_filter(filters)))
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry[2] < self.ttl:
+                self._entries.move_to_end(key)
+                self._stats['hits'] += 1
+                return entry[0], entry[1]
+            self._stats['misses'] += 1
+
+        db_collection = mongo.db[collection]
+        if not filters:
+            total, exact = db_collection.estimated_document_count(), False
+            with self._lock:
+                self._stats['estimated'] += 1
+        else:
+            try:
+                total, exact = db_collection.count_documents(filters, maxTimeMS=self.max_time_ms), True
+            except ExecutionTimeout:
+                logger.warning(f"{collection} 计数超过 {self.max_time_ms}ms，返回估算的总数")
+                with self._lock:
+                    self._stats['timeouts'] += 1
+                    stale = self._stale.get(key)
+                if stale is not None:
+                    return stale, False
+                return db_collection.estimated_document_count(), False
+
+        with self._lock:
+            self._entries[key] = (total, exact, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._stale.pop(key, None)
+            self._stale[key] = total
+            while len(self._stale) > self.max_entries:
+                del self._stale[next(iter(self._stale))]
+        return total, exact
+
+    def invalidate(self, collection):
+        """集合有写入时清除其全部缓存的计数"""
+        with self._lock:
+            keys = [key for key in self._entries if key[0] == collection]
+            for key in keys:
+                del self._entries[key]
+            self._stats['invalidations'] += 1
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, entries=len(self._entries))
+
+
+# 方案市场和行程列表的总数缓存；tripPlans / userTrips 的写操作 (见模型) 会清除对应集合的缓存
+listing_counts = CountCache(
+    ttl=float(os.getenv('TRIPS_COUNT_CACHE_TTL', 30)),
+    max_time_ms=int(os.getenv('TRIPS_COUNT_MAX_TIME_MS', 2000)),
+    max_entries=int(os.getenv('TRIPS_COUNT_CACHE_SIZE', 1000)),
+)
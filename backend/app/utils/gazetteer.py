@@ -0,0 +1,263 @@
+# app/utils/gazetteer.py
+import json
+import os
+import re
+import logging
+from collections import deque
+
+from .text_numbers import NUMBER_PATTERN as _NUM, parse_number
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DATA_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'gazetteer.json')
+
+# 天数写法: 5天 / 五日游 / 3天2晚 / 两晚 / 一周 / 两个星期；"5月1日" 与 "第3天" 不算行程天数
+_DAYS_RE = re.compile(r'(?<![月第\d零一二两三四五六七八九十])' + _NUM + r'\s*(?:个)?\s*(天|日|晚|夜|周|星期|礼拜)')
+_WEEKEND_RE = re.compile(r'周末|双休')
+
+# 出发地标记: "从上海出发" / "上海出发"
+_ORIGIN_BEFORE = frozenset('从由自')
+_ORIGIN_AFTER = frozenset(('出发', '启程', '动身'))
+# 目的地标记: "去成都" / "到三亚" / "飞往东京" (检查地名前两个字符)
+_DEST_BEFORE = frozenset('去到游逛往玩赴至')
+
+# 词典中没有命中时的兜底写法 (与原先的规则一致)
+_FALLBACK_PATTERNS = [re.compile(p) for p in (
+    r'去([\u4e00-\u9fa5]{2,4})旅游',
+    r'去([\u4e00-\u9fa5]{2,4})玩',
+    r'([\u4e00-\u9fa5]{2,4})之旅',
+    r'([\u4e00-\u9fa5]{2,4})游玩',
+    r'([\u4e00-\u9fa5]{2,4})旅行',
+)]
+# 兜底写法捕获到的泛指词不是目的地，如 "去哪里玩"
+_FALLBACK_STOPWORDS = ('哪', '什么', '这里', '那里', '这个', '那个', '一个', '地方')
+
+
+class AhoCorasick:
+    """Aho-Corasick 多模式匹配自动机
+
+    构建后对文本只扫描一遍，即可找出所有词典词的出现位置，耗时与文本长度
+    和命中数成正比，与词典大小无关。
+    """
+
+    def __init__(self):
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]   # 每个状态上结束的模式: [(长度, 值)]
+        self._built = False
+
+    def add(self, word, value):
+        """加入一个模式；同一模式重复加入时保留第一次的值"""
+        if not word:
+            return
+        state = 0
+        for ch in word:
+            nxt = self._goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            state = nxt
+        if not self._output[state]:
+            self._output[state].append((len(word), value))
+        self._built = False
+
+    def build(self):
+        """计算失配指针，并把后缀状态上的输出合并进来"""
+        queue = deque()
+        for nxt in self._goto[0].values():
+            self._fail[nxt] = 0
+            queue.append(nxt)
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fail = self._fail[state]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(ch, 0)
+                self._output[nxt] = self._output[nxt] + self._output[self._fail[nxt]]
+        self._built = True
+
+    def find_all(self, text):
+        """返回所有命中 [(起始位置, 结束位置, 值)]，包含相互重叠的命中"""
+        if not self._built:
+            self.build()
+        goto, fail, output = self._goto, self._fail, self._output
+        root = goto[0]
+        matches = []
+        state = 0
+        for index, ch in enumerate(text):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0) if state else root.get(ch, 0)
+            if output[state]:
+                for length, value in output[state]:
+                    matches.append((index - length + 1, index + 1, value))
+        return matches
+
+    def __len__(self):
+        return len(self._goto)
+
+
+class Gazetteer:
+    """地名与标签词典
+
+    从 data/gazetteer.json 加载城市、县市、景区、景点、境外目的地及其别名，
+    以及标签同义词表，编译为一个 Aho-Corasick 自动机，对提示词扫描一遍即可
+    同时得到目的地候选和标签。
+    """
+
+    MAX_DAYS = 30
+
+    def __init__(self, places, tag_synonyms):
+        self.places = {}
+        self.tags = list(tag_synonyms)
+        self._tag_order = {tag: index for index, tag in enumerate(self.tags)}
+        self._automaton = AhoCorasick()
+
+        for place in places:
+            self.places[place['name']] = place
+            names = list(place.get('aliases') or [])
+            if place.get('match_name', True):
+                names.insert(0, place['name'])
+            for name in names:
+                self._automaton.add(name.lower(), ('place', place['name']))
+        for tag, synonyms in tag_synonyms.items():
+            for word in [tag] + list(synonyms):
+                self._automaton.add(word.lower(), ('tag', tag))
+        self._automaton.build()
+
+    @classmethod
+    def load(cls, path=None):
+        """从JSON数据文件加载词典"""
+        path = path or DEFAULT_DATA_PATH
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+        gazetteer = cls(data.get('places') or [], data.get('tags') or {})
+        logger.info(f"地名词典加载完成: {len(gazetteer.places)} 个地点, 自动机状态数 {len(gazetteer._automaton)}")
+        return gazetteer
+
+    def extract(self, prompt):
+        """一次扫描提取意图
+
+        返回 {'destination', 'destination_source', 'days', 'tags', 'places'}；
+        未识别到的 destination/days 为 None，tags 为空列表，由调用方决定默认值。
+        """
+        prompt = prompt or ''
+        text = prompt.lower()
+
+        place_hits = []
+        tag_hits = set()
+        for start, end, (kind, value) in self._automaton.find_all(text):
+            if kind == 'tag':
+                tag_hits.add(value)
+            else:
+                place_hits.append((start, end, value))
+
+        places = self._longest_non_overlapping(place_hits)
+        destination, source = self._pick_destination(text, places)
+        if destination is None:
+            destination = self._fallback_destination(prompt)
+            source = 'pattern' if destination else None
+
+        return {
+            'destination': destination,
+            'destination_source': source,
+            'days': self.extract_days(prompt),
+            'tags': sorted(tag_hits, key=self._tag_order.get),
+            'places': [name for _, _, name in places],
+        }
+
+    def extract_days(self, prompt):
+        """提取行程天数，未识别到或超出合理范围时返回 None"""
+        days = nights = weeks = None
+        for match in _DAYS_RE.finditer(prompt or ''):
+            number = parse_number(match.group(1))
+            if not number:
+                continue
+            unit = match.group(2)
+            if unit in ('天', '日'):
+                days = number
+                break
+            if unit in ('晚', '夜'):
+                nights = nights or number
+            else:
+                weeks = weeks or number
+        if days is None:
+            if weeks:
+                days = weeks * 7
+            elif nights:
+                days = nights + 1
+            elif _WEEKEND_RE.search(prompt or ''):
+                days = 2
+        if days is None or not 1 <= days <= self.MAX_DAYS:
+            return None
+        return days
+
+    def resolve(self, name):
+        """将地点解析为目的地名称: 城市内的景点归入所属城市，其余返回自身"""
+        place = self.places.get(name)
+        if place and place.get('type') == 'poi' and place.get('city'):
+            return place['city']
+        return name
+
+    # --- 内部方法 ---
+
+    @staticmethod
+    def _longest_non_overlapping(hits):
+        """按最左最长原则挑选互不重叠的命中，如 "南京路" 优先于 "南京" """
+        hits.sort(key=lambda hit: (hit[0], -(hit[1] - hit[0])))
+        selected = []
+        last_end = 0
+        for start, end, name in hits:
+            if start >= last_end:
+                selected.append((start, end, name))
+                last_end = end
+        return selected
+
+    def _pick_destination(self, text, places):
+        if not places:
+            return None, None
+
+        candidates = []
+        for start, end, name in places:
+            before = set(text[max(0, start - 2):start])
+            if before & _ORIGIN_BEFORE or text[end:end + 2] in _ORIGIN_AFTER:
+                continue
+            candidates.append((bool(before & _DEST_BEFORE), name))
+        if not candidates:
+            # 只提到了出发地时，仍以最后提到的地点为准
+            candidates = [(False, places[-1][2])]
+
+        marked = [name for is_marked, name in candidates if is_marked]
+        chosen = marked[0] if marked else candidates[0][1]
+
+        # "云南大理" / "日本东京": 省份或国家后面跟了更具体的地点时取更具体的
+        chosen_type = self.places.get(chosen, {}).get('type')
+        if chosen_type in ('province', 'country'):
+            field = 'province' if chosen_type == 'province' else 'country'
+            for _, name in candidates:
+                if name != chosen and self._parent_field(name, field) == chosen:
+                    chosen = name
+                    break
+
+        return self.resolve(chosen), 'gazetteer'
+
+    def _parent_field(self, name, field):
+        """取地点的所属省份/国家，景区和景点沿所属城市向上查找"""
+        place = self.places.get(name) or {}
+        if field in place:
+            return place[field]
+        city = self.places.get(place.get('city')) or {}
+        return city.get(field)
+
+    @staticmethod
+    def _fallback_destination(prompt):
+        for pattern in _FALLBACK_PATTERNS:
+            match = pattern.search(prompt)
+            if match and not any(word in match.group(1) for word in _FALLBACK_STOPWORDS):
+                return match.group(1)
+        return None
@@ -0,0 +1,326 @@
+# app/utils/geocoder.py
+import math
+import re
+import threading
+
+from .gazetteer import AhoCorasick
+
+# 可用于填充活动坐标的地点类型: 城市、国家、省份范围太大，只用于确定行程所在区域
+MATCH_TYPES = ('poi', 'area', 'county')
+# 反查时返回的地点类型
+REVERSE_TYPES = ('poi', 'area', 'county', 'city', 'international')
+
+# 活动地点与行程目的地相距超过该值(公里)时视为无效
+DEFAULT_MAX_DISTANCE_KM = 300
+
+# 输出坐标系: 前端地图使用百度 BD09LL
+COORD_WGS84 = 'wgs84'
+COORD_GCJ02 = 'gcj02'
+COORD_BD09LL = 'bd09ll'
+COORD_TYPES = (COORD_WGS84, COORD_GCJ02, COORD_BD09LL)
+
+_EARTH_RADIUS_KM = 6371.0
+_KM_PER_DEGREE = 111.2
+_GRID_DEGREES = 1.0
+
+_PAREN_RE = re.compile(r'[（(【\[][^）)】\]]*[）)】\]]')
+_STRIP_RE = re.compile(r'[\s　·•・,，。.、:：;；!！?？"“”\'‘’「」『』《》<>\-—_/\\|]+')
+# 命中后紧跟这些字时是行政区或道路名的一部分，如 "上海市普陀区"、"黄山路"
+_ADMIN_SUFFIXES = frozenset('区县市镇乡路街道巷号')
+# 精确查找时去掉的通用后缀，如 "峨眉山风景区" -> "峨眉山"
+_NAME_SUFFIXES = ('风景名胜区', '旅游度假区', '国家森林公园', '旅游景区', '风景区', '旅游区', '景区')
+
+
+def normalize_name(text):
+    """地名规范化: 去掉括号内的补充说明、空白和标点，英文转小写"""
+    text = _PAREN_RE.sub('', str(text or ''))
+    return _STRIP_RE.sub('', text).lower()
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    """两点间的大圆距离(公里)"""
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    h = (math.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2)
+    return 2 * _EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(h)))
+
+
+def parse_coordinates(value):
+    """解析活动的 coordinates 字段 (数字或数字字符串)，返回 (lat, lng)；缺失或无效时返回 None"""
+    if not isinstance(value, dict):
+        return None
+    try:
+        lat = float(value.get('latitude'))
+        lng = float(value.get('longitude'))
+    except (TypeError, ValueError):
+        return None
+    # NaN 与任何数比较都为假，同样视为无效
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180) or (lat == 0 and lng == 0):
+        return None
+    return lat, lng
+
+
+# --- 坐标系转换 (WGS84 -> GCJ02 -> BD09LL) ---
+
+_GCJ_A = 6378245.0
+_GCJ_EE = 0.00669342162296594323
+_BD_X_PI = math.pi * 3000.0 / 180.0
+
+
+def _in_china(lat, lng):
+    return 72.004 <= lng <= 137.8347 and 0.8293 <= lat <= 55.8271
+
+
+def _gcj_delta_lat(x, y):
+    ret = -100.0 + 2.0 * x + 3.0 * y + 0.2 * y * y + 0.1 * x * y + 0.2 * math.sqrt(abs(x))
+    ret += (20.0 * math.sin(6.0 * x * math.pi) + 20.0 * math.sin(2.0 * x * math.pi)) * 2.0 / 3.0
+    ret += (20.0 * math.sin(y * math.pi) + 40.0 * math.sin(y / 3.0 * math.pi)) * 2.0 / 3.0
+    ret += (160.0 * math.sin(y / 12.0 * math.pi) + 320.0 * math.sin(y * math.pi / 30.0)) * 2.0 / 3.0
+    return ret
+
+
+def _gcj_delta_lng(x, y):
+    ret = 300.0 + x + 2.0 * y + 0.1 * x * x + 0.1 * x * y + 0.1 * math.sqrt(abs(x))
+    ret += (20.0 * math.sin(6.0 * x * math.pi) + 20.0 * math.sin(2.0 * x * math.pi)) * 2.0 / 3.0
+    ret += (20.0 * math.sin(x * math.pi) + 40.0 * math.sin(x / 3.0 * math.pi)) * 2.0 / 3.0
+    ret += (150.0 * math.sin(x / 12.0 * math.pi) + 300.0 * math.sin(x / 30.0 * math.pi)) * 2.0 / 3.0
+    return ret
+
+
+def wgs84_to_gcj02(lat, lng):
+    if not _in_china(lat, lng):
+        return lat, lng
+    dlat = _gcj_delta_lat(lng - 105.0, lat - 35.0)
+    dlng = _gcj_delta_lng(lng - 105.0, lat - 35.0)
+    radlat = lat / 180.0 * math.pi
+    magic = 1 - _GCJ_EE * math.sin(radlat) ** 2
+    sqrt_magic = math.sqrt(magic)
+    dlat = (dlat * 180.0) / ((_GCJ_A * (1 - _GCJ_EE)) / (magic * sqrt_magic) * math.pi)
+    dlng = (dlng * 180.0) / (_GCJ_A / sqrt_magic * math.cos(radlat) * math.pi)
+    return lat + dlat, lng + dlng
+
+
+def gcj02_to_bd09(lat, lng):
+    z = math.sqrt(lng * lng + lat * lat) + 0.00002 * math.sin(lat * _BD_X_PI)
+    theta = math.atan2(lat, lng) + 0.000003 * math.cos(lng * _BD_X_PI)
+    return z * math.sin(theta) + 0.006, z * math.cos(theta) + 0.0065
+
+
+def convert_coordinates(lat, lng, coord_type):
+    """把词典中的 WGS84 坐标转换为输出坐标系；境外坐标各坐标系相同，不做转换"""
+    if coord_type == COORD_WGS84 or not _in_china(lat, lng):
+        return lat, lng
+    lat, lng = wgs84_to_gcj02(lat, lng)
+    if coord_type == COORD_BD09LL:
+        lat, lng = gcj02_to_bd09(lat, lng)
+    return lat, lng
+
+
+class Geocoder:
+    """离线地理编码
+
+    使用地名词典 (data/gazetteer.json) 中带 coord 的地点 (WGS84 坐标)，建立三个索引:
+    - 规范化名称 -> 地点，用于精确查找
+    - 名称和别名的 Aho-Corasick 自动机，在活动的地点、标题和地址中一次扫描找出提到的地点
+    - 按经纬度划分的网格，用于最近地点和坐标反查
+    生成行程后由服务端为活动填充坐标，并丢弃与目的地相距过远或格式错误的坐标。
+    """
+
+    def __init__(self, places, coord_type=COORD_BD09LL, max_distance_km=DEFAULT_MAX_DISTANCE_KM):
+        if coord_type not in COORD_TYPES:
+            raise ValueError(f"不支持的坐标系: {coord_type}")
+        self.coord_type = coord_type
+        self.max_distance_km = max_distance_km
+        self.places = {}
+        self._names = {}      # 规范化名称 -> [地点名]
+        self._grid = {}       # (纬度格, 经度格) -> [地点名]
+        self._automaton = AhoCorasick()
+        self._lock = threading.Lock()
+        self._stats = {'filled': 0, 'kept': 0, 'dropped': 0, 'unmatched': 0}
+
+        for place in places:
+            self.places[place['name']] = place
+            for name in [place['name']] + list(place.get('aliases') or []):
+                key = normalize_name(name)
+                if key:
+                    self._names.setdefault(key, []).append(place['name'])
+            coord = place.get('coord')
+            if coord:
+                self._grid.setdefault(self._cell(*coord), []).append(place['name'])
+        for key in self._names:
+            self._automaton.add(key, key)
+        self._automaton.build()
+
+    @classmethod
+    def from_gazetteer(cls, gazetteer, **kwargs):
+        """复用已加载的地名词典，不重复读取数据文件"""
+        return cls(gazetteer.places.values(), **kwargs)
+
+    # --- 查询 ---
+
+    def coordinates(self, name):
+        """地点的输出坐标 {"latitude", "longitude"}；没有坐标时返回 None"""
+        place = self.places.get(name) or {}
+        coord = place.get('coord')
+        if not coord:
+            return None
+        lat, lng = coord
+        # 境外地点 (如首尔) 可能落在国内坐标范围的矩形内，按所属国家判断，不做转换
+        if not place.get('country'):
+            lat, lng = convert_coordinates(lat, lng, self.coord_type)
+        return {'latitude': round(lat, 6), 'longitude': round(lng, 6)}
+
+    def lookup(self, text, destination=None):
+        """按名称查找地点，返回地点名；destination 用于在同名地点中选择并排除相距过远的地点"""
+        region = self._region(destination)
+        for candidate in self._candidates(text, region, types=None):
+            return candidate
+        return None
+
+    def nearest(self, lat, lng, limit=5, max_km=50, types=REVERSE_TYPES):
+        """返回距离坐标最近的地点 [(距离公里, 地点名)]，只查找 max_km 范围内的网格"""
+        row_reach = int(math.ceil(max_km / (_KM_PER_DEGREE * _GRID_DEGREES)))
+        lng_km = _KM_PER_DEGREE * _GRID_DEGREES * max(math.cos(math.radians(lat)), 0.05)
+        col_reach = min(int(math.ceil(max_km / lng_km)), int(180 / _GRID_DEGREES))
+        row, col = self._cell(lat, lng)
+
+        found = []
+        for r in range(row - row_reach, row + row_reach + 1):
+            for c in range(col - col_reach, col + col_reach + 1):
+                for name in self._grid.get((r, self._wrap_col(c)), ()):
+                    place = self.places[name]
+                    if types and place.get('type') not in types:
+                        continue
+                    distance = haversine_km(lat, lng, *place['coord'])
+                    if distance <= max_km:
+                        found.append((round(distance, 2), name))
+        found.sort()
+        return found[:limit]
+
+    def reverse(self, lat, lng, max_km=100):
+        """坐标反查: 返回最近的城市/县市级地点名，范围内没有时返回 None"""
+        hits = self.nearest(lat, lng, limit=1, max_km=max_km, types=('county', 'city', 'international'))
+        return hits[0][1] if hits else None
+
+    # --- 行程坐标 ---
+
+    def fill_plan(self, plan, destination=None):
+        """为行程中所有活动填充/校验坐标 (原地修改)，返回本次的统计"""
+        if not isinstance(plan, dict):
+            return {}
+        return self.fill_days(plan.get('days'), destination or plan.get('destination'))
+
+    def fill_days(self, days, destination):
+        """为若干天的活动填充/校验坐标 (流式生成时逐天调用)
+
+        - 按地点、标题、地址依次查找词典中的景点/景区/县镇，找到则填入 (替换已有的坐标)
+        - 词典中没有时保留已有坐标并转换为数字；格式错误或与目的地相距过远时丢弃
+        - 都没有时不填，由客户端再按名称查询
+        """
+        counts = {'filled': 0, 'kept': 0, 'dropped': 0, 'unmatched': 0}
+        if not isinstance(days, list):
+            return counts
+        region = self._region(destination)
+        for day in days:
+            if not isinstance(day, dict):
+                continue
+            for activity in day.get('activities') or []:
+                if isinstance(activity, dict):
+                    counts[self._fill_activity(activity, region)] += 1
+        with self._lock:
+            for key, value in counts.items():
+                self._stats[key] += value
+        return counts
+
+    def stats(self):
+        with self._lock:
+            result = dict(self._stats)
+        result['places'] = sum(len(names) for names in self._grid.values())
+        result['coord_type'] = self.coord_type
+        return result
+
+    # --- 内部方法 ---
+
+    def _fill_activity(self, activity, region):
+        # 词典命中时总是使用词典坐标 (统一转换为输出坐标系)，不与模型给出的、坐标系未知的坐标混用；
+        # 已经填充过的行程 (如修改行程时) 再次处理得到相同的坐标
+        for field in ('location', 'title', 'address'):
+            for name in self._candidates(activity.get(field), region, types=MATCH_TYPES):
+                activity['coordinates'] = self.coordinates(name)
+                return 'filled'
+
+        if 'coordinates' not in activity or activity['coordinates'] is None:
+            return 'unmatched'
+        coord = parse_coordinates(activity['coordinates'])
+        if coord and self._in_region(coord, region):
+            activity['coordinates'] = {'latitude': coord[0], 'longitude': coord[1]}
+            return 'kept'
+        activity['coordinates'] = None
+        return 'dropped'
+
+    def _region(self, destination):
+        """解析行程目的地，返回 (目的地名, 中心坐标)；不在词典中时返回 None"""
+        names = self._names.get(normalize_name(destination)) if destination else None
+        if not names:
+            return None
+        name = names[0]
+        return name, self.places[name].get('coord')
+
+    def _in_region(self, coord, region):
+        if region is None or not region[1]:
+            return True
+        return haversine_km(coord[0], coord[1], *region[1]) <= self.max_distance_km
+
+    def _belongs_to(self, name, region):
+        """地点是否属于目的地: 所属城市/省份/国家是目的地，或与目的地中心相距不远"""
+        if region is None:
+            return True
+        place = self.places[name]
+        if region[0] == name or region[0] in self._ancestors(place):
+            return True
+        return bool(region[1]) and self._in_region(place['coord'], region)
+
+    def _ancestors(self, place):
+        chain = [place.get(field) for field in ('city', 'province', 'country')]
+        city = self.places.get(place.get('city')) or {}
+        chain.extend(city.get(field) for field in ('province', 'country'))
+        return [name for name in chain if name]
+
+    def _candidates(self, text, region, types):
+        """依次给出文本中提到的、属于目的地的地点: 先精确匹配整段文本，再按最长命中扫描"""
+        key = normalize_name(text)
+        if not key:
+            return
+        exact = [key] + [key[:-len(suffix)] for suffix in _NAME_SUFFIXES
+                         if key.endswith(suffix) and len(key) > len(suffix)]
+        for word in exact:
+            yield from self._pick(self._names.get(word) or (), region, types)
+
+        hits = []
+        for start, end, word in self._automaton.find_all(key):
+            if key[end:end + 1] in _ADMIN_SUFFIXES:
+                continue
+            hits.append((end - start, word))
+        hits.sort(key=lambda hit: -hit[0])
+        for _, word in hits:
+            yield from self._pick(self._names[word], region, types)
+
+    def _pick(self, names, region, types):
+        candidates = [
+            name for name in names
+            if self.places[name].get('coord')
+            and (types is None or self.places[name].get('type') in types)
+            and self._belongs_to(name, region)
+        ]
+        if region is not None and region[1] and len(candidates) > 1:
+            candidates.sort(key=lambda name: haversine_km(*region[1], *self.places[name]['coord']))
+        return candidates
+
+    @staticmethod
+    def _cell(lat, lng):
+        return int(math.floor(lat / _GRID_DEGREES)), int(math.floor(lng / _GRID_DEGREES))
+
+    @staticmethod
+    def _wrap_col(col):
+        span = int(360 / _GRID_DEGREES)
+        return (col + span // 2) % span - span // 2
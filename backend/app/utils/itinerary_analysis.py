@@ -0,0 +1,248 @@
+# app/utils/itinerary_analysis.py
+import re
+
+# 分析结果的格式版本，字段含义变化时递增，客户端据此判断能否直接使用
+ANALYSIS_VERSION = 1
+
+# 每个行程最多记录的问题条数 (issueCount 为实际总数)
+MAX_ISSUES = 50
+
+# startTime/endTime 推算的时长与 durationMinutes 相差超过该值(分钟)时视为不一致
+DURATION_TOLERANCE = 15
+
+# 相邻活动之间的空档超过该值(分钟)时记为问题
+LONG_GAP_MINUTES = 240
+
+_MINUTES_PER_DAY = 24 * 60
+_CLOCK_RE = re.compile(r'^\s*(\d{1,2})\s*(?:[:：.]\s*(\d{1,2})|点\s*(?:(\d{1,2})\s*分?|半)?)\s*$')
+_NUMBER_RE = re.compile(r'\d+(?:\.\d+)?')
+# 数字中的千位分隔符 (1,200 / 1，200)
+_THOUSANDS_RE = re.compile(r'(?<=\d)[,，](?=\d{3}(?!\d))')
+# 明确的区间 (100-200 / ¥100~¥200 / 100至200元)，group 1 / 4 为区间两侧的货币符号
+_AMOUNT_RANGE_RE = re.compile(
+    r'([¥￥]?)\s*(\d+(?:\.\d+)?)\s*(?:元|块)?\s*(?:-|~|～|至|到)\s*[¥￥]?\s*(\d+(?:\.\d+)?)\s*(元|块)?'
+)
+# 紧挨货币符号的金额 (¥300 / 300元)
+_CURRENCY_AMOUNT_RE = re.compile(r'[¥￥]\s*(\d+(?:\.\d+)?)|(\d+(?:\.\d+)?)\s*(?:元|块)')
+
+# 问题类型
+ISSUE_OVERLAP = 'overlap'                      # 与同一天的其他活动时间重叠
+ISSUE_INVALID_TIME = 'invalid_time'            # 时间无法解析或超出 00:00-24:00
+ISSUE_END_BEFORE_START = 'end_before_start'    # 结束时间早于开始时间
+ISSUE_DURATION_MISMATCH = 'duration_mismatch'  # durationMinutes 与起止时间不一致
+ISSUE_LONG_GAP = 'long_gap'                    # 相邻活动之间的空档过长
+
+
+def parse_clock(value):
+    """把 "09:00"、"9:30"、"9点半" 等写法解析为当天的分钟数；无法解析时返回 None"""
+    if value is None or value == '':
+        return None
+    match = _CLOCK_RE.match(str(value))
+    if not match:
+        return None
+    hours = int(match.group(1))
+    if match.group(2) is not None:
+        minutes = int(match.group(2))
+    elif match.group(3) is not None:
+        minutes = int(match.group(3))
+    else:
+        minutes = 30 if str(value).strip().endswith('半') else 0
+    if minutes >= 60:
+        return None
+    return hours * 60 + minutes
+
+
+def parse_amount(value):
+    """解析费用，无法解析时返回 None
+
+    数字直接返回；先去掉千位分隔符 ("¥1,200" -> 1200)，然后依次取:
+    带货币符号的区间 ("¥100-200" 取平均值)、紧挨 ¥/元 的金额 ("2人共300元" -> 300)、
+    其他区间 ("100~200")、第一个数字。
+    """
+    if isinstance(value, bool) or value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    text = _THOUSANDS_RE.sub('', str(value))
+
+    ranges = list(_AMOUNT_RANGE_RE.finditer(text))
+    for match in ranges:
+        if match.group(1) or match.group(4):
+            return (float(match.group(2)) + float(match.group(3))) / 2
+    match = _CURRENCY_AMOUNT_RE.search(text)
+    if match:
+        return float(match.group(1) or match.group(2))
+    if ranges:
+        return (float(ranges[0].group(2)) + float(ranges[0].group(3))) / 2
+    match = _NUMBER_RE.search(text)
+    return float(match.group()) if match else None
+
+
+def format_clock(minutes):
+    if minutes is None:
+        return None
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+def flatten_activities(days):
+    """把所有天的活动一次性展开为按列存放的数组
+
+    返回 dict: day_index / activity_id / start / end / duration / cost 各为等长列表，
+    后续的统计和冲突检测都在这些数组上进行，不再反复遍历嵌套结构。
+    """
+    columns = {'day_index': [], 'activity_id': [], 'start': [], 'end': [],
+               'duration': [], 'cost': [], 'declared_duration': [], 'bad_time': []}
+    for day_index, day in enumerate(days):
+        if not isinstance(day, dict):
+            continue
+        for position, activity in enumerate(day.get('activities') or []):
+            if not isinstance(activity, dict):
+                continue
+            raw_start, raw_end = activity.get('startTime') or activity.get('time'), activity.get('endTime')
+            start, end = parse_clock(raw_start), parse_clock(raw_end)
+            bad_time = ((raw_start not in (None, '') and start is None)
+                        or (raw_end not in (None, '') and end is None)
+                        or any(t is not None and t > _MINUTES_PER_DAY for t in (start, end)))
+
+            declared = parse_amount(activity.get('durationMinutes'))
+            if start is not None and end is None and declared:
+                end = start + int(declared)
+            duration = end - start if start is not None and end is not None else declared
+
+            columns['day_index'].append(day_index)
+            columns['activity_id'].append(activity.get('id') or f"{day_index + 1}-{position + 1}")
+            columns['start'].append(start)
+            columns['end'].append(end)
+            columns['duration'].append(duration)
+            columns['declared_duration'].append(declared)
+            columns['cost'].append(parse_amount(activity.get('estimatedCost')))
+            columns['bad_time'].append(bad_time)
+    return columns
+
+
+def analyze_itinerary(plan):
+    """计算行程的费用、时长、时间冲突和空档，返回可直接存入文档的紧凑摘要
+
+    摘要包含总费用、总时长、每天的统计 (费用、活动数、首个活动开始/最后活动结束时间、
+    空档)，以及重叠、时间无效、结束早于开始、时长不一致和空档过长等问题列表。
+    """
+    days = plan.get('days') if isinstance(plan, dict) else None
+    if not isinstance(days, list):
+        return None
+    cols = flatten_activities(days)
+    count = len(cols['day_index'])
+
+    day_stats = []
+    for day_index, day in enumerate(days):
+        day_number = day.get('dayNumber') if isinstance(day, dict) else None
+        day_stats.append({
+            'dayNumber': day_number or day_index + 1,
+            'activityCount': 0,
+            'cost': 0.0,
+            'durationMinutes': 0,
+            'firstStart': None,
+            'lastEnd': None,
+            'gapMinutes': 0,
+            'longestGapMinutes': 0,
+            'conflicts': 0,
+        })
+
+    issues = []
+    issue_count = 0
+
+    def add_issue(issue):
+        nonlocal issue_count
+        issue_count += 1
+        if len(issues) < MAX_ISSUES:
+            issues.append(issue)
+
+    # 逐项统计费用、时长和单个活动的时间问题
+    total_cost = 0.0
+    total_duration = 0
+    costed = 0
+    timed_by_day = {}
+    for i in range(count):
+        stats = day_stats[cols['day_index'][i]]
+        stats['activityCount'] += 1
+        cost = cols['cost'][i]
+        if cost is not None:
+            stats['cost'] += cost
+            total_cost += cost
+            costed += 1
+
+        start, end, duration = cols['start'][i], cols['end'][i], cols['duration'][i]
+        if cols['bad_time'][i]:
+            add_issue({'type': ISSUE_INVALID_TIME, 'dayNumber': stats['dayNumber'],
+                       'activities': [cols['activity_id'][i]]})
+            continue
+        if start is not None and end is not None and end < start:
+            add_issue({'type': ISSUE_END_BEFORE_START, 'dayNumber': stats['dayNumber'],
+                       'activities': [cols['activity_id'][i]]})
+            continue
+        declared = cols['declared_duration'][i]
+        if (declared is not None and start is not None and end is not None
+                and abs(declared - (end - start)) > DURATION_TOLERANCE):
+            add_issue({'type': ISSUE_DURATION_MISMATCH, 'dayNumber': stats['dayNumber'],
+                       'activities': [cols['activity_id'][i]],
+                       'minutes': int(declared - (end - start))})
+        if duration is not None and duration > 0:
+            stats['durationMinutes'] += int(duration)
+            total_duration += int(duration)
+        if start is not None:
+            timed_by_day.setdefault(cols['day_index'][i], []).append(i)
+
+    # 每天按开始时间排序后扫描一遍，得到重叠和空档
+    for day_index, indexes in timed_by_day.items():
+        stats = day_stats[day_index]
+        indexes.sort(key=lambda i: cols['start'][i])
+        stats['firstStart'] = format_clock(cols['start'][indexes[0]])
+        latest_end, latest_index = None, None
+        for i in indexes:
+            start = cols['start'][i]
+            end = cols['end'][i] if cols['end'][i] is not None else start
+            if latest_end is not None:
+                if start < latest_end:
+                    stats['conflicts'] += 1
+                    add_issue({'type': ISSUE_OVERLAP, 'dayNumber': stats['dayNumber'],
+                               'activities': [cols['activity_id'][latest_index], cols['activity_id'][i]],
+                               'minutes': min(latest_end, end) - start})
+                elif start > latest_end:
+                    gap = start - latest_end
+                    stats['gapMinutes'] += gap
+                    stats['longestGapMinutes'] = max(stats['longestGapMinutes'], gap)
+                    if gap > LONG_GAP_MINUTES:
+                        add_issue({'type': ISSUE_LONG_GAP, 'dayNumber': stats['dayNumber'],
+                                   'activities': [cols['activity_id'][latest_index], cols['activity_id'][i]],
+                                   'minutes': gap})
+            if latest_end is None or end > latest_end:
+                latest_end, latest_index = end, i
+        stats['lastEnd'] = format_clock(latest_end)
+
+    for stats in day_stats:
+        stats['cost'] = round(stats['cost'], 2)
+
+    return {
+        'version': ANALYSIS_VERSION,
+        'dayCount': len(days),
+        'activityCount': count,
+        'totalCost': round(total_cost, 2),
+        'costedActivities': costed,
+        'totalDurationMinutes': total_duration,
+        'days': day_stats,
+        'issues': issues,
+        'issueCount': issue_count,
+    }
+
+
+def attach_analysis(plan):
+    """在行程上写入 analysis 字段 (原地修改) 并返回行程；没有 days 时原样返回"""
+    if isinstance(plan, dict) and isinstance(plan.get('days'), list):
+        plan['analysis'] = analyze_itinerary(plan)
+    return plan
+
+
+def strip_analysis(plan):
+    """返回去掉 analysis 字段的浅拷贝，发送给模型时使用 (分析结果由服务端重新计算)"""
+    if isinstance(plan, dict) and 'analysis' in plan:
+        return {k: v for k, v in plan.items() if k != 'analysis'}
+    return plan
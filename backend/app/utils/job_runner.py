@@ -0,0 +1,56 @@
+# app/utils/job_runner.py
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class BoundedJobExecutor:
+    """有界的后台任务执行器
+
+    最多 max_workers 个任务并发执行，排队加执行中的任务总数不超过 max_pending；
+    队列已满时 submit 返回 False，由调用方快速拒绝请求，而不是无限堆积。
+    """
+
+    def __init__(self, max_workers=4, max_pending=32, name='ai-job'):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._pending = 0
+
+    def submit(self, fn, *args, **kwargs):
+        """提交任务，队列已满时返回 False"""
+        if not self._slots.acquire(blocking=False):
+            return False
+        with self._lock:
+            self._pending += 1
+
+        def run():
+            try:
+                fn(*args, **kwargs)
+            except Exception as e:
+                logger.error(f"后台任务执行失败: {e}")
+            finally:
+                with self._lock:
+                    self._pending -= 1
+                self._slots.release()
+
+        try:
+            self._executor.submit(run)
+        except RuntimeError:
+            with self._lock:
+                self._pending -= 1
+            self._slots.release()
+            return False
+        return True
+
+    def stats(self):
+        with self._lock:
+            return {
+                'pending': self._pending,
+                'max_pending': self.max_pending,
+                'max_workers': self.max_workers,
+            }
@@ -0,0 +1,220 @@
+# app/utils/json_extract.py
+import json
+import re
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 提取成功时使用的策略
+STRATEGY_DIRECT = 'direct'      # 整个内容就是JSON
+STRATEGY_SCAN = 'scan'          # 扫描出的顶层JSON对象 (包括代码块中的JSON)
+STRATEGY_REPAIRED = 'repaired'  # 输出被截断，补全括号后解析成功
+
+# 跳过无效区域时只关心的结构字符；字符串内部由 _STRING_END_RE 一次跳过
+_STRUCT_RE = re.compile(r'[{}\[\]",]')
+_STRING_END_RE = re.compile(r'(?:[^"\\]|\\.)*"', re.S)
+_CLOSERS = {'{': '}', '[': ']'}
+_DECODER = json.JSONDecoder()
+
+# 截断修复时最多回退尝试的安全截断点数量
+_MAX_REPAIR_ATTEMPTS = 8
+# 最多记录的未闭合区域数量 (每个区域都要扫描到文本末尾)
+_MAX_TRUNCATED_REGIONS = 8
+
+# 修复后末尾的数组元素必须包含的字段 (按所在数组的键名)，缺少时说明该元素被截断，整个丢弃
+REQUIRED_ITEM_KEYS = {
+    'days': ('activities',),
+    'activities': ('title', 'location'),
+}
+
+
+def extract_json(content, expected_keys=None, allow_repair=True):
+    """从模型输出中提取JSON对象，返回 (value, strategy)
+
+    先尝试整体解析 (结果须是包含 expected_keys 的对象)；不满足时从左到右线性扫描内容，在每个顶层 '{' 处直接用
+    JSONDecoder.raw_decode 解析 (C实现，解析成功即得到对象和结束位置)；解析失败的
+    区域用跳过字符串和转义的括号扫描找到其结束位置后整体跳过，因此每个字符只被处理常数次。
+    候选对象中优先返回包含 expected_keys 的，其次是最长的。
+    遇到未闭合的 '{' 时记为修复候选并从下一个字符继续扫描，正文中的孤立括号不会挡住后面的JSON。
+    没有合适的完整对象而输出被截断时，allow_repair 为真则回退到最近的安全位置并补全括号，
+    并丢弃末尾缺少必需字段的天或活动。都失败时返回 (None, None)。
+    """
+    if not content:
+        return None, None
+    if not isinstance(content, str):
+        content = str(content)
+
+    expected = tuple(expected_keys or ())
+    stripped = content.strip()
+    if stripped[:1] in ('{', '['):
+        try:
+            value = json.loads(stripped)
+        except ValueError:
+            pass
+        else:
+            # 与扫描到的候选使用同样的条件: 必须是对象且包含 expected_keys，否则继续扫描 (如列表中的对象)
+            if isinstance(value, dict) and all(key in value for key in expected):
+                return value, STRATEGY_DIRECT
+
+    # 每个候选记录 (长度, 值, 是否位于第一个未闭合区域之前)
+    candidates = []
+    truncated = []
+    pos = 0
+    while True:
+        start = content.find('{', pos)
+        if start < 0:
+            break
+        try:
+            value, end = _DECODER.raw_decode(content, start)
+        except ValueError:
+            end, safe_points = _skip_balanced(content, start)
+            if end is None:
+                # 未闭合的 '{' 可能是正文中的孤立括号，也可能是被截断的输出: 记为修复候选后从下一个字符继续扫描
+                truncated.append((start, safe_points))
+                if len(truncated) >= _MAX_TRUNCATED_REGIONS:
+                    break
+                end = start + 1
+        else:
+            candidates.append((end - start, value, not truncated))
+        pos = end
+
+    if expected:
+        for _, value, _ in candidates:
+            if isinstance(value, dict) and all(key in value for key in expected):
+                return value, STRATEGY_SCAN
+
+    repaired = []
+    if allow_repair:
+        for region in truncated:
+            value = _repair(content, region)
+            if value is not None:
+                repaired.append(value)
+    if expected:
+        for value in repaired:
+            if all(key in value for key in expected):
+                return value, STRATEGY_REPAIRED
+
+    # 未闭合区域之前的完整对象优先于修复结果；未闭合区域内部的对象可能只是截断输出中的片段，
+    # 指定了 expected_keys 时不作为兜底结果
+    leading = [item for item in candidates if item[2]]
+    if leading:
+        return max(leading, key=lambda item: item[0])[1], STRATEGY_SCAN
+    if repaired:
+        return repaired[0], STRATEGY_REPAIRED
+    if candidates and not expected:
+        return max(candidates, key=lambda item: item[0])[1], STRATEGY_SCAN
+
+    return None, None
+
+
+def _skip_balanced(text, start):
+    """从 start 处的 '{' 开始扫描到与之平衡的右括号
+
+    返回 (结束位置, None)；到文本末尾仍未闭合 (输出被截断) 时返回
+    (None, 安全截断点列表)，每个安全截断点为 (截断位置, 该位置上尚未闭合的括号栈)。
+    """
+    stack = ['{']
+    safe_points = [(start + 1, '{')]
+    pos = start + 1
+
+    while True:
+        match = _STRUCT_RE.search(text, pos)
+        if match is None:
+            return None, safe_points[-_MAX_REPAIR_ATTEMPTS:]
+        ch = match.group()
+        pos = match.end()
+
+        if ch == '"':
+            end = _STRING_END_RE.match(text, pos)
+            if end is None:
+                return None, safe_points[-_MAX_REPAIR_ATTEMPTS:]  # 字符串未闭合
+            pos = end.end()
+        elif ch == ',':
+            safe_points.append((match.start(), ''.join(stack)))
+        elif ch in '{[':
+            stack.append(ch)
+            safe_points.append((pos, ''.join(stack)))
+        else:
+            if _CLOSERS[stack[-1]] == ch:
+                stack.pop()
+            if not stack:
+                return pos, None
+            safe_points.append((pos, ''.join(stack)))
+        if len(safe_points) > _MAX_REPAIR_ATTEMPTS * 4:
+            del safe_points[:-_MAX_REPAIR_ATTEMPTS]
+
+
+def _repair(text, truncated):
+    """截断在最近的安全位置并补全括号，从后往前尝试
+
+    优先在逗号或右括号处截断 (保留完整的元素)，都不行时才在左括号之后截断，
+    避免在结果末尾留下空对象。
+    """
+    start, safe_points = truncated
+    ordered = [point for point in reversed(safe_points) if text[point[0] - 1] not in '{[']
+    ordered += [point for point in reversed(safe_points) if text[point[0] - 1] in '{[']
+    for cut, open_stack in ordered:
+        body = text[start:cut].rstrip()
+        closing = ''.join(_CLOSERS[opener] for opener in reversed(open_stack))
+        try:
+            value = json.loads(body + closing)
+        except ValueError:
+            continue
+        if isinstance(value, dict) and value:
+            _prune_incomplete_tail(value)
+            return value
+    return None
+
+
+def _prune_incomplete_tail(value, key=None):
+    """沿最后一个元素向下，丢弃截断产生的不完整的末尾元素 (先处理内层)
+
+    截断只影响每一层的最后一个元素；数组末尾的对象为空或缺少 REQUIRED_ITEM_KEYS
+    中的字段 (或该字段为空) 时将其删除。
+    """
+    if isinstance(value, dict):
+        if value:
+            last_key = next(reversed(value))
+            _prune_incomplete_tail(value[last_key], last_key)
+    elif isinstance(value, list) and value:
+        last = value[-1]
+        _prune_incomplete_tail(last, key)
+        if isinstance(last, dict):
+            required = REQUIRED_ITEM_KEYS.get(key, ())
+            if not last or any(last.get(name) in (None, '', [], {}) for name in required):
+                value.pop()
+
+
+class JSONExtractionStats:
+    """记录各提取策略的命中次数和耗时，供 /api/ai/stats 展示"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {STRATEGY_DIRECT: 0, STRATEGY_SCAN: 0, STRATEGY_REPAIRED: 0, 'failed': 0}
+        self._total_ms = 0.0
+        self._max_ms = 0.0
+
+    def record(self, strategy, elapsed_ms):
+        with self._lock:
+            self._counts[strategy or 'failed'] += 1
+            self._total_ms += elapsed_ms
+            self._max_ms = max(self._max_ms, elapsed_ms)
+
+    def timed_extract(self, content, expected_keys=None, allow_repair=True):
+        """调用 extract_json 并记录结果"""
+        started = time.perf_counter()
+        value, strategy = extract_json(content, expected_keys, allow_repair)
+        self.record(strategy, (time.perf_counter() - started) * 1000)
+        return value, strategy
+
+    def stats(self):
+        with self._lock:
+            calls = sum(self._counts.values())
+            return dict(
+                self._counts,
+                calls=calls,
+                avg_ms=round(self._total_ms / calls, 3) if calls else 0.0,
+                max_ms=round(self._max_ms, 3),
+            )
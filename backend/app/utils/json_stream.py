@@ -0,0 +1,116 @@
+# app/utils/json_stream.py
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class IncrementalDaysParser:
+    """增量解析流式返回的行程JSON
+
+    按块喂入模型输出，每当顶层对象中 "days" 数组的某个元素 (一天的行程)
+    的右花括号到达时，立即解析并返回该对象，而不必等待整个JSON输出完毕。
+    含有 days 的顶层对象结束后停止扫描；之前不含 days 的顶层对象 (如正文中的示例) 会被跳过。
+    只扫描新到达的字符，总开销与输出长度成线性关系。
+    """
+
+    def __init__(self, array_key='days'):
+        self.array_key = array_key
+        self._buffer = []          # 已到达的文本块
+        self._text = ''            # 拼接后的完整文本 (惰性更新)
+        self._pos = 0              # 下一个待扫描字符的位置
+        self._stack = []           # 容器栈: 每项为 [类型('{'或'['), 当前键]
+        self._in_string = False
+        self._escape = False
+        self._string_start = None
+        self._last_string = None
+        self._item_start = None    # 当前 days 元素的起始位置
+        self._array_depth = None   # days 数组在栈中的深度
+        self._done = False
+        self.emitted = 0
+
+    @property
+    def text(self):
+        """目前为止收到的全部文本"""
+        if self._buffer:
+            self._text += ''.join(self._buffer)
+            self._buffer = []
+        return self._text
+
+    def feed(self, chunk):
+        """喂入一段文本，返回本次新完成的 days 元素列表"""
+        if not chunk:
+            return []
+        self._buffer.append(chunk)
+        text = self.text
+        completed = []
+
+        i = self._pos
+        length = len(text)
+        while i < length and not self._done:
+            ch = text[i]
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == '\\':
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    self._last_string = text[self._string_start + 1:i]
+                i += 1
+                continue
+
+            if ch == '"':
+                if self._stack:
+                    self._in_string = True
+                    self._string_start = i
+            elif ch == '{' or ch == '[':
+                key = None
+                if self._stack and self._stack[-1][0] == '{':
+                    key = self._stack[-1][1]
+                if (ch == '[' and len(self._stack) == 1 and key == self.array_key
+                        and self._array_depth is None):
+                    self._array_depth = len(self._stack) + 1
+                elif (ch == '{' and self._array_depth is not None
+                        and len(self._stack) == self._array_depth):
+                    self._item_start = i
+                if ch == '{' or self._stack:
+                    self._stack.append([ch, None])
+            elif ch == ':':
+                if self._stack and self._stack[-1][0] == '{':
+                    self._stack[-1][1] = self._last_string
+            elif ch == ',':
+                if self._stack and self._stack[-1][0] == '{':
+                    self._stack[-1][1] = None
+            elif ch == '}' or ch == ']':
+                if self._stack:
+                    self._stack.pop()
+                    depth = len(self._stack)
+                    if (ch == '}' and self._item_start is not None
+                            and depth == self._array_depth):
+                        item = self._parse_item(text[self._item_start:i + 1])
+                        self._item_start = None
+                        if item is not None:
+                            completed.append(item)
+                            self.emitted += 1
+                    elif ch == ']' and self._array_depth is not None and depth == self._array_depth - 1:
+                        self._array_depth = -1  # days 数组已结束，不再匹配
+                    if depth == 0:
+                        if self._array_depth is not None:
+                            self._done = True
+                        # 不含 days 的顶层对象 (如正文中的示例) 结束后继续寻找下一个顶层对象
+                        self._last_string = None
+            i += 1
+
+        self._pos = i
+        return completed
+
+    @staticmethod
+    def _parse_item(raw):
+        try:
+            item = json.loads(raw)
+        except ValueError:
+            logger.warning(f"无法解析流式行程中的单日数据: {raw[:200]}")
+            return None
+        return item if isinstance(item, dict) else None
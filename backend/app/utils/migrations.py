@@ -0,0 +1,55 @@
+# app/utils/migrations.py
+import datetime
+import logging
+
+from ..models.trips.trip_plan import TripPlan
+from ..models.trips.user_trip import UserTrip
+from ..models.trips.trip_item import TripItem
+from .search_index import SEARCH_VERSION, backfill_keywords
+
+logger = logging.getLogger(__name__)
+
+# 已执行的数据迁移及其版本: {_id: 迁移名称, version, applied_at}
+COLLECTION = 'schemaMigrations'
+
+
+def _backfill_search_keywords(mongo):
+    backfill_keywords(mongo, TripPlan.COLLECTION)
+    backfill_keywords(mongo, UserTrip.COLLECTION, plans_collection=TripPlan.COLLECTION)
+
+
+# (名称, 版本, 迁移函数)；迁移函数需要可以重复执行 (多个进程同时启动时可能都会执行)
+MIGRATIONS = [
+    # 检索关键词 (规则变化时 SEARCH_VERSION 递增，重新生成旧版本的关键词)
+    ('search_keywords', SEARCH_VERSION, _backfill_search_keywords),
+    # 嵌在 userTrips 中的消息、动态和笔记迁移到独立集合
+    ('trip_items', 1, TripItem.migrate_all),
+]
+
+
+def run_migration(mongo, name, version, migrate):
+    """执行一次性的数据迁移: 存储的版本标记已不低于 version 时直接跳过，只读取一条标记文档
+
+    迁移成功后写入版本标记；失败时记录日志且不写标记，下次启动重试。返回是否执行了迁移。
+    """
+    marker = mongo.db[COLLECTION].find_one({'_id': name})
+    if marker and marker.get('version', 0) >= version:
+        return False
+    try:
+        migrate(mongo)
+    except Exception as e:
+        logger.warning(f"数据迁移 {name} (版本 {version}) 失败: {e}")
+        return False
+    mongo.db[COLLECTION].update_one(
+        {'_id': name},
+        {'$set': {'version': version, 'applied_at': datetime.datetime.now(datetime.timezone.utc)}},
+        upsert=True
+    )
+    logger.info(f"数据迁移 {name} 已完成 (版本 {version})")
+    return True
+
+
+def run_pending_migrations(mongo):
+    """执行尚未完成的数据迁移 (启动时调用，全部完成后每项只有一次按 _id 的查询)"""
+    for name, version, migrate in MIGRATIONS:
+        run_migration(mongo, name, version, migrate)
@@ -5,6 +5,14 @@ import datetime
 # 确保导入 UserTrip 和 TripPlan 以便访问 COLLECTION 名称
 from ..models.trips.user_trip import UserTrip
 from ..models.trips.trip_plan import TripPlan # 现在需要导入 TripPlan
+from ..models.trips.trip_item import TripItem
+from .trip_cache import TripPlanCache
+from ..models.ai_job import AIJob
+from ..models.conversation import Conversation
+from .single_flight import SingleFlight
+from .usage_meter import UsageMeter
+from .search_index import KEYWORDS_FIELD
+from .migrations import run_pending_migrations
 
 
 # parse_mongo_doc 函数已移至 type_parsers.py (假设你已采纳方案二)
@@ -37,6 +45,10 @@ def init_mongo_indexes(mongo):
     create_mongo_index(mongo, TripPlan.COLLECTION, [('tags', 1)])
     create_mongo_index(mongo, TripPlan.COLLECTION, [('updated_at', -1)])
     create_mongo_index(mongo, TripPlan.COLLECTION, [('created_at', -1)])
+    create_mongo_index(mongo, TripPlan.COLLECTION, [(KEYWORDS_FIELD, 1)]) # 搜索 (q) 的关键词多键索引
+    # 列表的游标分页: 与 TripPlan.SORTS 中的排序键一致
+    create_mongo_index(mongo, TripPlan.COLLECTION, [('updated_at', -1), ('_id', -1)])
+    create_mongo_index(mongo, TripPlan.COLLECTION, [('rating', -1), ('updated_at', -1), ('_id', -1)])
     # 可以为 TripPlan 添加 creator_id (如果模板有创建者) 和可能的公开/热门标志索引
     # create_mongo_index(mongo, TripPlan.COLLECTION, [('is_public_template', 1), ('rating', -1)])
 
@@ -49,15 +61,50 @@ def init_mongo_indexes(mongo):
     create_mongo_index(mongo, UserTrip.COLLECTION, [('travel_status', 1)])
     create_mongo_index(mongo, UserTrip.COLLECTION, [('updated_at', -1)])
     create_mongo_index(mongo, UserTrip.COLLECTION, [('created_at', -1)])
+    # 列表的游标分页: 方案市场按发布状态过滤后按 UserTrip.SORTS 排序，"我的行程" 的 $or 两个分支各自按更新时间排序
+    for sort_criteria in UserTrip.SORTS.values():
+        create_mongo_index(mongo, UserTrip.COLLECTION, [('publish_status', 1)] + sort_criteria)
+    create_mongo_index(mongo, UserTrip.COLLECTION, [('publish_status', 1), (KEYWORDS_FIELD, 1)]) # 方案市场搜索
+    create_mongo_index(mongo, UserTrip.COLLECTION, [('creator_id', 1), ('updated_at', -1), ('_id', -1)])
+    create_mongo_index(mongo, UserTrip.COLLECTION, [('members.userId', 1), ('updated_at', -1), ('_id', -1)])
     
     # 用于方案市场查询 UserTrip (如果 UserTrip 也有评分等属性)
     # create_mongo_index(mongo, UserTrip.COLLECTION, [('rating', -1), ('publish_status', 1)])
     # create_mongo_index(mongo, UserTrip.COLLECTION, [('price_display', 1), ('publish_status', 1)])
+
+    # 行程消息、动态和笔记 (按时间倒序分页；迁移嵌入数据时按 id 去重)
+    for collection in TripItem.COLLECTIONS.values():
+        create_mongo_index(mongo, collection, [('trip_id', 1), ('timestamp', -1), ('_id', -1)])
+        create_mongo_index(mongo, collection, [('trip_id', 1), ('id', 1)])
     
     # 验证码集合索引
     create_mongo_index(mongo, 'verification_codes', [('email', 1), ('purpose', 1)])
     create_mongo_index(mongo, 'verification_codes', [('code', 1)])
     create_mongo_index(mongo, 'verification_codes', [('expires_at', 1)])
     create_mongo_index(mongo, 'verification_codes', [('used', 1)])
+    
+    # AI行程生成缓存索引 (expires_at 为TTL索引，过期文档由MongoDB自动清理)
+    create_mongo_index(mongo, TripPlanCache.COLLECTION, [('expires_at', 1)], {'expireAfterSeconds': 0})
+    create_mongo_index(mongo, TripPlanCache.COLLECTION, [('intent_key', 1), ('updated_at', -1)])
+    
+    # AI异步任务索引 (任务记录过期后自动清理)
+    create_mongo_index(mongo, AIJob.COLLECTION, [('expires_at', 1)], {'expireAfterSeconds': 0})
+    
+    # AI对话会话索引 (最后一次活动后 EXPIRY_DAYS 天自动清理)
+    create_mongo_index(mongo, Conversation.COLLECTION, [('expires_at', 1)], {'expireAfterSeconds': 0})
+    create_mongo_index(mongo, Conversation.COLLECTION, [('user_id', 1), ('updated_at', -1)])
+    
+    # AI请求合并租约索引 (结果保留很短时间后自动清理)
+    create_mongo_index(mongo, SingleFlight.COLLECTION, [('expires_at', 1)], {'expireAfterSeconds': 0})
+    
+    # AI调用计量索引 (明细保留 AI_USAGE_RETENTION_DAYS 天；汇总按周期和时间查询，可按用户或路由过滤)
+    create_mongo_index(mongo, UsageMeter.COLLECTION, [('expires_at', 1)], {'expireAfterSeconds': 0})
+    create_mongo_index(mongo, UsageMeter.COLLECTION, [('user_id', 1), ('bucket', -1)])
+    create_mongo_index(mongo, UsageMeter.ROLLUP_COLLECTION, [('period', 1), ('start', -1)])
+    create_mongo_index(mongo, UsageMeter.ROLLUP_COLLECTION, [('period', 1), ('user_id', 1), ('start', -1)])
+    create_mongo_index(mongo, UsageMeter.ROLLUP_COLLECTION, [('period', 1), ('route', 1), ('start', -1)])
+
+    # 一次性数据迁移 (检索关键词、嵌入的消息等)，按 schemaMigrations 中的版本标记跳过已完成的迁移
+    run_pending_migrations(mongo)
         
     print("MongoDB索引初始化完成。")
\ No newline at end of file
@@ -0,0 +1,88 @@
+# app/utils/pagination.py
+import base64
+import binascii
+
+from bson import json_util
+
+# 每页条数的默认值和上限
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+def encode_cursor(values):
+    """把排序键的值 (可以包含 datetime、ObjectId) 编码为不透明的游标字符串"""
+    raw = json_util.dumps(list(values)).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, size=None):
+    """解析 encode_cursor 生成的游标，返回值列表；格式错误时抛出 ValueError"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json_util.loads(base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8'))
+    except (ValueError, TypeError, binascii.Error, UnicodeError) as e:
+        raise ValueError(f"无效的游标: {e}")
+    if not isinstance(values, list) or (size is not None and len(values) != size):
+        raise ValueError("无效的游标")
+    return values
+
+
+def keyset_filter(sort, values):
+    """按排序键生成 "在游标之后" 的查询条件
+
+    sort 为 [(字段, 1/-1), ...]，最后一个字段应唯一 (通常为 _id)；values 为游标中对应的值。
+    例如按 (timestamp 降序, _id 降序) 时生成
+    {'$or': [{'timestamp': {'$lt': t}}, {'timestamp': t, '_id': {'$lt': id}}]}
+    缺失的字段和 null 一样排在最小的位置，降序时排在最后。
+    """
+    branches = []
+    for index, (field, direction) in enumerate(sort):
+        condition = _after(field, direction, values[index])
+        if condition is None:
+            continue
+        branch = {f: values[i] for i, (f, _) in enumerate(sort[:index])}
+        branch.update(condition)
+        branches.append(branch)
+    if not branches:
+        return {'_id': {'$exists': False}} # 游标已经在最后，不会再有结果
+    return branches[0] if len(branches) == 1 else {'$or': branches}
+
+
+def _after(field, direction, value):
+    """单个字段 "排在 value 之后" 的条件；不存在时返回 None"""
+    if direction < 0:
+        if value is None:
+            return None
+        # 比较运算不匹配 null，缺失该字段的文档在降序中排在所有值之后，需要单独包含
+        return {'$or': [{field: {'$lt': value}}, {field: None}]}
+    if value is None:
+        return {field: {'$ne': None}}
+    return {field: {'$gt': value}}
+
+
+def cursor_filter(cursor, sort, tag=None):
+    """解析游标并生成查询条件；tag 用于区分不同排序方式的游标，不匹配时抛出 ValueError"""
+    values = decode_cursor(cursor, len(sort) + (1 if tag else 0))
+    if tag:
+        if values[0] != tag:
+            raise ValueError("游标与当前排序方式不匹配")
+        values = values[1:]
+    return keyset_filter(sort, values)
+
+
+def split_page(docs, sort, limit, tag=None):
+    """docs 为按 sort 查询的 limit+1 条结果，返回 (当前页, 下一页游标)；没有下一页时游标为 None"""
+    if len(docs) <= limit:
+        return docs, None
+    docs = docs[:limit]
+    values = [docs[-1].get(field) for field, _ in sort]
+    return docs, encode_cursor(([tag] if tag else []) + values)
+
+
+def page_size(value, default=DEFAULT_PAGE_SIZE):
+    """解析每页条数，限制在 1~MAX_PAGE_SIZE 之间"""
+    try:
+        size = int(value) if value not in (None, '') else default
+    except (TypeError, ValueError):
+        size = default
+    return max(1, min(size, MAX_PAGE_SIZE))
@@ -0,0 +1,98 @@
+# app/utils/projection.py
+import re
+
+# 列表接口的返回视图: full 返回完整文档，summary 只返回列表卡片需要的字段
+VIEW_FULL = 'full'
+VIEW_SUMMARY = 'summary'
+VIEWS = (VIEW_FULL, VIEW_SUMMARY)
+
+# 同一请求最多投影的字段数
+MAX_FIELDS = 50
+
+_FIELD_PATTERN = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*(\.[A-Za-z_][A-Za-z0-9_]*)*$')
+
+
+class ListProjection:
+    """列表查询的投影
+
+    fields 为主文档的投影 (None 表示返回完整文档)；
+    plan_fields 为关联的 plan_details 的投影 (None 表示完整的 plan_details)；
+    include_plan 为 False 时不需要 plan_details，可以跳过 $lookup。
+    """
+
+    __slots__ = ('fields', 'plan_fields', 'include_plan')
+
+    def __init__(self, fields=None, plan_fields=None, include_plan=True):
+        self.fields = fields
+        self.plan_fields = plan_fields
+        self.include_plan = include_plan
+
+    @property
+    def is_full(self):
+        return self.fields is None and self.plan_fields is None and self.include_plan
+
+
+def parse_fields(value):
+    """解析逗号分隔的字段列表；字段名不合法 (例如以 $ 开头) 时抛出 ValueError"""
+    fields = []
+    for name in (value or '').split(','):
+        name = name.strip()
+        if not name:
+            continue
+        if not _FIELD_PATTERN.match(name):
+            raise ValueError(f"无效的字段名: {name}")
+        if name not in fields:
+            fields.append(name)
+    if len(fields) > MAX_FIELDS:
+        raise ValueError(f"最多只能指定 {MAX_FIELDS} 个字段")
+    return fields
+
+
+def build_projection(view=None, fields=None, summary_fields=(), plan_summary_fields=None,
+                     nested='plan_details'):
+    """根据 view / fields 查询参数生成 ListProjection，参数不合法时抛出 ValueError
+
+    - fields 优先于 view；以 "plan_details." 开头的字段投影到关联的方案上，
+      只写 "plan_details" 表示完整的方案，两者都没有时不返回 plan_details
+    - view=summary 时使用 summary_fields 和 plan_summary_fields
+    - 默认 (view=full) 返回完整文档
+    """
+    view = (view or VIEW_FULL).lower()
+    if view not in VIEWS:
+        raise ValueError(f"无效的 view 参数: {view} (可选: {', '.join(VIEWS)})")
+
+    names = parse_fields(fields)
+    if names:
+        prefix = f"{nested}." if nested else None
+        plan_names = [name[len(prefix):] for name in names if prefix and name.startswith(prefix)]
+        own_names = [name for name in names if not (prefix and name.startswith(prefix)) and name != nested]
+        include_plan = bool(nested) and (nested in names or bool(plan_names))
+        if include_plan:
+            own_names.append(nested)
+        return ListProjection(
+            fields=to_projection(own_names),
+            plan_fields=to_projection(plan_names) if plan_names else None,
+            include_plan=include_plan,
+        )
+
+    if view == VIEW_SUMMARY:
+        own_names = list(summary_fields)
+        if nested and plan_summary_fields is not None:
+            own_names.append(nested)
+        return ListProjection(
+            fields=to_projection(own_names),
+            plan_fields=to_projection(plan_summary_fields) if plan_summary_fields is not None else None,
+            include_plan=bool(nested) and plan_summary_fields is not None,
+        )
+
+    return ListProjection()
+
+
+def to_projection(names):
+    """字段列表转换为MongoDB的包含式投影；父字段已包含时省略其子字段，避免路径冲突"""
+    names = sorted(set(names), key=len)
+    kept = []
+    for name in names:
+        if not any(name.startswith(parent + '.') for parent in kept):
+            kept.append(name)
+    return {name: 1 for name in kept}
@@ -0,0 +1,33 @@
+# app/utils/prompt_builder.py
+import string
+
+
+class PromptTemplate:
+    """前缀稳定的提示词模板
+
+    上游按请求开头逐字相同的前缀命中上下文缓存 (命中部分计费更低、首字更快)，
+    因此消息一律按 "固定的系统提示词 -> 固定的任务和格式说明 -> 本次请求的数据" 排列。
+    前两部分在导入时拼好，所有请求完全相同；目的地、行程、用户要求等可变内容只出现在末尾。
+    说明部分不经过 format，JSON 示例中的花括号无需转义。
+    """
+
+    def __init__(self, system, instructions, data_template):
+        self.system = system
+        self.prefix = instructions.strip() + '\n\n'
+        self.data_template = data_template.strip()
+        self.fields = frozenset(
+            name for _, name, _, _ in string.Formatter().parse(self.data_template) if name
+        )
+
+    def render(self, **values):
+        """拼出用户消息: 固定前缀 + 本次请求的数据"""
+        missing = self.fields - values.keys()
+        if missing:
+            raise KeyError(f"提示词模板缺少字段: {', '.join(sorted(missing))}")
+        return self.prefix + self.data_template.format(**values)
+
+    def messages(self, **values):
+        return [
+            {'role': 'system', 'content': self.system},
+            {'role': 'user', 'content': self.render(**values)},
+        ]
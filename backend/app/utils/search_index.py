@@ -0,0 +1,214 @@
+# app/utils/search_index.py
+import logging
+import re
+
+from pymongo import UpdateOne
+
+logger = logging.getLogger(__name__)
+
+# 关键词规则变化时递增，启动时重建旧版本的关键词
+SEARCH_VERSION = 1
+
+KEYWORDS_FIELD = 'search_keywords'             # 全部关键词 (名称、目的地、描述、标签、活动地点)
+TITLE_KEYWORDS_FIELD = 'search_title_keywords'  # 名称、目的地和标签的关键词，计算相关度时权重更高
+VERSION_FIELD = 'search_version'
+RELEVANCE_FIELD = 'relevance'                   # 搜索时计算的相关度，只用于排序和游标
+INTERNAL_FIELDS = (KEYWORDS_FIELD, TITLE_KEYWORDS_FIELD, VERSION_FIELD)
+
+# 变化时需要重新生成关键词的字段
+SOURCE_FIELDS = ('name', 'user_trip_name_override', 'destination', 'description', 'tags', 'days')
+
+# 每个文档最多保存的关键词数
+MAX_KEYWORDS = 1000
+# 查询最多使用的关键词数
+MAX_QUERY_TOKENS = 16
+# 名称、目的地和标签中命中的关键词额外加权
+TITLE_WEIGHT = 2
+
+# 连续的汉字 (含扩展A区) 或连续的字母数字
+_TOKEN_PATTERN = re.compile(r'[㐀-䶿一-鿿]+|[a-z0-9]+')
+_CJK_PATTERN = re.compile(r'[㐀-䶿一-鿿]')
+_ACTIVITY_LOCATION_FIELDS = ('location', 'location_name', 'address')
+
+
+def tokenize(text):
+    """切分为关键词: 汉字按相邻两字 (bigram) 切分，字母数字按单词切分并转为小写
+
+    每段连续汉字的最后一个字也单独作为关键词，这样任意一个汉字都是某个关键词的开头，
+    单字查询可以用前缀匹配 (^字) 走索引。例如 "成都美食" -> 成都、都美、美食、食。
+    """
+    tokens = []
+    for run in _TOKEN_PATTERN.findall(str(text or '').lower()):
+        if _CJK_PATTERN.match(run):
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+            tokens.append(run[-1])
+        else:
+            tokens.append(run)
+    return tokens
+
+
+def _texts(doc, plan=None):
+    """取出用于检索的文本，返回 (名称/目的地/标签, 描述/活动地点)；行程自身的字段优先于关联的方案"""
+    def pick(field):
+        value = doc.get(field)
+        if value in (None, '', []) and plan:
+            value = plan.get(field)
+        return value
+
+    title = [pick('user_trip_name_override'), pick('name'), pick('destination')]
+    tags = pick('tags')
+    if isinstance(tags, list):
+        title.extend(tag for tag in tags if isinstance(tag, str))
+    elif isinstance(tags, str):
+        title.append(tags)
+
+    body = [pick('description')]
+    for day in pick('days') or []:
+        if not isinstance(day, dict):
+            continue
+        for activity in day.get('activities') or []:
+            if isinstance(activity, dict):
+                body.extend(activity.get(field) for field in _ACTIVITY_LOCATION_FIELDS)
+    return ([text for text in title if isinstance(text, str)],
+            [text for text in body if isinstance(text, str)])
+
+
+def build_keywords(doc, plan=None):
+    """生成需要写入文档的关键词字段"""
+    title, body = _texts(doc, plan)
+    title_tokens = list(dict.fromkeys(token for text in title for token in tokenize(text)))
+    all_tokens = list(dict.fromkeys(title_tokens + [token for text in body for token in tokenize(text)]))
+    return {
+        KEYWORDS_FIELD: all_tokens[:MAX_KEYWORDS],
+        TITLE_KEYWORDS_FIELD: title_tokens[:MAX_KEYWORDS],
+        VERSION_FIELD: SEARCH_VERSION,
+    }
+
+
+def attach_search_keywords(doc, plan=None):
+    """在文档上写入关键词字段 (原地修改) 并返回文档"""
+    if isinstance(doc, dict):
+        doc.update(build_keywords(doc, plan))
+    return doc
+
+
+def strip_search_keywords(doc):
+    """去掉关键词字段，返回给客户端时使用"""
+    for field in INTERNAL_FIELDS:
+        doc.pop(field, None)
+    return doc
+
+
+def parse_query(q):
+    """解析搜索词，返回 (关键词, 单字前缀, 最少命中数)；没有可用的关键词时抛出 ValueError
+
+    连续汉字按 bigram 切分，但不要求全部命中: 搜索词中的词语边界未知，跨词的 bigram
+    (如 "成都美食" 中的 "都美") 在目的地为成都、标签为美食的文档中并不存在。
+    由两个字以上的词语组成时，跨词的 bigram 最多约占一半，因此每段汉字要求命中一半 (向上取整)；
+    字母数字单词要求全部命中；单独的一个汉字按关键词前缀匹配。
+    """
+    tokens, prefixes = [], []
+    min_hits = 0
+    for run in _TOKEN_PATTERN.findall(str(q or '').lower()):
+        if _CJK_PATTERN.match(run) and len(run) == 1:
+            prefixes.append(run)
+        elif _CJK_PATTERN.match(run):
+            bigrams = [token for token in dict.fromkeys(run[i:i + 2] for i in range(len(run) - 1))
+                       if token not in tokens]
+            tokens.extend(bigrams)
+            min_hits += (len(bigrams) + 1) // 2
+        elif run not in tokens:
+            tokens.append(run)
+            min_hits += 1
+    tokens = tokens[:MAX_QUERY_TOKENS]
+    prefixes = list(dict.fromkeys(prefixes))[:MAX_QUERY_TOKENS]
+    if not tokens and not prefixes:
+        raise ValueError("搜索词中没有可检索的文字")
+    return tokens, prefixes, min(min_hits, len(tokens))
+
+
+def _hits(source, cond):
+    """文档的 source 关键词数组中满足 cond 的个数 (聚合表达式，$$token 为当前关键词)"""
+    return {'$size': {'$filter': {
+        'input': {'$ifNull': [f'${source}', []]},
+        'as': 'token',
+        'cond': cond,
+    }}}
+
+
+def search_filter(q):
+    """搜索词对应的查询条件: 用 search_keywords 上的多键索引取出命中任一关键词的文档，再要求命中数达到下限"""
+    tokens, prefixes, min_hits = parse_query(q)
+    conditions = []
+    if tokens:
+        conditions.append({KEYWORDS_FIELD: {'$in': tokens}})
+        if min_hits > 1:
+            conditions.append({'$expr': {'$gte': [_hits(KEYWORDS_FIELD, {'$in': ['$$token', tokens]}), min_hits]}})
+    for prefix in prefixes:
+        # 锚定开头的正则可以按索引范围扫描
+        conditions.append({KEYWORDS_FIELD: {'$regex': f'^{re.escape(prefix)}'}})
+    return conditions[0] if len(conditions) == 1 else {'$and': conditions}
+
+
+def relevance_stage(q, field=RELEVANCE_FIELD):
+    """计算相关度的聚合阶段: 命中的关键词比例，名称、目的地和标签中的命中按 TITLE_WEIGHT 加权"""
+    tokens, prefixes, _ = parse_query(q)
+    if tokens:
+        terms, cond = tokens, {'$in': ['$$token', tokens]}
+    else:
+        # 只有单字时，按关键词的首字统计
+        terms, cond = prefixes, {'$in': [{'$substrCP': ['$$token', 0, 1]}, prefixes]}
+
+    score = {'$add': [_hits(KEYWORDS_FIELD, cond), {'$multiply': [TITLE_WEIGHT, _hits(TITLE_KEYWORDS_FIELD, cond)]}]}
+    return {'$addFields': {field: {'$divide': [score, len(terms)]}}}
+
+
+def strip_relevance(docs, field=RELEVANCE_FIELD):
+    """去掉相关度字段 (已用于生成下一页游标，不返回给客户端)"""
+    for doc in docs:
+        doc.pop(field, None)
+    return docs
+
+
+def refresh_keywords(mongo, collection, query, plans_collection=None, batch_size=500):
+    """重新生成满足条件的文档的关键词；plans_collection 不为空时合并关联方案 (plan_id) 的内容
+
+    返回更新的文档数。
+    """
+    projection = {field: 1 for field in SOURCE_FIELDS + ('plan_id',)}
+    updated = 0
+    batch = []
+
+    def flush(batch):
+        plans = {}
+        plan_ids = list({doc['plan_id'] for doc in batch if plans_collection and doc.get('plan_id')})
+        if plan_ids:
+            plan_projection = {field: 1 for field in SOURCE_FIELDS}
+            for plan in mongo.db[plans_collection].find({'_id': {'$in': plan_ids}}, plan_projection):
+                plans[plan['_id']] = plan
+        operations = [
+            UpdateOne({'_id': doc['_id']}, {'$set': build_keywords(doc, plans.get(doc.get('plan_id')))})
+            for doc in batch
+        ]
+        mongo.db[collection].bulk_write(operations, ordered=False)
+        return len(operations)
+
+    for doc in mongo.db[collection].find(query, projection):
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            updated += flush(batch)
+            batch = []
+    if batch:
+        updated += flush(batch)
+    return updated
+
+
+def backfill_keywords(mongo, collection, plans_collection=None):
+    """为缺少关键词或版本较旧的文档生成关键词
+
+    查询条件 ($ne) 无法使用索引，需要扫描整个集合，只在一次性迁移中调用 (见 utils.migrations)。
+    """
+    updated = refresh_keywords(mongo, collection, {VERSION_FIELD: {'$ne': SEARCH_VERSION}}, plans_collection)
+    if updated:
+        logger.info(f"已为 {updated} 个 {collection} 文档生成搜索关键词")
+    return updated
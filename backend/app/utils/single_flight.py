@@ -0,0 +1,195 @@
+# app/utils/single_flight.py
+import copy
+import datetime
+import hashlib
+import json
+import threading
+import time
+import uuid
+import logging
+
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+
+def make_flight_key(kind, payload):
+    """由请求类型和规范化后的请求内容生成合并键"""
+    body = json.dumps(payload, ensure_ascii=False, sort_keys=True, default=str)
+    return f"{kind}:{hashlib.sha256(body.encode('utf-8')).hexdigest()[:32]}"
+
+
+class _Flight:
+    __slots__ = ('done', 'result', 'error', 'waiters')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """合并相同的进行中请求 (single-flight)
+
+    同一个键同时只执行一次 fn，其余并发请求等待这次调用完成并共享结果 (或异常)。
+    调用结束后立即移除记录，之后到达的请求会重新执行，因此不会返回过期结果。
+    提供 mongo 时还通过 MongoDB 租约文档在多个worker之间合并：
+    抢到租约的worker执行调用并写回结果，其他worker轮询该文档；
+    租约过期 (执行者崩溃) 后由等待者接管。
+    """
+
+    COLLECTION = 'aiInflight'
+
+    # 结果在租约文档中保留的时间(秒)，供其他worker的轮询读取
+    RESULT_GRACE_SECONDS = 30
+
+    def __init__(self, mongo=None, wait_timeout=90, lease_seconds=None, poll_interval=0.2):
+        self.mongo = mongo
+        self.wait_timeout = wait_timeout
+        self.lease_seconds = lease_seconds or wait_timeout
+        self.poll_interval = poll_interval
+        self._flights = {}
+        self._lock = threading.Lock()
+        self._stats = {'leaders': 0, 'coalesced': 0, 'coalesced_remote': 0,
+                       'timeouts': 0, 'takeovers': 0}
+
+    def do(self, key, fn):
+        """执行或等待 fn()，返回 (result, shared)；shared 表示结果来自其他请求的调用"""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = self._flights[key] = _Flight()
+                leader = True
+            else:
+                flight.waiters += 1
+                leader = False
+
+        if not leader:
+            if flight.done.wait(self.wait_timeout):
+                self._incr('coalesced')
+                if flight.error is not None:
+                    raise flight.error
+                return copy.deepcopy(flight.result), True
+            # 等待超时: 不再等待，自行调用
+            self._incr('timeouts')
+            return fn(), False
+
+        try:
+            flight.result, shared = self._run_leader(key, fn)
+            return flight.result, shared
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+
+    def _run_leader(self, key, fn):
+        """本进程内的首个请求: 未启用跨worker合并时直接调用，否则先争抢租约"""
+        if self.mongo is None:
+            self._incr('leaders')
+            return fn(), False
+
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + self.wait_timeout
+        while True:
+            acquired = self._acquire(key, token)
+            if acquired is None or acquired:
+                # 抢到租约，或MongoDB不可用时退化为进程内合并
+                self._incr('leaders')
+                return self._call_and_publish(key, token if acquired else None, fn), False
+
+            doc = self._poll(key, deadline)
+            if doc is not None and doc.get('status') == 'done':
+                self._incr('coalesced_remote')
+                if doc.get('error'):
+                    raise Exception(doc['error'])
+                return doc.get('result'), True
+            if time.monotonic() >= deadline:
+                self._incr('timeouts')
+                self._incr('leaders')
+                return fn(), False
+            # 租约已过期: 下一轮重新争抢
+            self._incr('takeovers')
+
+    def _call_and_publish(self, key, token, fn):
+        try:
+            result = fn()
+        except Exception as e:
+            self._publish(key, token, error=str(e))
+            raise
+        self._publish(key, token, result=result)
+        return result
+
+    def _acquire(self, key, token):
+        """争抢租约: 成功返回True，已被其他worker持有返回False，MongoDB出错返回None"""
+        now = datetime.datetime.now(datetime.timezone.utc)
+        try:
+            self.mongo.db[self.COLLECTION].update_one(
+                {'_id': key, '$or': [{'status': 'done'}, {'lease_until': {'$lt': now}}]},
+                {'$set': {
+                    'status': 'running',
+                    'token': token,
+                    'result': None,
+                    'error': None,
+                    'lease_until': now + datetime.timedelta(seconds=self.lease_seconds),
+                    'expires_at': now + datetime.timedelta(seconds=self.lease_seconds + self.RESULT_GRACE_SECONDS),
+                }},
+                upsert=True
+            )
+            return True
+        except DuplicateKeyError:
+            return False
+        except Exception as e:
+            logger.warning(f"获取请求合并租约失败: {e}")
+            return None
+
+    def _poll(self, key, deadline):
+        """轮询租约文档，直到结果写回、租约过期或等待超时；返回最后读到的文档"""
+        while True:
+            try:
+                doc = self.mongo.db[self.COLLECTION].find_one({'_id': key})
+            except Exception as e:
+                logger.warning(f"读取请求合并租约失败: {e}")
+                return None
+            if doc is None or doc.get('status') == 'done':
+                return doc
+            lease_until = doc.get('lease_until')
+            if lease_until is not None:
+                if lease_until.tzinfo is None:
+                    lease_until = lease_until.replace(tzinfo=datetime.timezone.utc)
+                if lease_until < datetime.datetime.now(datetime.timezone.utc):
+                    return doc
+            if time.monotonic() >= deadline:
+                return doc
+            time.sleep(self.poll_interval)
+
+    def _publish(self, key, token, result=None, error=None):
+        """写回结果 (只有仍持有租约时才写入)"""
+        if token is None:
+            return
+        now = datetime.datetime.now(datetime.timezone.utc)
+        try:
+            self.mongo.db[self.COLLECTION].update_one(
+                {'_id': key, 'token': token},
+                {'$set': {
+                    'status': 'done',
+                    'result': result,
+                    'error': error,
+                    'expires_at': now + datetime.timedelta(seconds=self.RESULT_GRACE_SECONDS),
+                }}
+            )
+        except Exception as e:
+            logger.warning(f"写回请求合并结果失败: {e}")
+
+    def _incr(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['in_flight'] = len(self._flights)
+        return stats
@@ -0,0 +1,264 @@
+# app/utils/template_index.py
+import copy
+import datetime
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# 保存的行程使用下划线命名 (day_number、start_time 等)，AI接口返回驼峰命名，模板统一转换为后者
+_DAY_ALIASES = {
+    'day_number': 'dayNumber',
+    'daily_notes': 'notes',
+    'user_daily_notes': 'notes',
+}
+_ACTIVITY_ALIASES = {
+    'activity_id': 'id',
+    'user_activity_id': 'id',
+    'location_name': 'location',
+    'start_time': 'startTime',
+    'end_time': 'endTime',
+    'duration_minutes': 'durationMinutes',
+    'estimated_cost': 'estimatedCost',
+    'booking_info': 'bookingInfo',
+    'activity_notes': 'note',
+}
+# 模板中与具体用户无关、可以复用的字段
+_PLAN_FIELDS = ('name', 'destination', 'tags', 'description', 'coverImage')
+
+# 匹配评分的权重: 天数、标签、评分
+_WEIGHT_DAYS = 0.5
+_WEIGHT_TAGS = 0.35
+_WEIGHT_RATING = 0.15
+_DEFAULT_RATING = 3.0
+
+
+def _rename(item, aliases):
+    """按别名表把键名转换为AI行程格式，已有的驼峰字段优先"""
+    result = {}
+    for key, value in item.items():
+        target = aliases.get(key, key)
+        if target not in result or key == target:
+            result[target] = value
+    return result
+
+
+def to_plan_format(days):
+    """把保存的行程天数转换为AI接口返回的格式，去掉用户相关的字段"""
+    result = []
+    for day in days or []:
+        if not isinstance(day, dict):
+            continue
+        day = _rename(day, _DAY_ALIASES)
+        day['activities'] = [
+            _rename(activity, _ACTIVITY_ALIASES)
+            for activity in day.get('activities') or [] if isinstance(activity, dict)
+        ]
+        day.pop('date', None)
+        result.append(day)
+    return result
+
+
+class TripTemplate:
+    """一个可复用的已发布行程"""
+
+    __slots__ = ('trip_id', 'plan_id', 'destination', 'days', 'tags', 'rating', 'plan')
+
+    def __init__(self, trip_id, plan_id, destination, tags, rating, plan):
+        self.trip_id = trip_id
+        self.plan_id = plan_id
+        self.destination = destination
+        self.tags = frozenset(tags)
+        self.rating = rating
+        self.plan = plan
+        self.days = len(plan['days'])
+
+    def score(self, days, tags):
+        """与请求的匹配程度 (0~1): 天数相同最好，较长的模板可以截取，较短的按比例扣分；
+        标签按请求的标签被模板覆盖的比例计分"""
+        if self.days == days:
+            days_fit = 1.0
+        elif self.days > days:
+            days_fit = 0.85
+        else:
+            days_fit = 0.7 * self.days / days
+        wanted = set(tags or ())
+        tags_fit = len(wanted & self.tags) / len(wanted) if wanted else 0.5
+        rating = self.rating if self.rating is not None else _DEFAULT_RATING
+        return round(_WEIGHT_DAYS * days_fit + _WEIGHT_TAGS * tags_fit
+                     + _WEIGHT_RATING * min(max(rating, 0), 5) / 5, 4)
+
+
+class TemplateIndex:
+    """已发布行程的内存索引
+
+    从方案市场中已发布的用户行程 (publish_status=published，行程内容取自身的 days
+    或关联的 tripPlans 模板) 加载，按规范化的目的地分组，组内再按天数、标签和评分打分。
+    索引在首次使用时同步加载，之后由后台线程每 refresh_interval 秒重新加载，
+    查询只读内存，不访问MongoDB。
+    """
+
+    def __init__(self, mongo, trips_collection, plans_collection, resolve_destination=None,
+                 resolve_tags=None, refresh_interval=300, max_templates=5000):
+        self.mongo = mongo
+        self.trips_collection = trips_collection
+        self.plans_collection = plans_collection
+        self.resolve_destination = resolve_destination or (lambda text: (text or '').strip() or None)
+        self.resolve_tags = resolve_tags or (lambda tags: list(tags or []))
+        self.refresh_interval = refresh_interval
+        self.max_templates = max_templates
+        self._by_destination = {}
+        self._loaded_at = None
+        self._load_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self._stats = {'hits': 0, 'misses': 0, 'fallbacks': 0, 'refreshes': 0,
+                       'refresh_failures': 0, 'refresh_ms': 0.0}
+
+    # --- 查询 ---
+
+    def match(self, destination, days, tags, min_score=0.0, allow_shorter=True):
+        """返回 (模板, 分数)；没有满足条件的模板时返回 (None, 0)"""
+        self.ensure_loaded()
+        best, best_score = None, 0.0
+        for template in self._by_destination.get(destination, ()):
+            if not allow_shorter and template.days < days:
+                continue
+            score = template.score(days, tags)
+            if score > best_score:
+                best, best_score = template, score
+        if best is None or best_score < min_score:
+            return None, 0.0
+        return best, best_score
+
+    def instantiate(self, template, destination, days, tags, start_date=None):
+        """按请求生成行程副本: 截取所需天数、重新编号、按出发日期排日期
+
+        模板天数不足时只返回已有的天数，由调用方补齐。
+        """
+        plan = copy.deepcopy(template.plan)
+        plan['days'] = plan['days'][:days]
+        start_date = start_date or datetime.date.today()
+        for index, day in enumerate(plan['days']):
+            day['dayNumber'] = index + 1
+            day['date'] = (start_date + datetime.timedelta(days=index)).isoformat()
+            for position, activity in enumerate(day.get('activities') or []):
+                activity['id'] = f"act{index + 1}_{position + 1}"
+        if template.days != days:
+            plan['name'] = f"{destination}{days}天 {(tags or ['休闲'])[0]}之旅"
+        plan['destination'] = destination
+        plan['tags'] = list(dict.fromkeys(list(tags or []) + list(plan.get('tags') or [])))
+        plan['source'] = 'template'
+        plan['template_id'] = template.trip_id
+        return plan
+
+    def record(self, outcome):
+        """记录一次使用结果: hits (快速路径)、misses、fallbacks (上游失败时的兜底)"""
+        with self._lock:
+            self._stats[outcome] += 1
+
+    # --- 加载 ---
+
+    def ensure_loaded(self):
+        """首次使用时同步加载并启动后台刷新线程"""
+        if self._loaded_at is not None or self.mongo is None:
+            return
+        with self._load_lock:
+            if self._loaded_at is None:
+                self.refresh()
+        self.start()
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='trip-templates', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.refresh_interval):
+            self.refresh()
+
+    def refresh(self):
+        """重新加载全部模板，构建完成后整体替换索引"""
+        started = time.monotonic()
+        try:
+            by_destination = self._load()
+        except Exception as e:
+            logger.warning(f"加载行程模板失败: {e}")
+            with self._lock:
+                self._stats['refresh_failures'] += 1
+            self._loaded_at = self._loaded_at or time.time()
+            return False
+
+        self._by_destination = by_destination
+        self._loaded_at = time.time()
+        elapsed = (time.monotonic() - started) * 1000
+        with self._lock:
+            self._stats['refreshes'] += 1
+            self._stats['refresh_ms'] = round(elapsed, 1)
+        logger.info(f"行程模板索引已刷新: {sum(len(v) for v in by_destination.values())} 个模板, "
+                    f"{len(by_destination)} 个目的地, 耗时 {elapsed:.0f}ms")
+        return True
+
+    def _load(self):
+        trips = list(self.mongo.db[self.trips_collection].find(
+            {'publish_status': 'published'},
+            {'plan_id': 1, 'destination': 1, 'tags': 1, 'days': 1, 'user_trip_name_override': 1,
+             'description': 1, 'coverImage': 1, 'rating': 1, 'average_rating': 1},
+        ).sort('rating', -1).limit(self.max_templates))
+
+        plan_ids = list({trip['plan_id'] for trip in trips if trip.get('plan_id')})
+        plans = {}
+        if plan_ids:
+            projection = {field: 1 for field in _PLAN_FIELDS + ('days', 'average_rating', 'rating')}
+            for plan in self.mongo.db[self.plans_collection].find({'_id': {'$in': plan_ids}}, projection):
+                plans[plan['_id']] = plan
+
+        by_destination = {}
+        for trip in trips:
+            template = self._build(trip, plans.get(trip.get('plan_id')) or {})
+            if template is not None:
+                by_destination.setdefault(template.destination, []).append(template)
+        return by_destination
+
+    def _build(self, trip, plan):
+        days = to_plan_format(trip.get('days') or plan.get('days'))
+        if not days or not any(day.get('activities') for day in days):
+            return None
+        destination = self.resolve_destination(trip.get('destination') or plan.get('destination'))
+        if not destination:
+            return None
+
+        content = {field: plan.get(field) for field in _PLAN_FIELDS if plan.get(field) is not None}
+        for field in ('destination', 'description', 'coverImage', 'tags'):
+            if trip.get(field):
+                content[field] = trip[field]
+        if trip.get('user_trip_name_override'):
+            content['name'] = trip['user_trip_name_override']
+        content['days'] = days
+
+        rating = next((source[field] for source in (trip, plan) for field in ('rating', 'average_rating')
+                       if isinstance(source.get(field), (int, float))), None)
+        return TripTemplate(
+            str(trip['_id']),
+            str(trip['plan_id']) if trip.get('plan_id') else None,
+            destination,
+            self.resolve_tags(content.get('tags') or []),
+            rating,
+            content,
+        )
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        by_destination = self._by_destination
+        stats['templates'] = sum(len(v) for v in by_destination.values())
+        stats['destinations'] = len(by_destination)
+        stats['loaded_at'] = self._loaded_at
+        return stats
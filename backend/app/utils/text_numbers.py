@@ -0,0 +1,26 @@
+# app/utils/text_numbers.py
+
+# 用户输入中的数字: 阿拉伯数字或中文数字 (如 3 / 三 / 两 / 十二)，用于正则中的捕获组
+NUMBER_PATTERN = r'(\d+|[零一二两三四五六七八九十]+)'
+
+_CN_DIGITS = {'零': 0, '一': 1, '二': 2, '两': 2, '三': 3, '四': 4, '五': 5,
+              '六': 6, '七': 7, '八': 8, '九': 9}
+
+
+def parse_number(text):
+    """解析阿拉伯数字或中文数字 (支持到九十九)；无法解析时返回 None"""
+    if text is None:
+        return None
+    if text.isdigit():
+        return int(text)
+    if text == '十':
+        return 10
+    if '十' in text:
+        tens, _, units = text.partition('十')
+        return _CN_DIGITS.get(tens, 1) * 10 + (_CN_DIGITS.get(units, 0) if units else 0)
+    value = 0
+    for ch in text:
+        if ch not in _CN_DIGITS:
+            return None
+        value = value * 10 + _CN_DIGITS[ch]
+    return value
@@ -0,0 +1,195 @@
+# app/utils/trip_cache.py
+import datetime
+import hashlib
+import re
+import threading
+import time
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
+class TripPlanCache:
+    """AI生成行程的结果缓存
+
+    键由规范化的意图 (目的地、天数、排序后的标签) 和原始提示词的哈希组成。
+    一级为进程内带TTL的LRU，二级为MongoDB集合，使所有worker共享缓存。
+    开启 serve_nearest 后，精确未命中但同一意图已有结果时，先返回该结果，
+    同时在后台为当前提示词重新生成并写回缓存。
+    """
+
+    COLLECTION = 'aiTripCache'
+
+    def __init__(self, mongo=None, max_entries=256, ttl=86400, serve_nearest=False):
+        self.mongo = mongo
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.serve_nearest = serve_nearest
+        self._entries = OrderedDict()  # key -> (expires_at, plan)
+        self._latest_by_intent = {}    # intent_key -> 该意图最近写入的key
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self._stats = {
+            'memory_hits': 0,
+            'mongo_hits': 0,
+            'nearest_hits': 0,
+            'misses': 0,
+            'stores': 0,
+            'refreshes': 0,
+        }
+
+    @staticmethod
+    def make_key(destination, days, tags, prompt):
+        """返回 (intent_key, prompt_hash)"""
+        intent_key = f"{destination}|{days}|{','.join(sorted(set(tags or [])))}"
+        normalized_prompt = _WHITESPACE_RE.sub(' ', (prompt or '').strip().lower())
+        prompt_hash = hashlib.sha256(normalized_prompt.encode('utf-8')).hexdigest()[:32]
+        return intent_key, prompt_hash
+
+    def get(self, intent_key, prompt_hash):
+        """查询缓存，返回 (plan, match)；match 为 'exact'、'nearest' 或 None"""
+        key = self._full_key(intent_key, prompt_hash)
+
+        plan = self._memory_get(key)
+        if plan is not None:
+            self._incr('memory_hits')
+            return plan, 'exact'
+
+        doc = self._mongo_find({'_id': key})
+        if doc:
+            self._memory_set(key, intent_key, doc['plan'], doc.get('expires_at'))
+            self._incr('mongo_hits')
+            return doc['plan'], 'exact'
+
+        if self.serve_nearest:
+            plan = self._nearest(intent_key)
+            if plan is not None:
+                self._incr('nearest_hits')
+                return plan, 'nearest'
+
+        self._incr('misses')
+        return None, None
+
+    def set(self, intent_key, prompt_hash, plan):
+        """写入缓存 (内存 + MongoDB)"""
+        key = self._full_key(intent_key, prompt_hash)
+        now = datetime.datetime.now(datetime.timezone.utc)
+        expires_at = now + datetime.timedelta(seconds=self.ttl)
+        self._memory_set(key, intent_key, plan, expires_at)
+        self._incr('stores')
+
+        if self.mongo is None:
+            return
+        try:
+            self.mongo.db[self.COLLECTION].update_one(
+                {'_id': key},
+                {
+                    '$set': {
+                        'intent_key': intent_key,
+                        'prompt_hash': prompt_hash,
+                        'plan': plan,
+                        'updated_at': now,
+                        'expires_at': expires_at,
+                    },
+                    '$setOnInsert': {'created_at': now},
+                },
+                upsert=True
+            )
+        except Exception as e:
+            logger.warning(f"写入行程缓存失败: {e}")
+
+    def refresh_async(self, intent_key, prompt_hash, generate_fn):
+        """在后台线程中调用 generate_fn 重新生成结果并写回缓存，同一key同时只刷新一次"""
+        key = self._full_key(intent_key, prompt_hash)
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def worker():
+            try:
+                plan = generate_fn()
+                if plan:
+                    self.set(intent_key, prompt_hash, plan)
+                    self._incr('refreshes')
+            except Exception as e:
+                logger.warning(f"后台刷新行程缓存失败: {e}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=worker, name='trip-cache-refresh', daemon=True).start()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['memory_entries'] = len(self._entries)
+        lookups = stats['memory_hits'] + stats['mongo_hits'] + stats['nearest_hits'] + stats['misses']
+        stats['hit_rate'] = round((lookups - stats['misses']) / lookups, 4) if lookups else 0.0
+        return stats
+
+    # --- 内部方法 ---
+
+    @staticmethod
+    def _full_key(intent_key, prompt_hash):
+        return f"{intent_key}#{prompt_hash}"
+
+    def _incr(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def _memory_get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, plan = entry
+            if expires_at < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return plan
+
+    def _memory_set(self, key, intent_key, plan, expires_at=None):
+        if isinstance(expires_at, datetime.datetime):
+            if expires_at.tzinfo is None:
+                expires_at = expires_at.replace(tzinfo=datetime.timezone.utc)
+            expires_ts = expires_at.timestamp()
+        else:
+            expires_ts = time.time() + self.ttl
+        with self._lock:
+            self._entries[key] = (expires_ts, plan)
+            self._entries.move_to_end(key)
+            self._latest_by_intent[intent_key] = key
+            while len(self._entries) > self.max_entries:
+                evicted_key, _ = self._entries.popitem(last=False)
+                evicted_intent = evicted_key.rsplit('#', 1)[0]
+                if self._latest_by_intent.get(evicted_intent) == evicted_key:
+                    del self._latest_by_intent[evicted_intent]
+
+    def _nearest(self, intent_key):
+        with self._lock:
+            key = self._latest_by_intent.get(intent_key)
+        if key is not None:
+            plan = self._memory_get(key)
+            if plan is not None:
+                return plan
+
+        doc = self._mongo_find({'intent_key': intent_key}, sort=[('updated_at', -1)])
+        if doc:
+            self._memory_set(doc['_id'], intent_key, doc['plan'], doc.get('expires_at'))
+            return doc['plan']
+        return None
+
+    def _mongo_find(self, query, sort=None):
+        if self.mongo is None:
+            return None
+        query = dict(query, expires_at={'$gt': datetime.datetime.now(datetime.timezone.utc)})
+        try:
+            return self.mongo.db[self.COLLECTION].find_one(query, sort=sort)
+        except Exception as e:
+            logger.warning(f"读取行程缓存失败: {e}")
+            return None
@@ -0,0 +1,183 @@
+# app/utils/trip_patch.py
+import copy
+import datetime
+import json
+import re
+
+from .text_numbers import NUMBER_PATTERN as _NUM, parse_number
+
+# 修改指令中引用天数的写法: 第3天 / 第三天 / 第2-3天 / 第二到四天 / Day 3 / D3
+_DAY_RANGE_RE = re.compile(r'第\s*' + _NUM + r'\s*(?:天|日)?\s*(?:-|~|～|至|到)\s*(?:第\s*)?' + _NUM + r'\s*[天日]')
+_DAY_RE = re.compile(r'第\s*' + _NUM + r'\s*[天日]')
+# \b 在英文字母和汉字之间不成立 (汉字也算单词字符)，用前后不是字母数字代替，"第二天day2改成" 也能识别
+_DAY_EN_RE = re.compile(r'(?<![A-Za-z0-9])(?:day\s*|d)(\d+)(?![A-Za-z0-9])', re.IGNORECASE)
+_LAST_DAY_RE = re.compile(r'最后\s*' + _NUM + r'?\s*[天日]|末日|返程日')
+_FIRST_DAY_RE = re.compile(r'(?:前|头)\s*' + _NUM + r'\s*[天日]|首日')
+
+# 补丁支持的操作
+PATCH_OPS = ('replace_day', 'add_day', 'remove_day', 'set')
+
+# 补丁中允许通过 set 修改的顶层字段
+PATCHABLE_FIELDS = ('name', 'description', 'tags', 'destination', 'notes', 'note')
+
+
+class PatchScopeError(ValueError):
+    """补丁替换或删除了没有完整发送给模型的天数"""
+
+
+def select_target_days(plan, instruction):
+    """找出修改指令涉及的天数 (从1开始的dayNumber列表)
+
+    依次识别显式的天数引用 (第N天、第N-M天、Day N、最后一天、前两天) 和
+    指令中出现的活动标题/地点名称；都没有识别到时返回空列表，表示指令针对整个行程。
+    """
+    days = plan.get('days') or []
+    total = len(days)
+    if not total or not instruction:
+        return []
+
+    selected = set()
+
+    for match in _DAY_RANGE_RE.finditer(instruction):
+        start, end = parse_number(match.group(1)), parse_number(match.group(2))
+        if start and end:
+            selected.update(range(min(start, end), max(start, end) + 1))
+    for match in _DAY_RE.finditer(instruction):
+        number = parse_number(match.group(1))
+        if number:
+            selected.add(number)
+    for match in _DAY_EN_RE.finditer(instruction):
+        selected.add(int(match.group(1)))
+    for match in _LAST_DAY_RE.finditer(instruction):
+        count = parse_number(match.group(1)) if match.lastindex else None
+        selected.update(range(total - (count or 1) + 1, total + 1))
+    for match in _FIRST_DAY_RE.finditer(instruction):
+        count = parse_number(match.group(1)) if match.lastindex else None
+        selected.update(range(1, (count or 1) + 1))
+
+    # 指令中直接提到某个活动 (如"把故宫换成颐和园") 时，选中该活动所在的天
+    for index, day in enumerate(days):
+        for activity in day.get('activities') or []:
+            for field in ('title', 'location'):
+                name = activity.get(field)
+                if isinstance(name, str) and len(name) >= 2 and name in instruction:
+                    selected.add(_day_number(day, index))
+
+    return sorted(n for n in selected if 1 <= n <= total)
+
+
+def build_plan_outline(plan, selected_days):
+    """生成除选中天数以外的行程概要，供模型了解上下文"""
+    lines = [
+        f"行程名称: {plan.get('name', '')}",
+        f"目的地: {plan.get('destination', '')}",
+        f"标签: {'、'.join(plan.get('tags') or [])}",
+        f"总天数: {len(plan.get('days') or [])}",
+    ]
+    for index, day in enumerate(plan.get('days') or []):
+        number = _day_number(day, index)
+        if number in selected_days:
+            continue
+        titles = [a.get('title') or a.get('location') or '' for a in day.get('activities') or []]
+        lines.append(f"第{number}天 {day.get('title', '')}: {' / '.join(t for t in titles if t)}")
+    return '\n'.join(lines)
+
+
+def selected_days_payload(plan, selected_days):
+    """返回选中天数的完整数据"""
+    return [day for index, day in enumerate(plan.get('days') or [])
+            if _day_number(day, index) in selected_days]
+
+
+def to_prompt_json(value):
+    """将行程数据序列化为紧凑的JSON字符串，日期输出为 YYYY-MM-DD"""
+    def default(obj):
+        if isinstance(obj, datetime.datetime):
+            return obj.strftime('%Y-%m-%d')
+        return str(obj)
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'), default=default)
+
+
+def apply_trip_patch(plan, patch, affected_days=None):
+    """将补丁应用到行程上，返回新的行程 (不修改传入的plan)
+
+    patch 格式: {"operations": [
+        {"op": "replace_day", "dayNumber": 2, "day": {...}},
+        {"op": "add_day", "dayNumber": 4, "day": {...}},
+        {"op": "remove_day", "dayNumber": 3},
+        {"op": "set", "field": "name", "value": "..."}
+    ]}
+    dayNumber 均指应用补丁前的天数 (add_day 为新一天插入后的位置)；
+    应用后按顺序重新编号 dayNumber。操作不合法时抛出 ValueError。
+    affected_days 为发送给模型完整数据的天数，replace_day / remove_day 指向其他天时
+    抛出 PatchScopeError (模型只看到这些天的概要，不能覆盖或删除)；为 None 时不限制。
+    """
+    operations = patch.get('operations') if isinstance(patch, dict) else patch
+    if not isinstance(operations, list):
+        raise ValueError("补丁格式错误: 缺少 operations 列表")
+
+    result = copy.deepcopy(plan)
+    days = result.get('days') or []
+    # 以原始天数为键，便于在增删操作之间保持引用稳定
+    slots = {index + 1: [day] for index, day in enumerate(days)}
+    slots[0] = []
+    removed = set()
+
+    for op in operations:
+        if not isinstance(op, dict) or op.get('op') not in PATCH_OPS:
+            raise ValueError(f"不支持的补丁操作: {op}")
+        kind = op['op']
+
+        if kind == 'set':
+            field = op.get('field')
+            if field not in PATCHABLE_FIELDS:
+                raise ValueError(f"不允许修改字段: {field}")
+            result[field] = op.get('value')
+            continue
+
+        number = op.get('dayNumber')
+        if not isinstance(number, int):
+            number = parse_number(str(number)) if number is not None else None
+        if number is None:
+            raise ValueError(f"补丁操作缺少有效的 dayNumber: {op}")
+        if kind in ('replace_day', 'remove_day') and affected_days is not None and number not in affected_days:
+            raise PatchScopeError(f"补丁操作的第{number}天不在修改范围 {list(affected_days)} 内")
+
+        if kind == 'replace_day':
+            if number not in slots or number == 0 or number in removed:
+                raise ValueError(f"要替换的第{number}天不存在")
+            if not isinstance(op.get('day'), dict):
+                raise ValueError(f"replace_day 缺少 day 数据: {op}")
+            slots[number][0] = copy.deepcopy(op['day'])
+        elif kind == 'remove_day':
+            if number not in slots or number == 0 or number in removed:
+                raise ValueError(f"要删除的第{number}天不存在")
+            removed.add(number)
+        elif kind == 'add_day':
+            if not isinstance(op.get('day'), dict):
+                raise ValueError(f"add_day 缺少 day 数据: {op}")
+            # 插入到原第 number-1 天之后
+            anchor = max(0, min(number - 1, len(days)))
+            slots[anchor].append(copy.deepcopy(op['day']))
+
+    new_days = []
+    for number in range(0, len(days) + 1):
+        items = slots[number]
+        if number in removed:
+            items = items[1:]  # 保留在被删除天之后插入的新天
+        new_days.extend(items)
+    for index, day in enumerate(new_days):
+        day['dayNumber'] = index + 1
+
+    result['days'] = new_days
+    return result
+
+
+def _day_number(day, index):
+    number = day.get('dayNumber')
+    if isinstance(number, int):
+        return number
+    try:
+        return int(number)
+    except (TypeError, ValueError):
+        return index + 1
@@ -0,0 +1,310 @@
+# app/utils/usage_meter.py
+import atexit
+import datetime
+import logging
+import threading
+from contextlib import contextmanager
+
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+logger = logging.getLogger(__name__)
+
+PERIOD_HOUR = 'hour'
+PERIOD_DAY = 'day'
+PERIODS = (PERIOD_HOUR, PERIOD_DAY)
+
+# 汇总中累加的计数字段
+_SUM_FIELDS = ('calls', 'errors', 'streamed', 'truncated', 'prompt_tokens', 'completion_tokens',
+               'cache_hit_tokens', 'cache_miss_tokens', 'latency_ms_total')
+# 汇总中取最大值的字段
+_MAX_FIELDS = ('latency_ms_max', 'completion_tokens_max')
+
+
+def period_start(ts, period):
+    """时间所在小时/天(UTC)的起点"""
+    if period == PERIOD_DAY:
+        return ts.replace(hour=0, minute=0, second=0, microsecond=0)
+    return ts.replace(minute=0, second=0, microsecond=0)
+
+
+def rollup_id(period, start, user_id, route):
+    return f"{period}:{start.strftime('%Y%m%d%H')}:{user_id or '-'}:{route}"
+
+
+def finish_rollup(doc):
+    """补充平均值，去掉内部字段，返回可直接输出的汇总"""
+    row = {k: v for k, v in doc.items() if k != '_id'}
+    if isinstance(row.get('start'), datetime.datetime):
+        row['start'] = row['start'].replace(tzinfo=None).isoformat() + 'Z'
+    calls = row.get('calls') or 0
+    row['total_tokens'] = (row.get('prompt_tokens') or 0) + (row.get('completion_tokens') or 0)
+    row['avg_latency_ms'] = round(row.pop('latency_ms_total', 0) / calls, 1) if calls else 0.0
+    row['avg_completion_tokens'] = round((row.get('completion_tokens') or 0) / calls, 1) if calls else 0.0
+    return row
+
+
+class UsageMeter:
+    """AI上游调用的计量
+
+    - 每次调用记录用户、路由、模型、token用量、耗时、是否流式、finish_reason 和请求的 max_tokens
+    - 记录先缓冲在内存中，由后台线程按 flush_interval 或缓冲达到 flush_size 时批量写入
+      aiUsage 集合 (带小时桶字段 bucket，过期后由TTL索引清理)
+    - 同时在内存中预先聚合每个 (用户, 路由) 的小时和天汇总，刷新时以 $inc 批量更新到
+      aiUsageRollups 集合，查询汇总不需要扫描明细
+    - 写入失败的明细和汇总放回缓冲区，下次刷新时重试；缓冲的明细超过 max_buffer 时丢弃最旧的记录
+    """
+
+    COLLECTION = 'aiUsage'
+    ROLLUP_COLLECTION = 'aiUsageRollups'
+
+    def __init__(self, mongo, flush_interval=10, flush_size=200, max_buffer=10000, retention_days=30):
+        self.mongo = mongo
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.max_buffer = max_buffer
+        self.retention = datetime.timedelta(days=retention_days)
+        self._records = []
+        self._rollups = {}   # rollup_id -> 待累加的汇总
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._local = threading.local()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._stats = {'recorded': 0, 'flushed': 0, 'flushes': 0, 'flush_failures': 0, 'dropped': 0}
+
+    # --- 调用上下文 ---
+
+    @contextmanager
+    def scope(self, user_id=None, route=None):
+        """在当前线程内设置计量的用户和路由 (用于后台任务、批量生成等不在请求上下文中的调用)"""
+        previous = getattr(self._local, 'context', None)
+        self._local.context = (user_id, route)
+        try:
+            yield
+        finally:
+            self._local.context = previous
+
+    def current_scope(self):
+        """返回 scope 设置的 (用户, 路由)，未设置时返回 None"""
+        return getattr(self._local, 'context', None)
+
+    # --- 记录 ---
+
+    def record(self, route, user_id=None, model=None, usage=None, latency_ms=0.0, error=None,
+               stream=False, max_tokens=None, finish_reason=None):
+        """记录一次上游调用；usage 为上游返回的 usage 字段"""
+        usage = usage or {}
+        now = datetime.datetime.now(datetime.timezone.utc)
+        prompt_tokens = usage.get('prompt_tokens') or 0
+        completion_tokens = usage.get('completion_tokens') or 0
+        record = {
+            '_id': ObjectId(),
+            'ts': now,
+            'bucket': period_start(now, PERIOD_HOUR),
+            'user_id': user_id,
+            'route': route,
+            'model': model,
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'cache_hit_tokens': usage.get('prompt_cache_hit_tokens') or 0,
+            'cache_miss_tokens': usage.get('prompt_cache_miss_tokens') or 0,
+            'latency_ms': round(latency_ms, 1),
+            'stream': stream,
+            'max_tokens': max_tokens,
+            'finish_reason': finish_reason,
+            'error': str(error)[:200] if error else None,
+            'expires_at': now + self.retention,
+        }
+        increments = {
+            'calls': 1,
+            'errors': 1 if error else 0,
+            'streamed': 1 if stream else 0,
+            'truncated': 1 if finish_reason == 'length' else 0,
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'cache_hit_tokens': record['cache_hit_tokens'],
+            'cache_miss_tokens': record['cache_miss_tokens'],
+            'latency_ms_total': record['latency_ms'],
+            'latency_ms_max': record['latency_ms'],
+            'completion_tokens_max': completion_tokens,
+        }
+
+        with self._lock:
+            self._stats['recorded'] += 1
+            self._records.append(record)
+            if len(self._records) > self.max_buffer:
+                overflow = len(self._records) - self.max_buffer
+                del self._records[:overflow]
+                self._stats['dropped'] += overflow
+            for period in PERIODS:
+                start = period_start(now, period)
+                key = rollup_id(period, start, user_id, route)
+                pending = self._rollups.get(key)
+                if pending is None:
+                    pending = self._rollups[key] = {
+                        'period': period, 'start': start, 'user_id': user_id, 'route': route,
+                        **{f: 0 for f in _SUM_FIELDS + _MAX_FIELDS},
+                    }
+                self._merge(pending, increments)
+            full = len(self._records) >= self.flush_size
+
+        self.start()
+        if full:
+            self._wake.set()
+
+    @staticmethod
+    def _merge(target, increments):
+        for field in _SUM_FIELDS:
+            target[field] += increments[field]
+        for field in _MAX_FIELDS:
+            target[field] = max(target[field], increments[field])
+
+    # --- 刷新 ---
+
+    def start(self):
+        """启动后台刷新线程 (重复调用无副作用)，进程退出时刷新剩余记录"""
+        if self._thread is not None or self.mongo is None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='ai-usage-meter', daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.warning(f"刷新AI调用计量失败: {e}")
+
+    def flush(self):
+        """把缓冲的明细批量插入、汇总批量累加到MongoDB；返回写入的明细条数"""
+        if self.mongo is None:
+            return 0
+        with self._flush_lock:
+            with self._lock:
+                records, self._records = self._records, []
+                rollups, self._rollups = self._rollups, {}
+            if not records and not rollups:
+                return 0
+
+            written = self._insert_records(records)
+            self._write_rollups(rollups)
+            with self._lock:
+                self._stats['flushes'] += 1
+                self._stats['flushed'] += written
+            return written
+
+    def _insert_records(self, records):
+        if not records:
+            return 0
+        try:
+            self.mongo.db[self.COLLECTION].insert_many(records, ordered=False)
+            return len(records)
+        except BulkWriteError as e:
+            # 明细带有预先生成的 _id，重试时已写入的记录只会报重复键错误
+            details = e.details or {}
+            return details.get('nInserted', 0)
+        except Exception as e:
+            logger.warning(f"写入AI调用明细失败，下次刷新时重试: {e}")
+            with self._lock:
+                self._stats['flush_failures'] += 1
+                self._records[:0] = records
+                overflow = len(self._records) - self.max_buffer
+                if overflow > 0:
+                    del self._records[:overflow]
+                    self._stats['dropped'] += overflow
+            return 0
+
+    def _write_rollups(self, rollups):
+        if not rollups:
+            return
+        operations = [
+            UpdateOne(
+                {'_id': key},
+                {
+                    '$inc': {f: pending[f] for f in _SUM_FIELDS},
+                    '$max': {f: pending[f] for f in _MAX_FIELDS},
+                    '$setOnInsert': {k: pending[k] for k in ('period', 'start', 'user_id', 'route')},
+                },
+                upsert=True,
+            )
+            for key, pending in rollups.items()
+        ]
+        try:
+            self.mongo.db[self.ROLLUP_COLLECTION].bulk_write(operations, ordered=False)
+        except BulkWriteError as e:
+            # 汇总的 $inc 不是幂等的，部分写入后不再重试，以免重复累加
+            logger.warning(f"部分AI调用汇总写入失败: {e.details.get('writeErrors', [])[:1] if e.details else e}")
+            with self._lock:
+                self._stats['flush_failures'] += 1
+        except Exception as e:
+            logger.warning(f"写入AI调用汇总失败，下次刷新时重试: {e}")
+            with self._lock:
+                self._stats['flush_failures'] += 1
+                for key, pending in rollups.items():
+                    current = self._rollups.get(key)
+                    if current is None:
+                        self._rollups[key] = pending
+                    else:
+                        self._merge(current, pending)
+
+    # --- 查询 ---
+
+    def rollups(self, period=PERIOD_HOUR, since=None, until=None, user_id=None, route=None, limit=200):
+        """按时间倒序返回汇总 (会先刷新本进程缓冲的记录)"""
+        self.flush()
+        query = self._rollup_query(period, since, until, user_id, route)
+        cursor = self.mongo.db[self.ROLLUP_COLLECTION].find(query).sort('start', -1).limit(limit)
+        return [finish_rollup(doc) for doc in cursor]
+
+    def grouped(self, by, period=PERIOD_HOUR, since=None, until=None, user_id=None, route=None, limit=200):
+        """把时间范围内的全部汇总按用户或路由合并 (在数据库中 $group)，按总token数从高到低返回前 limit 项
+
+        合并覆盖整个时间范围，limit 只作用于合并后的结果，用于配额统计时不会因截断而偏低。
+        """
+        self.flush()
+        field = 'user_id' if by == 'user' else 'route'
+        accumulators = {f: {'$sum': f'${f}'} for f in _SUM_FIELDS}
+        accumulators.update({f: {'$max': f'${f}'} for f in _MAX_FIELDS})
+        pipeline = [
+            {'$match': self._rollup_query(period, since, until, user_id, route)},
+            {'$group': {'_id': f'${field}', **accumulators}},
+            {'$addFields': {'total_tokens': {'$add': ['$prompt_tokens', '$completion_tokens']}}},
+            {'$sort': {'total_tokens': -1, '_id': 1}},
+            {'$limit': limit},
+        ]
+        return [
+            finish_rollup(dict(doc, **{field: doc['_id']}))
+            for doc in self.mongo.db[self.ROLLUP_COLLECTION].aggregate(pipeline)
+        ]
+
+    @staticmethod
+    def _rollup_query(period, since=None, until=None, user_id=None, route=None):
+        query = {'period': period}
+        if since or until:
+            query['start'] = {}
+            if since:
+                query['start']['$gte'] = period_start(since, period)
+            if until:
+                query['start']['$lt'] = until
+        if user_id:
+            query['user_id'] = user_id
+        if route:
+            query['route'] = route
+        return query
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, buffered=len(self._records), pending_rollups=len(self._rollups))
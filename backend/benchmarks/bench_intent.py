@@ -0,0 +1,142 @@
+"""意图提取微基准
+
+对比原先的线性扫描实现与地名词典 (Aho-Corasick) 实现的耗时和准确率。
+在 backend 目录下运行:  python benchmarks/bench_intent.py [--rounds 2000]
+"""
+import argparse
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.gazetteer import Gazetteer  # noqa: E402
+
+# (提示词, 期望目的地, 期望天数, 期望包含的标签)
+SAMPLES = [
+    ("帮我规划一个北京4天的文化之旅", "北京", 4, ["文化"]),
+    ("我想去成都玩3天，主要想吃小吃", "成都", 3, ["美食"]),
+    ("从上海出发去杭州西湖玩两天", "杭州", 2, []),
+    ("五一想带娃去三亚看海，5天4晚", "三亚", 5, ["亲子", "海滩"]),
+    ("周末去苏州逛逛园林", "苏州", 2, []),
+    ("想去云南大理住一周，慢节奏度假", "大理", 7, ["休闲"]),
+    ("日本东京自由行6天，想多拍照", "东京", 6, ["摄影"]),
+    ("去故宫和颐和园一日游", "北京", 1, []),
+    ("九寨沟黄龙4日游", "九寨沟", 4, []),
+    ("计划去张家界徒步三天", "张家界", 3, ["户外"]),
+    ("想去阳朔骑行，大概3天2晚", "阳朔", 3, ["户外"]),
+    ("5月1日出发去西安看兵马俑，玩四天", "西安", 4, []),
+    ("去新疆喀纳斯自驾十天", "喀纳斯", 10, ["户外"]),
+    ("带爸妈去厦门鼓浪屿两天", "厦门", 2, []),
+    ("去哈尔滨看冰雪大世界", "哈尔滨", None, []),
+    ("想在南京路附近逛街购物", "上海", None, ["购物"]),
+    ("去凤凰古城三天，拍照打卡", "凤凰古城", 3, ["摄影", "古迹"]),
+    ("重庆洪崖洞和解放碑两日游", "重庆", 2, []),
+    ("泰国清迈5天，想体验当地美食", "清迈", 5, ["美食"]),
+    ("青海湖环湖骑行一周", "青海湖", 7, ["户外"]),
+    ("想去拉萨布达拉宫，七天", "拉萨", 7, []),
+    ("贵州黄果树瀑布加西江千户苗寨四天", "黄果树瀑布", 4, []),
+    ("桂林漓江游船两天一夜", "桂林", 2, []),
+    ("去敦煌莫高窟看壁画，三天", "敦煌", 3, ["艺术"]),
+    ("乌镇西塘古镇两日", "乌镇", 2, ["古迹"]),
+]
+
+
+def legacy_extract(prompt):
+    """原先的实现 (每次调用都执行 import re 与线性扫描)"""
+    common_cities = ["北京", "上海", "广州", "深圳", "成都", "重庆", "西安", "杭州", "南京",
+                     "武汉", "长沙", "厦门", "青岛", "大连", "三亚", "丽江", "桂林", "昆明",
+                     "兰州", "西宁", "拉萨", "呼和浩特", "乌鲁木齐"]
+    destination = None
+    for city in common_cities:
+        if city in prompt:
+            destination = city
+            break
+    if destination is None:
+        for pattern in [r'去([\u4e00-\u9fa5]{2,4})旅游', r'去([\u4e00-\u9fa5]{2,4})玩',
+                        r'([\u4e00-\u9fa5]{2,4})之旅', r'([\u4e00-\u9fa5]{2,4})游玩',
+                        r'([\u4e00-\u9fa5]{2,4})旅行']:
+            match = re.search(pattern, prompt)
+            if match:
+                destination = match.group(1)
+                break
+    destination = destination or "北京"
+
+    match = re.search(r'(\d+)\s*[天日]', prompt)
+    days = int(match.group(1)) if match else None
+    if days is not None and not 1 <= days <= 30:
+        days = None
+
+    common_tags = ["文化", "美食", "购物", "亲子", "自然", "历史", "古迹", "艺术", "休闲",
+                   "冒险", "户外", "摄影", "温泉", "海滩", "山川", "乡村", "城市"]
+    tags = [tag for tag in common_tags if tag in prompt]
+    return destination, days, tags
+
+
+def gazetteer_extract(gazetteer):
+    def extract(prompt):
+        intent = gazetteer.extract(prompt)
+        return intent['destination'], intent['days'], intent['tags']
+    return extract
+
+
+def naive_extract(gazetteer):
+    """与词典规模相同的逐词线性扫描，用于对比多模式匹配的收益"""
+    words = []
+    for place in gazetteer.places.values():
+        words.extend([place['name']] + list(place.get('aliases') or []))
+
+    def extract(prompt):
+        hits = [word for word in words if word in prompt]
+        return (hits[0] if hits else None), None, []
+    return extract
+
+
+def accuracy(extract):
+    dest_ok = days_ok = tags_ok = 0
+    for prompt, destination, days, tags in SAMPLES:
+        got_dest, got_days, got_tags = extract(prompt)
+        dest_ok += got_dest == destination
+        days_ok += got_days == days
+        tags_ok += all(tag in got_tags for tag in tags)
+    total = len(SAMPLES)
+    return dest_ok / total, days_ok / total, tags_ok / total
+
+
+def timing(extract, rounds):
+    prompts = [sample[0] for sample in SAMPLES]
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for prompt in prompts:
+            extract(prompt)
+    elapsed = time.perf_counter() - start
+    return elapsed / (rounds * len(prompts)) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description='意图提取微基准')
+    parser.add_argument('--rounds', type=int, default=2000)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    gazetteer = Gazetteer.load()
+    load_ms = (time.perf_counter() - start) * 1000
+    print(f"词典: {len(gazetteer.places)} 个地点, 加载+编译 {load_ms:.1f} ms")
+
+    for name, extract in (('legacy', legacy_extract), ('gazetteer', gazetteer_extract(gazetteer))):
+        dest_acc, days_acc, tags_acc = accuracy(extract)
+        per_call = timing(extract, args.rounds)
+        print(f"{name:<10} {per_call:8.2f} us/次   目的地 {dest_acc:6.1%}   天数 {days_acc:6.1%}   标签 {tags_acc:6.1%}")
+    # 只比较速度: 同样规模的词典用 `in` 逐个扫描
+    per_call = timing(naive_extract(gazetteer), max(1, args.rounds // 20))
+    print(f"{'naive-scan':<10} {per_call:8.2f} us/次   (同规模词典逐词扫描，仅供对比耗时)")
+
+    for prompt, destination, days, tags in SAMPLES:
+        got = gazetteer_extract(gazetteer)(prompt)
+        if got[0] != destination or got[1] != days or not all(tag in got[2] for tag in tags):
+            print(f"  未命中: {prompt} -> {got}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""模型输出JSON提取基准
+
+样本按 DeepSeek 行程生成接口的真实输出形态构造: 纯JSON、带说明文字的代码块、
+多个JSON块、被 max_tokens 截断的输出、字符串中含花括号的输出以及大体积输出。
+对比原先的正则级联实现与单次扫描实现的耗时和结果。
+在 backend 目录下运行:  python benchmarks/bench_json_extract.py [--rounds 50]
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.json_extract import extract_json  # noqa: E402
+
+
+def make_plan(days, activities_per_day=4):
+    return {
+        "name": f"成都{days}天美食文化之旅",
+        "destination": "成都",
+        "tags": ["美食", "文化"],
+        "days": [
+            {
+                "dayNumber": d + 1,
+                "date": f"2025-06-{(d % 28) + 1:02d}",
+                "title": f"第{d + 1}天：宽窄巷子与锦里",
+                "activities": [
+                    {
+                        "id": f"act_{d + 1}_{a + 1}",
+                        "time": f"{9 + a * 3:02d}:00",
+                        "title": "宽窄巷子",
+                        "description": "漫步清代古街，品尝钟水饺、龙抄手，感受老成都的\"慢生活\"。",
+                        "location": "成都市青羊区宽窄巷子",
+                    }
+                    for a in range(activities_per_day)
+                ],
+                "notes": "建议穿舒适的鞋子",
+            }
+            for d in range(days)
+        ],
+    }
+
+
+def build_samples():
+    plan = make_plan(4)
+    plan_json = json.dumps(plan, ensure_ascii=False, indent=2)
+    big_json = json.dumps(make_plan(30, 40), ensure_ascii=False, indent=2)
+    braces_plan = make_plan(2)
+    braces_plan["days"][0]["notes"] = "模板写法为 {name}，不要与 } 混淆 {"
+    braces_json = json.dumps(braces_plan, ensure_ascii=False)
+
+    return [
+        ("纯JSON", plan_json),
+        ("代码块+说明", f"好的，以下是为您规划的行程：\n\n```json\n{plan_json}\n```\n\n祝您旅途愉快！如需调整请告诉我。"),
+        ("多个JSON块",
+         "返回格式示例: {\"name\": \"...\"}，实际行程如下：\n"
+         f"{plan_json}\n另外附上预算估计 {{\"budget\": 3000, \"currency\": \"CNY\"}} 供参考。"),
+        ("截断输出", "```json\n" + plan_json[:int(len(plan_json) * 0.7)]),
+        ("字符串含花括号", f"行程如下：{braces_json} 以上。"),
+        ("大体积(约1MB)", f"以下是详细行程：\n```json\n{big_json}\n```\n以上为完整行程。"),
+        ("大体积多块", f"示例 {{\"a\": 1}}\n{big_json}\n备注 {{\"b\": 2}} 结束"),
+    ]
+
+
+def legacy_extract(content):
+    """原先的实现: 整体解析 -> 代码块正则 -> 贪婪花括号正则"""
+    try:
+        return json.loads(content)
+    except Exception:
+        pass
+    matches = re.findall(r'```(?:json)?\s*([\s\S]*?)\s*```', content)
+    for match in matches:
+        try:
+            return json.loads(match)
+        except Exception:
+            continue
+    matches = re.findall(r'(\{[\s\S]*\})', content)
+    for match in matches:
+        try:
+            return json.loads(match)
+        except Exception:
+            continue
+    return None
+
+
+def describe(value):
+    if not isinstance(value, dict):
+        return "失败"
+    days = value.get("days")
+    return f"{len(days)}天" if isinstance(days, list) else f"键={list(value)[:3]}"
+
+
+def timing(fn, content, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        fn(content)
+    return (time.perf_counter() - start) / rounds * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description='模型输出JSON提取基准')
+    parser.add_argument('--rounds', type=int, default=50)
+    args = parser.parse_args()
+
+    print(f"{'样本':<14}{'大小':>10}  {'legacy':>22}  {'scan':>30}")
+    for name, content in build_samples():
+        legacy_ms = timing(legacy_extract, content, args.rounds)
+        scan_ms = timing(lambda c: extract_json(c, expected_keys=('days',)), content, args.rounds)
+        legacy_result = describe(legacy_extract(content))
+        value, strategy = extract_json(content, expected_keys=('days',))
+        print(f"{name:<14}{len(content):>10}  {legacy_ms:8.3f}ms {legacy_result:<12}"
+              f"  {scan_ms:8.3f}ms {describe(value):<10} {strategy or '-'}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,253 @@
+"""AI接口压测
+
+按配置的比例并发回放聊天、行程生成、行程修改 (含流式) 场景，统计吞吐量、状态码、
+兜底响应比例和 p50/p95/p99 延迟，用于在发布前离线评估worker饱和点和降级行为。
+通常配合 benchmarks/mock_deepseek.py 使用 (见该文件的说明)。
+
+在 backend 目录下运行:
+    python benchmarks/load_ai.py --base-url http://127.0.0.1:5000/api --concurrency 16 --duration 60 \\
+        --mix chat=4,generate=3,modify=2,stream-chat=1
+
+--unique 使每个请求的提示词不同并跳过行程缓存，测量上游调用路径本身；
+不加时重复的提示词会命中缓存和请求合并。--token 以登录用户身份(高优先级)发送请求。
+"""
+import argparse
+import json
+import math
+import random
+import threading
+import time
+from collections import Counter
+
+import requests
+
+DESTINATIONS = ["北京", "上海", "成都", "杭州", "西安", "三亚", "厦门", "重庆", "桂林", "丽江"]
+THEMES = ["美食", "文化", "亲子", "休闲", "摄影", "户外"]
+CHAT_MESSAGES = ["有什么美食推荐？", "当地交通方便吗？", "推荐几家性价比高的酒店", "几月份去比较合适？"]
+MODIFY_PROMPTS = ["第2天下午改成购物", "把最后一天的行程安排得轻松一些", "第1天晚上加一个夜市"]
+
+# 后端的兜底响应特征
+DEFAULT_TRIP_NOTE = '系统生成的基础行程'
+CHAT_FALLBACK_PREFIX = '抱歉'
+
+
+def sample_plan(destination, days=3):
+    return {
+        "name": f"{destination}{days}天之旅",
+        "destination": destination,
+        "tags": ["文化"],
+        "days": [
+            {
+                "dayNumber": day,
+                "title": f"第{day}天",
+                "activities": [
+                    {"id": f"act{day}_{i}", "title": f"景点{day}-{i}", "location": f"{destination}景点{day}-{i}",
+                     "startTime": f"{9 + i * 3:02d}:00", "endTime": f"{11 + i * 3:02d}:00", "estimatedCost": 50}
+                    for i in range(1, 4)
+                ],
+            }
+            for day in range(1, days + 1)
+        ],
+    }
+
+
+class Scenario:
+    """一个压测场景: 构造请求并判断响应属于正常、兜底还是错误"""
+
+    def __init__(self, name, path, stream=False):
+        self.name = name
+        self.path = path
+        self.stream = stream
+
+    def build(self, unique):
+        destination = random.choice(DESTINATIONS)
+        suffix = f" #{random.getrandbits(32):08x}" if unique else ''
+        if self.name in ('chat', 'stream-chat'):
+            body = {"message": f"我想去{destination}，{random.choice(CHAT_MESSAGES)}{suffix}"}
+        elif self.name in ('generate', 'stream-generate'):
+            body = {"prompt": f"帮我规划{destination}{random.randint(2, 5)}天{random.choice(THEMES)}之旅{suffix}"}
+            if unique:
+                body["use_cache"] = False
+        else:
+            body = {"prompt": random.choice(MODIFY_PROMPTS) + suffix, "currentPlan": sample_plan(destination)}
+            if self.name == 'patch':
+                body["mode"] = "patch"
+        if self.stream:
+            body["stream"] = True
+        return body
+
+    def classify(self, status, text):
+        if status == 503:
+            return 'rejected'
+        if self.stream:
+            if status != 200 or 'event: error' in text:
+                return 'error'
+            if 'event: done' not in text:
+                return 'incomplete'
+            return 'fallback' if DEFAULT_TRIP_NOTE in text else 'ok'
+        if status == 400 and self.name in ('modify', 'patch'):
+            return 'fallback'
+        if status != 200:
+            return 'error'
+        try:
+            body = json.loads(text)
+        except ValueError:
+            return 'error'
+        if self.name == 'chat':
+            return 'fallback' if str(body.get('content', '')).startswith(CHAT_FALLBACK_PREFIX) else 'ok'
+        if self.name == 'generate':
+            return 'fallback' if DEFAULT_TRIP_NOTE in str(body.get('note', '')) else 'ok'
+        return 'ok'
+
+
+SCENARIOS = {
+    'chat': Scenario('chat', '/ai/chat'),
+    'stream-chat': Scenario('stream-chat', '/ai/chat', stream=True),
+    'generate': Scenario('generate', '/ai/generate-trip'),
+    'stream-generate': Scenario('stream-generate', '/ai/generate-trip', stream=True),
+    'modify': Scenario('modify', '/ai/modify-trip'),
+    'patch': Scenario('patch', '/ai/modify-trip'),
+}
+
+
+class Results:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {}   # 场景 -> [总耗时(秒)]
+        self.first_byte = {}  # 流式场景 -> [首个事件耗时(秒)]
+        self.outcomes = {}    # 场景 -> Counter
+        self.statuses = {}    # 场景 -> Counter
+
+    def record(self, name, status, outcome, elapsed, first_byte=None):
+        with self.lock:
+            self.latencies.setdefault(name, []).append(elapsed)
+            self.outcomes.setdefault(name, Counter())[outcome] += 1
+            self.statuses.setdefault(name, Counter())[status] += 1
+            if first_byte is not None:
+                self.first_byte.setdefault(name, []).append(first_byte)
+
+
+def percentile(sorted_values, pct):
+    """最近秩法计算百分位数"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def run_request(session, args, scenario, results):
+    body = scenario.build(args.unique)
+    headers = {'Authorization': f"Bearer {args.token}"} if args.token else {}
+    started = time.perf_counter()
+    first_byte = None
+    try:
+        with session.post(args.base_url + scenario.path, json=body, headers=headers,
+                          timeout=args.timeout, stream=scenario.stream) as response:
+            if scenario.stream:
+                parts = []
+                for chunk in response.iter_content(chunk_size=None):
+                    if first_byte is None:
+                        first_byte = time.perf_counter() - started
+                    parts.append(chunk)
+                text = b''.join(parts).decode('utf-8', errors='replace')
+            else:
+                text = response.text
+            status = response.status_code
+        outcome = scenario.classify(status, text)
+    except requests.Timeout:
+        status, outcome = 'timeout', 'timeout'
+    except requests.RequestException:
+        status, outcome = 'conn_error', 'error'
+    results.record(scenario.name, status, outcome, time.perf_counter() - started, first_byte)
+
+
+def parse_mix(text):
+    weights = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in SCENARIOS:
+            raise SystemExit(f"未知场景: {name} (可选: {', '.join(SCENARIOS)})")
+        weights[name] = float(weight or 1)
+    return weights
+
+
+def worker(args, weights, results, deadline, remaining, remaining_lock):
+    session = requests.Session()
+    names = list(weights)
+    weight_values = [weights[n] for n in names]
+    while time.monotonic() < deadline:
+        if remaining is not None:
+            with remaining_lock:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+        scenario = SCENARIOS[random.choices(names, weights=weight_values)[0]]
+        run_request(session, args, scenario, results)
+
+
+def report(results, elapsed):
+    total = sum(len(v) for v in results.latencies.values())
+    print(f"\n共 {total} 个请求，耗时 {elapsed:.1f}s，吞吐量 {total / elapsed:.2f} req/s\n")
+    header = f"{'场景':<16}{'请求数':>8}{'req/s':>8}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}  结果 / 状态码"
+    print(header)
+    for name in sorted(results.latencies):
+        values = sorted(results.latencies[name])
+        row = (f"{name:<16}{len(values):>8}{len(values) / elapsed:>8.2f}"
+               + ''.join(f"{percentile(values, p) * 1000:>8.0f}ms" for p in (50, 95, 99))
+               + f"{values[-1] * 1000:>7.0f}ms  "
+               + ' '.join(f"{k}={v}" for k, v in results.outcomes[name].most_common())
+               + ' / ' + ' '.join(f"{k}={v}" for k, v in results.statuses[name].most_common()))
+        print(row)
+        if name in results.first_byte:
+            fb = sorted(results.first_byte[name])
+            print(f"{'  首个事件':<16}{len(fb):>8}{'':>8}"
+                  + ''.join(f"{percentile(fb, p) * 1000:>8.0f}ms" for p in (50, 95, 99)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='AI接口压测')
+    parser.add_argument('--base-url', default='http://127.0.0.1:5000/api')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=30, help='压测时长(秒)')
+    parser.add_argument('--requests', type=int, default=None, help='总请求数 (达到后提前结束)')
+    parser.add_argument('--mix', default='chat=4,generate=3,modify=2,stream-chat=1', help='场景及权重')
+    parser.add_argument('--unique', action='store_true', help='提示词互不相同并跳过行程缓存')
+    parser.add_argument('--token', default='', help='JWT access token，以登录用户身份发送请求')
+    parser.add_argument('--timeout', type=float, default=120)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--show-stats', action='store_true', help='结束后输出 /ai/stats')
+    args = parser.parse_args()
+    args.base_url = args.base_url.rstrip('/')
+
+    if args.seed is not None:
+        random.seed(args.seed)
+    weights = parse_mix(args.mix)
+    results = Results()
+    remaining = [args.requests] if args.requests else None
+    remaining_lock = threading.Lock()
+
+    print(f"压测 {args.base_url}: 并发 {args.concurrency}，时长 {args.duration}s，场景 {args.mix}")
+    started = time.monotonic()
+    threads = [
+        threading.Thread(target=worker, args=(args, weights, results, started + args.duration,
+                                              remaining, remaining_lock), daemon=True)
+        for _ in range(args.concurrency)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    report(results, time.monotonic() - started)
+
+    if args.show_stats:
+        try:
+            stats = requests.get(args.base_url + '/ai/stats', timeout=10).json()
+            print("\n/ai/stats:")
+            print(json.dumps(stats, ensure_ascii=False, indent=2))
+        except (requests.RequestException, ValueError) as e:
+            print(f"\n获取 /ai/stats 失败: {e}")
+
+
+if __name__ == '__main__':
+    main()
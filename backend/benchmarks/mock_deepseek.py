@@ -0,0 +1,328 @@
+"""本地 DeepSeek 模拟服务
+
+提供 OpenAI 兼容的 POST /v1/chat/completions (含流式)，用于在不调用真实 DeepSeek 的情况下
+对 AI 接口做压测和故障演练。根据请求内容返回聊天文本、行程JSON、修改后的行程、补丁或会话摘要，
+可配置延迟分布、429/5xx 注入、挂起(超时)以及截断/格式错误的行程JSON。
+GET /stats 返回模拟服务收到的请求数和注入的故障数。
+
+在 backend 目录下运行:
+    python benchmarks/mock_deepseek.py --port 8900 --latency lognormal:1500,0.4 --rate-429 0.05
+
+然后让后端指向模拟服务:
+    DEEPSEEK_API_URL=http://127.0.0.1:8900/v1/chat/completions \\
+    BACKUP_API_URL=http://127.0.0.1:8900/v1/chat/completions python run.py
+
+延迟分布写法: fixed:800 (毫秒)、uniform:200-1500、lognormal:中位数,sigma (如 lognormal:1500,0.4)
+"""
+import argparse
+import json
+import math
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DESTINATIONS = ["北京", "上海", "成都", "杭州", "西安", "三亚", "厦门", "重庆"]
+
+_DESTINATION_RE = re.compile(r'目的地必须是"([^"]+)"')
+_DAYS_RE = re.compile(r'(\d+)天行程规划')
+_CURRENT_PLAN_MARK = '当前行程：'
+
+
+class LatencyModel:
+    """按配置的分布采样延迟(秒)"""
+
+    def __init__(self, spec):
+        kind, _, params = spec.partition(':')
+        self.kind = kind
+        if kind == 'fixed':
+            self.params = (float(params or 0),)
+        elif kind == 'uniform':
+            low, _, high = params.partition('-')
+            self.params = (float(low), float(high or low))
+        elif kind == 'lognormal':
+            median, _, sigma = params.partition(',')
+            self.params = (float(median), float(sigma or 0.5))
+        else:
+            raise ValueError(f"未知的延迟分布: {spec}")
+
+    def sample(self):
+        if self.kind == 'fixed':
+            ms = self.params[0]
+        elif self.kind == 'uniform':
+            ms = random.uniform(*self.params)
+        else:
+            median, sigma = self.params
+            ms = random.lognormvariate(math.log(max(median, 1)), sigma)
+        return max(0.0, ms) / 1000
+
+
+def build_activity(day, index, destination):
+    start = 9 + index * 3
+    return {
+        "id": f"act{day}_{index + 1}",
+        "title": f"{destination}景点{day}-{index + 1}",
+        "description": f"游览{destination}的第{index + 1}个景点，感受当地文化。",
+        "location": f"{destination}景点{day}-{index + 1}",
+        "address": f"{destination}市中心路{day * 10 + index}号",
+        "startTime": f"{start:02d}:00",
+        "endTime": f"{start + 2:02d}:00",
+        "transportation": "地铁",
+        "durationMinutes": 120,
+        "type": "景点",
+        "estimatedCost": 50 * (index + 1),
+        "bookingInfo": "无需预约",
+        "note": "",
+        "icon": "景点",
+    }
+
+
+def build_day(day, destination):
+    return {
+        "dayNumber": day,
+        "title": f"第{day}天：{destination}探索",
+        "description": f"{destination}第{day}天的行程",
+        "date": f"2025-05-{day:02d}",
+        "activities": [build_activity(day, i, destination) for i in range(3)],
+        "notes": "注意防晒",
+    }
+
+
+def build_plan(destination, days):
+    return {
+        "name": f"{destination}{days}天之旅",
+        "destination": destination,
+        "tags": ["文化", "美食"],
+        "description": f"{destination}{days}天的模拟行程",
+        "days": [build_day(day, destination) for day in range(1, days + 1)],
+    }
+
+
+def estimate_tokens(text):
+    return max(1, len(text) // 2)
+
+
+# 模拟上游的上下文缓存: 按固定长度的块比较请求前缀，块的前缀出现过即计为命中
+_CACHE_BLOCK_CHARS = 128
+
+
+class MockState:
+    """模拟服务的配置和计数"""
+
+    def __init__(self, args):
+        self.args = args
+        self.latency = LatencyModel(args.latency)
+        self.lock = threading.Lock()
+        self.counts = {}
+        self.prefixes = set()
+
+    def incr(self, name):
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + 1
+
+    def prompt_cache(self, messages):
+        """返回 (命中token数, 未命中token数)，并记住本次请求的所有前缀块"""
+        text = ''.join(f"{m.get('role', '')}:{m.get('content', '')}\n" for m in messages)
+        total = estimate_tokens(text)
+        hit_chars = 0
+        with self.lock:
+            for end in range(_CACHE_BLOCK_CHARS, len(text) + 1, _CACHE_BLOCK_CHARS):
+                key = hash(text[:end])
+                if key in self.prefixes and hit_chars == end - _CACHE_BLOCK_CHARS:
+                    hit_chars = end
+                self.prefixes.add(key)
+        hit = min(total, hit_chars // 2)
+        return hit, total - hit
+
+    def roll(self, rate):
+        return rate > 0 and random.random() < rate
+
+    def reply_for(self, messages):
+        """返回 (请求类型, 回复文本)"""
+        system = messages[0].get('content', '') if messages else ''
+        user = messages[-1].get('content', '') if messages else ''
+
+        if '"operations"' in user:
+            day = build_day(1, "模拟")
+            return 'patch', self.wrap_json({"operations": [{"op": "replace_day", "dayNumber": 1, "day": day}]})
+        if _CURRENT_PLAN_MARK in user:
+            plan = self.parse_current_plan(user) or build_plan(random.choice(DESTINATIONS), 3)
+            plan["name"] = f"{plan.get('name', '')}(已修改)"
+            return 'modify', self.wrap_json(plan)
+        if '行程规划' in user and 'JSON' in user:
+            match = _DESTINATION_RE.search(user)
+            destination = match.group(1) if match else random.choice(DESTINATIONS)
+            match = _DAYS_RE.search(user)
+            days = min(int(match.group(1)), 30) if match else 3
+            return 'generate', self.wrap_json(build_plan(destination, days))
+        if '压缩' in system and '摘要' in system:
+            return 'summary', "用户计划出行，关注美食和文化景点，预算适中。"
+        return 'chat', ("您好！我是途乐乐。" + "推荐您先确定出行日期和预算，再根据兴趣选择景点和美食。" * 4)
+
+    @staticmethod
+    def parse_current_plan(text):
+        start = text.find('{', text.find(_CURRENT_PLAN_MARK))
+        if start < 0:
+            return None
+        try:
+            value, _ = json.JSONDecoder().raw_decode(text, start)
+        except ValueError:
+            return None
+        return value if isinstance(value, dict) else None
+
+    def wrap_json(self, value):
+        """按配置的比例返回截断或格式错误的JSON，其余用代码块包裹返回"""
+        text = json.dumps(value, ensure_ascii=False, indent=2)
+        if self.roll(self.args.truncated_rate):
+            self.incr('truncated')
+            return "```json\n" + text[:int(len(text) * random.uniform(0.5, 0.9))]
+        if self.roll(self.args.malformed_rate):
+            self.incr('malformed')
+            # 去掉一个逗号并留下尾随逗号，模拟模型常见的语法错误
+            text = text.replace(',', '', 1).replace('\n  ]', ',\n  ]', 1)
+        return f"好的，以下是为您生成的结果：\n```json\n{text}\n```\n祝您旅途愉快！"
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    server_version = 'MockDeepSeek/1.0'
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        if self.server.state.args.verbose:
+            super().log_message(format, *args)
+
+    def do_GET(self):
+        if self.path.rstrip('/') == '/stats':
+            with self.server.state.lock:
+                self.send_json(200, dict(self.server.state.counts))
+        else:
+            self.send_json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        state = self.server.state
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            payload = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            self.send_json(400, {"error": {"message": "invalid json"}})
+            return
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self.send_json(404, {"error": {"message": "not found"}})
+            return
+        if state.args.require_key and self.headers.get('Authorization') != f"Bearer {state.args.require_key}":
+            state.incr('401')
+            self.send_json(401, {"error": {"message": "invalid api key"}})
+            return
+
+        state.incr('requests')
+        if state.roll(state.args.rate_429):
+            state.incr('429')
+            self.send_json(429, {"error": {"message": "rate limit exceeded"}}, {'Retry-After': '1'})
+            return
+        if state.roll(state.args.rate_5xx):
+            status = random.choice((500, 502, 503))
+            state.incr(str(status))
+            self.send_json(status, {"error": {"message": "upstream error"}})
+            return
+        if state.roll(state.args.hang_rate):
+            state.incr('hang')
+            time.sleep(state.args.hang_seconds)
+
+        messages = payload.get('messages') or []
+        kind, content = state.reply_for(messages)
+        state.incr(kind)
+        cache_hit, cache_miss = state.prompt_cache(messages)
+        usage = {
+            "prompt_tokens": cache_hit + cache_miss,
+            "completion_tokens": estimate_tokens(content),
+            "prompt_cache_hit_tokens": cache_hit,
+            "prompt_cache_miss_tokens": cache_miss,
+        }
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        model = payload.get('model') or 'deepseek-chat'
+
+        time.sleep(state.latency.sample())
+        if payload.get('stream'):
+            include_usage = (payload.get('stream_options') or {}).get('include_usage')
+            self.send_stream(model, content, usage if include_usage else None)
+        else:
+            self.send_json(200, {
+                "id": f"mock-{random.getrandbits(48):x}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content},
+                             "finish_reason": "stop"}],
+                "usage": usage,
+            })
+
+    def send_json(self, status, body, headers=None):
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_stream(self, model, content, usage):
+        args = self.server.state.args
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        try:
+            for i in range(0, len(content), args.chunk_chars):
+                chunk = {"model": model, "choices": [{"index": 0, "delta": {"content": content[i:i + args.chunk_chars]}}]}
+                self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode('utf-8'))
+                self.wfile.flush()
+                if args.chunk_ms:
+                    time.sleep(args.chunk_ms / 1000)
+            if usage:
+                self.wfile.write(f"data: {json.dumps({'choices': [], 'usage': usage})}\n\n".encode('utf-8'))
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            self.server.state.incr('client_disconnects')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地 DeepSeek 模拟服务')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--latency', default='lognormal:1200,0.5', help='首字节延迟分布')
+    parser.add_argument('--chunk-chars', type=int, default=16, help='流式响应每个片段的字符数')
+    parser.add_argument('--chunk-ms', type=float, default=15, help='流式响应片段之间的间隔(毫秒)')
+    parser.add_argument('--rate-429', type=float, default=0.0, help='返回429的比例')
+    parser.add_argument('--rate-5xx', type=float, default=0.0, help='返回500/502/503的比例')
+    parser.add_argument('--hang-rate', type=float, default=0.0, help='挂起不响应的比例(用于测试读超时)')
+    parser.add_argument('--hang-seconds', type=float, default=120)
+    parser.add_argument('--truncated-rate', type=float, default=0.0, help='行程JSON被截断的比例')
+    parser.add_argument('--malformed-rate', type=float, default=0.0, help='行程JSON格式错误的比例')
+    parser.add_argument('--require-key', default='', help='只接受该API密钥 (默认接受任意密钥)')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    server = ThreadingHTTPServer((args.host, args.port), MockHandler)
+    server.daemon_threads = True
+    server.state = MockState(args)
+    print(f"模拟服务已启动: http://{args.host}:{args.port}/v1/chat/completions (延迟 {args.latency})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"请求统计: {json.dumps(server.state.counts, ensure_ascii=False)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,6 @@
+# tests/conftest.py
+import os
+import sys
+
+# 从任意目录运行 pytest 时都能导入 app 包
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
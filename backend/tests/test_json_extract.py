@@ -0,0 +1,90 @@
+# tests/test_json_extract.py
+import json
+
+from app.utils.json_extract import (
+    STRATEGY_DIRECT, STRATEGY_REPAIRED, STRATEGY_SCAN, extract_json,
+)
+
+PLAN = {
+    'name': '杭州两日游',
+    'days': [
+        {'dayNumber': 1, 'activities': [{'title': '西湖', 'location': '西湖'}]},
+        {'dayNumber': 2, 'activities': [{'title': '灵隐寺', 'location': '灵隐寺'}]},
+    ],
+}
+PLAN_TEXT = json.dumps(PLAN, ensure_ascii=False)
+
+
+def test_direct_parse():
+    assert extract_json(PLAN_TEXT, expected_keys=('days',)) == (PLAN, STRATEGY_DIRECT)
+
+
+def test_direct_parse_without_expected_keys_keeps_scanning():
+    content = json.dumps([{'a': 1}, PLAN], ensure_ascii=False)
+    assert extract_json(content, expected_keys=('days',)) == (PLAN, STRATEGY_SCAN)
+
+
+def test_code_block_after_prose():
+    content = f'好的，以下是行程:\n```json\n{PLAN_TEXT}\n```\n祝旅途愉快'
+    assert extract_json(content, expected_keys=('days',)) == (PLAN, STRATEGY_SCAN)
+
+
+def test_example_object_before_plan():
+    content = f'格式示例 {{"title": "示例"}}，实际行程:\n{PLAN_TEXT}'
+    assert extract_json(content, expected_keys=('days',)) == (PLAN, STRATEGY_SCAN)
+
+
+def test_longest_candidate_without_expected_keys():
+    content = f'{{"a": 1}} 然后 {PLAN_TEXT}'
+    assert extract_json(content) == (PLAN, STRATEGY_SCAN)
+
+
+def test_stray_brace_before_code_block():
+    content = '说明 {占位 这里没有闭合\n```json\n{"days":[{"x":1}]}\n```'
+    assert extract_json(content, expected_keys=('days',)) == ({'days': [{'x': 1}]}, STRATEGY_SCAN)
+    assert extract_json(content) == ({'days': [{'x': 1}]}, STRATEGY_SCAN)
+
+
+def test_stray_brace_before_truncated_plan():
+    content = '说明 {占位\n' + PLAN_TEXT[:PLAN_TEXT.index('灵隐寺')]
+    value, strategy = extract_json(content, expected_keys=('days',))
+    assert strategy == STRATEGY_REPAIRED
+    assert value['days'] == PLAN['days'][:1]
+
+
+def test_truncated_output_drops_incomplete_day():
+    # 第二天的 activities 还没开始输出
+    content = PLAN_TEXT[:PLAN_TEXT.index('"activities"', PLAN_TEXT.index('"dayNumber": 2'))]
+    value, strategy = extract_json(content, expected_keys=('days',))
+    assert strategy == STRATEGY_REPAIRED
+    assert value['name'] == PLAN['name']
+    assert value['days'] == PLAN['days'][:1]
+
+
+def test_truncated_output_drops_incomplete_activity():
+    plan = {'days': [{'dayNumber': 1, 'activities': [
+        {'title': '西湖', 'location': '西湖'},
+        {'title': '雷峰塔', 'location': '雷峰塔'},
+    ]}]}
+    text = json.dumps(plan, ensure_ascii=False)
+    content = text[:text.index('"title": "雷峰塔"')]
+    value, strategy = extract_json(content, expected_keys=('days',))
+    assert strategy == STRATEGY_REPAIRED
+    assert value['days'] == [{'dayNumber': 1, 'activities': [{'title': '西湖', 'location': '西湖'}]}]
+
+
+def test_truncated_output_keeps_prior_complete_object_unless_expected():
+    content = '{"a": 1} ' + PLAN_TEXT[:-20]
+    assert extract_json(content) == ({'a': 1}, STRATEGY_SCAN)
+    value, strategy = extract_json(content, expected_keys=('days',))
+    assert strategy == STRATEGY_REPAIRED
+    assert value['days'] == PLAN['days'][:1]
+
+
+def test_repair_disabled_ignores_fragments_of_truncated_output():
+    assert extract_json(PLAN_TEXT[:-20], expected_keys=('days',), allow_repair=False) == (None, None)
+
+
+def test_no_json():
+    assert extract_json('抱歉，我无法生成行程', expected_keys=('days',)) == (None, None)
+    assert extract_json('') == (None, None)
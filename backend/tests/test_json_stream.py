@@ -0,0 +1,70 @@
+# tests/test_json_stream.py
+import json
+
+from app.utils.json_stream import IncrementalDaysParser
+
+DAYS = [
+    {'dayNumber': 1, 'title': '西湖 {漫步}', 'activities': [{'title': '断桥 "残雪"'}]},
+    {'dayNumber': 2, 'title': '灵隐寺', 'activities': [{'title': '飞来峰'}]},
+]
+PLAN_TEXT = json.dumps({'name': '杭州两日游', 'days': DAYS}, ensure_ascii=False)
+
+
+def feed_in_chunks(parser, text, size):
+    completed = []
+    for start in range(0, len(text), size):
+        completed.extend(parser.feed(text[start:start + size]))
+    return completed
+
+
+def test_emits_each_day_as_it_completes():
+    parser = IncrementalDaysParser()
+    first_day_end = PLAN_TEXT.index('"dayNumber": 2')
+    assert parser.feed(PLAN_TEXT[:first_day_end]) == DAYS[:1]
+    assert parser.feed(PLAN_TEXT[first_day_end:]) == DAYS[1:]
+    assert parser.emitted == 2
+    assert parser.text == PLAN_TEXT
+
+
+def test_chunk_boundaries_do_not_matter():
+    for size in (1, 3, 7, 64):
+        assert feed_in_chunks(IncrementalDaysParser(), PLAN_TEXT, size) == DAYS
+
+
+def test_prose_and_code_fence_around_plan():
+    text = f'好的，这是您的行程 (共{{2}}天):\n```json\n{PLAN_TEXT}\n```\n祝旅途愉快'
+    assert feed_in_chunks(IncrementalDaysParser(), text, 5) == DAYS
+
+
+def test_example_object_before_plan_is_skipped():
+    example = json.dumps({'format': '示例', 'activities': [{'title': '示例活动'}]}, ensure_ascii=False)
+    text = f'输出格式如 {example}，实际行程如下:\n{PLAN_TEXT}'
+    assert feed_in_chunks(IncrementalDaysParser(), text, 4) == DAYS
+
+
+def test_nested_days_key_is_not_the_plan():
+    text = json.dumps({'meta': {'days': [{'dayNumber': 9}]}, 'days': DAYS}, ensure_ascii=False)
+    assert feed_in_chunks(IncrementalDaysParser(), text, 6) == DAYS
+
+
+def test_stops_after_plan_object():
+    text = PLAN_TEXT + '\n另一个示例: {"days": [{"dayNumber": 3}]}'
+    parser = IncrementalDaysParser()
+    assert feed_in_chunks(parser, text, 8) == DAYS
+    assert parser.emitted == 2
+
+
+def test_truncated_output_emits_only_complete_days():
+    truncated = PLAN_TEXT[:PLAN_TEXT.index('飞来峰')]
+    parser = IncrementalDaysParser()
+    assert feed_in_chunks(parser, truncated, 10) == DAYS[:1]
+    assert parser.emitted == 1
+
+
+def test_custom_array_key():
+    text = json.dumps({'items': [{'a': 1}, {'a': 2}]})
+    assert feed_in_chunks(IncrementalDaysParser(array_key='items'), text, 2) == [{'a': 1}, {'a': 2}]
+
+
+def test_empty_chunk():
+    assert IncrementalDaysParser().feed('') == []
@@ -0,0 +1,95 @@
+# tests/test_pagination.py
+import datetime
+
+import pytest
+from bson import ObjectId
+
+from app.utils.pagination import (
+    MAX_PAGE_SIZE, cursor_filter, decode_cursor, encode_cursor, keyset_filter, page_size, split_page,
+)
+
+
+def test_cursor_round_trip():
+    values = ['rating', datetime.datetime(2026, 1, 2, 3, 4, 5), ObjectId(), None, 4.5]
+    cursor = encode_cursor(values)
+    assert '=' not in cursor
+    decoded = decode_cursor(cursor, size=5)
+    assert decoded[0] == 'rating' and decoded[2:] == values[2:]
+    assert decoded[1].replace(tzinfo=None) == values[1]
+
+
+@pytest.mark.parametrize('cursor', ['不是游标', '!!!', encode_cursor([1, 2])[:-2]])
+def test_decode_invalid_cursor(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
+
+
+def test_decode_cursor_size_mismatch():
+    with pytest.raises(ValueError):
+        decode_cursor(encode_cursor([1, 2]), size=3)
+
+
+def test_cursor_filter_tag():
+    sort = [('rating', -1), ('_id', -1)]
+    oid = ObjectId()
+    assert cursor_filter(encode_cursor(['rating', 4, oid]), sort, tag='rating') == keyset_filter(sort, [4, oid])
+    with pytest.raises(ValueError):
+        cursor_filter(encode_cursor(['newest', 4, oid]), sort, tag='rating')
+
+
+def test_keyset_filter_descending():
+    oid = ObjectId()
+    assert keyset_filter([('timestamp', -1), ('_id', -1)], [5, oid]) == {'$or': [
+        {'$or': [{'timestamp': {'$lt': 5}}, {'timestamp': None}]},
+        {'timestamp': 5, '$or': [{'_id': {'$lt': oid}}, {'_id': None}]},
+    ]}
+
+
+def test_keyset_filter_null_values():
+    oid = ObjectId()
+    # 降序时 null 排在最后: 之后只有同为 null 且 _id 更小的文档
+    assert keyset_filter([('rating', -1), ('_id', -1)], [None, oid]) == {
+        'rating': None, '$or': [{'_id': {'$lt': oid}}, {'_id': None}],
+    }
+    # 升序时 null 排在最前: 之后是所有非 null 的值
+    assert keyset_filter([('rating', 1), ('_id', 1)], [None, oid]) == {'$or': [
+        {'rating': {'$ne': None}},
+        {'rating': None, '_id': {'$gt': oid}},
+    ]}
+
+
+def test_split_page():
+    docs = [{'_id': i, 'rating': 10 - i} for i in range(4)]
+    sort = [('rating', -1), ('_id', -1)]
+    assert split_page(docs, sort, 4) == (docs, None)
+    page, cursor = split_page(docs, sort, 3, tag='rating')
+    assert page == docs[:3]
+    assert decode_cursor(cursor) == ['rating', 8, 2]
+
+
+@pytest.mark.parametrize('value, expected', [
+    (None, 20), ('', 20), ('abc', 20), ('5', 5), (0, 1), (-3, 1), (str(MAX_PAGE_SIZE + 1), MAX_PAGE_SIZE),
+])
+def test_page_size(value, expected):
+    assert page_size(value) == expected
+
+
+@pytest.mark.parametrize('direction', [1, -1])
+def test_pages_cover_null_and_missing_sort_keys(direction):
+    mongomock = pytest.importorskip('mongomock')
+    collection = mongomock.MongoClient().db.items
+    docs = [{'rating': value} for value in (3, None, 5, 3, None, 1, 5, None)]
+    docs += [{}, {}]  # 缺少排序字段
+    collection.insert_many(docs)
+    sort = [('rating', direction), ('_id', direction)]
+
+    seen, cursor = [], None
+    for _ in range(len(docs) + 1):
+        query = cursor_filter(cursor, sort) if cursor else {}
+        page, cursor = split_page(list(collection.find(query).sort(sort).limit(4)), sort, 3)
+        seen.extend(page)
+        if cursor is None:
+            break
+
+    expected = list(collection.find().sort(sort))
+    assert [doc['_id'] for doc in seen] == [doc['_id'] for doc in expected]
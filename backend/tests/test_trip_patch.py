@@ -0,0 +1,109 @@
+# tests/test_trip_patch.py
+import pytest
+
+from app.utils.text_numbers import parse_number
+from app.utils.trip_patch import PatchScopeError, apply_trip_patch, select_target_days
+
+
+def make_plan(total):
+    return {
+        'name': '北京之旅',
+        'days': [
+            {'dayNumber': n, 'title': f'第{n}天', 'activities': [{'title': f'活动{n}', 'location': f'地点{n}'}]}
+            for n in range(1, total + 1)
+        ],
+    }
+
+
+PLAN = make_plan(5)
+PLAN['days'][1]['activities'][0].update(title='故宫', location='故宫博物院')
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('3', 3), ('三', 3), ('两', 2), ('十', 10), ('十二', 12), ('二十', 20), ('二十五', 25), ('x', None), (None, None),
+])
+def test_parse_number(text, expected):
+    assert parse_number(text) == expected
+
+
+@pytest.mark.parametrize('instruction, expected', [
+    ('把第3天换成室内活动', [3]),
+    ('第三天下雨', [3]),
+    ('第2-3天安排轻松一点', [2, 3]),
+    ('第二到四天少走路', [2, 3, 4]),
+    ('第4至2天', [2, 3, 4]),
+    ('Day 4 改成购物', [4]),
+    ('d5 早点结束', [5]),
+    ('第二天day4都改一下', [2, 4]),
+    ('最后一天去机场', [5]),
+    ('最后两天放松', [4, 5]),
+    ('返程日不要安排景点', [5]),
+    ('前两天慢一点', [1, 2]),
+    ('首日晚点出发', [1]),
+    ('把故宫换成颐和园', [2]),
+    ('第9天', []),
+    ('整体预算降低', []),
+])
+def test_select_target_days(instruction, expected):
+    assert select_target_days(PLAN, instruction) == expected
+
+
+def test_select_target_days_ignores_words_containing_day():
+    assert select_target_days(PLAN, 'today 和 birthday2 都不是天数') == []
+
+
+def test_select_target_days_empty_plan():
+    assert select_target_days({'days': []}, '第1天') == []
+    assert select_target_days(PLAN, '') == []
+
+
+def test_apply_patch_replace_remove_add():
+    patch = {'operations': [
+        {'op': 'replace_day', 'dayNumber': 2, 'day': {'title': '颐和园'}},
+        {'op': 'remove_day', 'dayNumber': 3},
+        {'op': 'add_day', 'dayNumber': 6, 'day': {'title': '新的一天'}},
+        {'op': 'set', 'field': 'name', 'value': '北京慢游'},
+    ]}
+    result = apply_trip_patch(PLAN, patch)
+    assert result['name'] == '北京慢游'
+    assert [day['title'] for day in result['days']] == ['第1天', '颐和园', '第4天', '第5天', '新的一天']
+    assert [day['dayNumber'] for day in result['days']] == [1, 2, 3, 4, 5]
+    # 不修改传入的行程
+    assert PLAN['name'] == '北京之旅' and len(PLAN['days']) == 5
+
+
+def test_apply_patch_add_day_after_removed_day():
+    patch = {'operations': [
+        {'op': 'remove_day', 'dayNumber': 1},
+        {'op': 'add_day', 'dayNumber': 2, 'day': {'title': '替代'}},
+    ]}
+    result = apply_trip_patch(make_plan(2), patch)
+    assert [day['title'] for day in result['days']] == ['替代', '第2天']
+
+
+def test_apply_patch_chinese_day_number():
+    patch = {'operations': [{'op': 'replace_day', 'dayNumber': '二', 'day': {'title': '颐和园'}}]}
+    assert apply_trip_patch(PLAN, patch)['days'][1]['title'] == '颐和园'
+
+
+def test_apply_patch_out_of_scope():
+    patch = {'operations': [{'op': 'remove_day', 'dayNumber': 4}]}
+    with pytest.raises(PatchScopeError):
+        apply_trip_patch(PLAN, patch, affected_days=[2, 3])
+    # add_day 不受范围限制
+    patch = {'operations': [{'op': 'add_day', 'dayNumber': 6, 'day': {'title': '加一天'}}]}
+    assert len(apply_trip_patch(PLAN, patch, affected_days=[5])['days']) == 6
+
+
+@pytest.mark.parametrize('patch', [
+    {},
+    {'operations': [{'op': 'rename_day', 'dayNumber': 1}]},
+    {'operations': [{'op': 'set', 'field': 'days', 'value': []}]},
+    {'operations': [{'op': 'replace_day', 'dayNumber': 9, 'day': {}}]},
+    {'operations': [{'op': 'replace_day', 'dayNumber': 1}]},
+    {'operations': [{'op': 'remove_day'}]},
+    {'operations': [{'op': 'remove_day', 'dayNumber': 1}, {'op': 'remove_day', 'dayNumber': 1}]},
+])
+def test_apply_patch_invalid(patch):
+    with pytest.raises(ValueError):
+        apply_trip_patch(PLAN, patch)